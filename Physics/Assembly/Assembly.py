@@ -0,0 +1,306 @@
+from ..DoFHandler.DoFHandler import DoFHandler
+from ..Geometry.GeometricFactors import mappingTables, jacobians
+from ..LinearAlgebra.LinearAlgebra import ParallelLayout, ContributionExchange, DistributedMatrix, DistributedVector
+from numpy import asarray, einsum, empty, stack, zeros, repeat, tile, arange, searchsorted, bincount, diff, \
+    unique, concatenate, cumsum, lexsort
+from scipy.sparse import coo_array
+
+
+class ElementAssembler():
+    '''Batched element integrals over every local cell of a DoFHandler
+
+    Each term (stiffness, mass, source) is integrated with quadrature.rule(term). With
+    affineFastPath the stiffness of parallelogram cells, whose Jacobian is constant, is the
+    reference stiffness per metric component scaled by the cell's metric. quadrature replaces
+    the DoFHandler's rule (same order), e.g. to share the points of several fields'''
+
+    def __init__(self, dofs: DoFHandler, affineFastPath=True, tolerance=1.0e-12, quadrature=None):
+        self._dofs = dofs
+        self._geom = dofs.geometry
+        self._quad = dofs.quadrature if quadrature is None else quadrature
+        assert self._quad.order == dofs.quadrature.order, "Quadrature order must match the DoFHandler"
+        self._ordering = dofs.localBasisOrdering
+        self._terms = {}
+
+        # Reference tables at all quadrature points, columns in DoF connectivity order
+        self._points, self._weights, self._shape, self._grad = self.__tables(self._quad)
+        # Odd edge modes follow the global edge orientation
+        self._signs = dofs.basisSigns
+
+        self._affine = self.__affineElements(tolerance) if affineFastPath else zeros(self.nElements, dtype=bool)
+
+    @property
+    def nElements(self):
+        return len(self._geom.localConnectivity)
+
+    @property
+    def nQuadraturePoints(self):
+        return len(self._weights)
+
+    @property
+    def signs(self):
+        '''Sign (nElem, nBasis) of every element basis function'''
+        return self._signs
+
+    @property
+    def affineElements(self):
+        '''Mask of the local cells treated as parallelograms by the stiffness fast path'''
+        return self._affine
+
+    def __tables(self, quad):
+        ordering = self._ordering
+        return quad.points, quad.weights, quad.shapeValues[:, ordering], quad.shapeGradients[:, ordering, :]
+
+    def termQuadrature(self, term):
+        if term not in self._terms:
+            quad = self._quad.rule(term)
+            self._terms[term] = (quad,) + self.__tables(quad)
+        return self._terms[term]
+
+    def __affineElements(self, tolerance):
+        # Parallelograms have v0 + v2 = v1 + v3
+        coords = self.elementCoordinates()
+        size = abs(coords - coords.mean(axis=1)[:,None,:]).max(axis=(1,2))
+        return abs(coords[:,0] + coords[:,2] - coords[:,1] - coords[:,3]).max(axis=1) <= tolerance*size
+
+    def elementCoordinates(self):
+        '''Return (nElem, 4, 2) vertex coordinates of the local cells'''
+        return self._geom.localCoordinates
+
+    def mappingTables(self, term=None):
+        '''Return bilinear map values (nq, 4) and reference gradients (nq, 4, 2)'''
+        points = self._points if term is None else self.termQuadrature(term)[1]
+        return mappingTables(points)
+
+    def jacobians(self, coords=None, term=None):
+        '''Return J (nElem, nq, 2, 2), detJ (nElem, nq) and J^{-1} (nElem, nq, 2, 2)
+
+        J[e,q,a,b] = dx_b/dxi_a, matching MeshCell2D.getJacobian. Without coords the factors
+        cached on the geometry are returned'''
+        if coords is not None:
+            points = self._points if term is None else self.termQuadrature(term)[1]
+            return jacobians(coords, points)
+        factors = self.geometricFactors(term)
+        return factors.jacobian, factors.detJ, factors.invJ
+
+    def geometricFactors(self, term=None):
+        quad = self._quad if term is None else self.termQuadrature(term)[0]
+        factors = self._geom.geometricFactors(quad)
+        assert len(factors.invalidElements) == 0, f"{len(factors.invalidElements)} inverted or degenerate local cells"
+        return factors
+
+    def physicalLocations(self, coords=None, term=None):
+        '''Return (nElem, nq, 2) physical coordinates of every quadrature point'''
+        coords = self.elementCoordinates() if coords is None else coords
+        values, _ = self.mappingTables(term)
+        return einsum("qv,evb->eqb", values, coords)
+
+    def stiffnessMatrices(self, coefficient=None):
+        '''Return local stiffness matrices (nElem, nBasis, nBasis)
+
+        coefficient is an optional (nElem, nq) array scaling the integrand at the points of the
+        stiffness rule; it disables the affine fast path'''
+        quad, _, weights, _, grad = self.termQuadrature("stiffness")
+        K = empty((self.nElements, len(self._ordering), len(self._ordering)))
+        affine = self._affine if coefficient is None else zeros(self.nElements, dtype=bool)
+        if affine.any():
+            K[affine] = self.__affineStiffness(affine, weights, grad)
+
+        general = ~affine
+        if general.any():
+            factors = self.geometricFactors("stiffness")
+            scale = factors.detJ[general] * weights
+            if coefficient is not None:
+                scale = scale * asarray(coefficient)[general]
+
+            # grad_x u . grad_x v = grad_xi u . G grad_xi v with the cached metric G
+            metricGrad = einsum("eqab,qnb->eqna", factors.metric[general], grad, optimize=True)
+            K[general] = einsum("qna,eqma,eq->enm", grad, metricGrad, scale, optimize=True)
+        return K * self._signs[:,:,None] * self._signs[:,None,:]
+
+    def __affineStiffness(self, affine, weights, grad):
+        # Constant J from the edge vectors at the cell centre; reference matrices per metric entry
+        coords = self.elementCoordinates()[affine]
+        J = stack([coords[:,1] - coords[:,0], coords[:,3] - coords[:,0]], axis=1) * 0.5
+        detJ = J[:,0,0]*J[:,1,1] - J[:,0,1]*J[:,1,0]
+        assert (detJ > 0.0).all(), f"{(detJ <= 0.0).sum()} inverted or degenerate local cells"
+        # detJ G = adj(J) adj(J)^T / detJ for G = J^{-1}J^{-T} in this convention
+        G = empty((len(coords), 2, 2))
+        G[:,0,0] = (J[:,1,0]**2 + J[:,1,1]**2) / detJ
+        G[:,1,1] = (J[:,0,0]**2 + J[:,0,1]**2) / detJ
+        G[:,0,1] = G[:,1,0] = -(J[:,0,0]*J[:,1,0] + J[:,0,1]*J[:,1,1]) / detJ
+        reference = einsum("q,qna,qmb->abnm", weights, grad, grad)
+        return einsum("eab,abnm->enm", G, reference, optimize=True)
+
+    def massMatrices(self, coefficient=None):
+        '''Return local mass matrices (nElem, nBasis, nBasis) with the mass rule'''
+        _, _, weights, shape, _ = self.termQuadrature("mass")
+        scale = self.geometricFactors("mass").detJ * weights
+        if coefficient is not None:
+            scale = scale * asarray(coefficient)
+        M = einsum("qn,qm,eq->enm", shape, shape, scale, optimize=True)
+        return M * self._signs[:,:,None] * self._signs[:,None,:]
+
+    def mixedMassMatrices(self, trial, coefficient=None):
+        '''Return int c b_i d_j (nElem, nBasis, nBasis_trial) coupling this assembler's basis b
+        to the basis d of another ElementAssembler on the same cells and mass rule points'''
+        _, _, weights, shape, _ = self.termQuadrature("mass")
+        _, _, trialWeights, trialShape, _ = trial.termQuadrature("mass")
+        assert len(trialWeights) == len(weights), "Mixed mass matrices need a shared quadrature rule"
+        scale = self.geometricFactors("mass").detJ * weights
+        if coefficient is not None:
+            scale = scale * asarray(coefficient)
+        M = einsum("qn,qm,eq->enm", shape, trialShape, scale, optimize=True)
+        return M * self._signs[:,:,None] * trial.signs[:,None,:]
+
+    def rhsVectors(self, source):
+        '''Return local load vectors (nElem, nBasis) for source(x, y) evaluated on arrays'''
+        xq = self.physicalLocations(term="source")
+        return self.loadVectors(source(xq[...,0], xq[...,1]), term="source")
+
+    def loadVectors(self, values, term="source"):
+        '''Return int b_i Q (nElem, nBasis) for Q given at the points of term (nElem, nq)'''
+        _, _, weights, shape, _ = self.termQuadrature(term)
+        Q = asarray(values) * self.geometricFactors(term).detJ * weights
+        return einsum("qn,eq->en", shape, Q) * self._signs
+
+    # Residual-form kernels: element coefficients u (nElem, nBasis) multiply the signed basis
+    def elementValues(self, u):
+        '''Element coefficients (nElem, nBasis) of values u on the DoFHandler local DoFs'''
+        return asarray(u)[self._dofs.dofConnectivity] * self._signs
+
+    def interpolate(self, elementValues, term="stiffness"):
+        '''Return values (nElem, nq) and physical gradients (nElem, nq, 2) at the points of term'''
+        _, _, _, shape, grad = self.termQuadrature(term)
+        gradXi = einsum("qnb,en->eqb", grad, elementValues)
+        return elementValues @ shape.T, einsum("eqab,eqb->eqa", self.geometricFactors(term).invJ, gradXi)
+
+    def diffusionVectors(self, elementValues, coefficient=None, term="stiffness"):
+        '''Return int c grad b_i . grad u (nElem, nBasis), the stiffness action without matrices'''
+        _, _, weights, _, grad = self.termQuadrature(term)
+        factors = self.geometricFactors(term)
+        scale = factors.detJ * weights
+        if coefficient is not None:
+            scale = scale * asarray(coefficient)
+        gradXi = einsum("qnb,en->eqb", grad, elementValues)
+        flux = einsum("eqab,eqb->eqa", factors.metric, gradXi) * scale[...,None]
+        return einsum("qna,eqa->en", grad, flux) * self._signs
+
+    def gradientValueMatrices(self, vector, term="stiffness"):
+        '''Return int (w . grad b_i) b_j (nElem, nBasis, nBasis) for w (nElem, nq, 2)'''
+        _, _, weights, shape, grad = self.termQuadrature(term)
+        factors = self.geometricFactors(term)
+        # w . grad_x b = (invJ^T w) . grad_xi b
+        w = einsum("eqac,eqa->eqc", factors.invJ, vector) * (factors.detJ * weights)[...,None]
+        M = einsum("eqc,qnc,qm->enm", w, grad, shape, optimize=True)
+        return M * self._signs[:,:,None] * self._signs[:,None,:]
+
+class GlobalAssembler():
+    '''Scatter element contributions into the global matrix and RHS without per-entry Python work'''
+
+    def __init__(self, dofs: DoFHandler):
+        self._dofs = dofs
+        self._size = dofs.globalDoFsize
+
+        # Global (renumbered) DoFs of every local element and the flat (row, col) pairs
+        connectivity = asarray(dofs.dofConnectivity, dtype="int64").reshape(-1, dofs.dofsPerElement)
+        self._elementDoFs = asarray(dofs.dofMap)[connectivity]
+        nBasis = self._elementDoFs.shape[1]
+        self._rows = repeat(self._elementDoFs, nBasis, axis=1).ravel()
+        self._cols = tile(self._elementDoFs, (1, nBasis)).ravel()
+        self._scatterMap = None
+
+    @property
+    def elementDoFs(self):
+        return self._elementDoFs
+
+    def assembleMatrix(self, localMatrices):
+        '''Build the CSR matrix from COO triplets with a single sum-duplicates pass'''
+        A = coo_array((asarray(localMatrices).ravel(), (self._rows, self._cols)), shape=(self._size, self._size)).tocsr()
+        A.sum_duplicates()
+        return A
+
+    def assembleMatrixInPattern(self, localMatrices):
+        '''Scatter into the data array of the DoFHandler sparsity through the element-to-nnz map'''
+        if self._scatterMap is None:
+            self._scatterMap = self.buildScatterMap()
+        A = self._dofs.sparsityTemplate()
+        A.data[:] = bincount(self._scatterMap, weights=asarray(localMatrices).ravel(), minlength=len(A.data))
+        return A
+
+    def assembleVector(self, localVectors):
+        return bincount(self._elementDoFs.ravel(), weights=asarray(localVectors).ravel(), minlength=self._size)
+
+    def buildScatterMap(self):
+        '''Return the position in the sparsity data array of every element matrix entry'''
+        rowPtr, colIndices = self._dofs.sparsity
+        patternRows = repeat(arange(self._size), diff(rowPtr))
+
+        # Pattern keys row*N+col are sorted since columns are sorted within each row
+        keys = patternRows.astype("int64")*self._size + colIndices
+        entryKeys = self._rows.astype("int64")*self._size + self._cols
+        pos = searchsorted(keys, entryKeys)
+        assert (pos < len(keys)).all() and (keys[pos.clip(max=len(keys)-1)] == entryKeys).all(), \
+            "Element entries missing from sparsity. Call DoFHandler.buildSparsity() after renumbering"
+        return pos
+
+class DistributedAssembler():
+    '''Assemble owned rows on every proc, reducing off-proc element contributions to their owners
+
+    The communication pattern and the owned-row sparsity are fixed at construction; repeated
+    assemblies only send values'''
+
+    def __init__(self, dofs: DoFHandler):
+        comm = dofs.geometry.mpiComm
+        size = dofs.globalDoFsize
+        ranges = dofs.ownershipRanges
+        start, end = dofs.ownedRange
+
+        connectivity = asarray(dofs.dofConnectivity, dtype="int64").reshape(-1, dofs.dofsPerElement)
+        elementDoFs = asarray(dofs.dofMap)[connectivity]
+        nBasis = elementDoFs.shape[1]
+        rows = repeat(elementDoFs, nBasis, axis=1).ravel()
+        keys = rows*size + tile(elementDoFs, (1, nBasis)).ravel()
+        rowOwner = searchsorted(ranges, rows, side="right") - 1
+        self._matrixExchange = ContributionExchange(comm, rowOwner, keys)
+
+        # Owned-row pattern from local and received couplings; ghost columns define the layout
+        ownedKeys = unique(concatenate([keys[self._matrixExchange.localEntries], self._matrixExchange.receivedKeys]))
+        patternRows, patternCols = ownedKeys // size - start, ownedKeys % size
+        self._layout = ParallelLayout(comm, ranges, patternCols[(patternCols < start) | (patternCols >= end)])
+        localCols = self._layout.globalToLocal(patternCols)
+        order = lexsort((localCols, patternRows))
+        position = empty(len(order), dtype="int64")
+        position[order] = arange(len(order))
+        self._indptr = concatenate([[0], cumsum(bincount(patternRows, minlength=end-start))])
+        self._indices = localCols[order]
+        self._matrixLocal = position[searchsorted(ownedKeys, keys[self._matrixExchange.localEntries])]
+        self._matrixReceived = position[searchsorted(ownedKeys, self._matrixExchange.receivedKeys)]
+
+        vectorRows = elementDoFs.ravel()
+        self._vectorExchange = ContributionExchange(comm, searchsorted(ranges, vectorRows, side="right") - 1, vectorRows)
+        self._vectorLocal = vectorRows[self._vectorExchange.localEntries] - start
+        self._vectorReceived = self._vectorExchange.receivedKeys - start
+
+    @property
+    def layout(self):
+        return self._layout
+
+    def assembleMatrix(self, localMatrices):
+        '''Return the DistributedMatrix of the element matrices (nElem, nBasis, nBasis)'''
+        values = asarray(localMatrices).ravel()
+        handle = self._matrixExchange.begin(values)
+        nnz = len(self._indices)
+        data = bincount(self._matrixLocal, weights=values[self._matrixExchange.localEntries], minlength=nnz)
+        data += bincount(self._matrixReceived, weights=self._matrixExchange.end(handle), minlength=nnz)
+        return DistributedMatrix(self._layout, self._indptr, self._indices, data)
+
+    def assembleVector(self, localVectors):
+        '''Return the DistributedVector of the element vectors (nElem, nBasis)'''
+        values = asarray(localVectors).ravel()
+        handle = self._vectorExchange.begin(values)
+        nOwned = self._layout.nOwned
+        result = DistributedVector(self._layout)
+        result.owned[:] = bincount(self._vectorLocal, weights=values[self._vectorExchange.localEntries], minlength=nOwned)
+        result.owned[:] += bincount(self._vectorReceived, weights=self._vectorExchange.end(handle), minlength=nOwned)
+        return result
@@ -0,0 +1,221 @@
+from ..BoundaryConditions.BoundaryConditions import DirichletCondition
+from ..DoFHandler.BlockDoFHandler import BlockDoFHandler
+from ..LinearAlgebra.LinearAlgebra import ParallelLayout, DistributedVector
+from ..Quadrature.Quadrature import Quadrature2D
+from .Assembly import ElementAssembler, DistributedAssembler
+from numpy import zeros
+
+class CoupledProblem():
+    '''Residual and Jacobian of several fields on one mesh, assembled as one block system
+
+    Every field gets an ElementAssembler on a shared Gauss rule with the points of its highest
+    order field, so one pass over the cells evaluates the basis tables of all fields against
+    the same geometric factors. Subclasses provide the element kernels
+
+        elementResidual(name, values) -> (nElem, nBasis_name)
+        elementJacobian(row, col, values) -> (nElem, nBasis_row, nBasis_col) or None for a zero block
+
+    where values maps every field to its element coefficients, values and gradients at the
+    quadrature points. dirichlet maps field names to their DirichletCondition'''
+
+    def __init__(self, dofs: BlockDoFHandler, dirichlet=None):
+        self._dofs = dofs
+        nPoints = max(dofs.field(name).quadrature.nPoints for name in dofs.fields)
+        self._elements = {name: ElementAssembler(dofs.field(name), quadrature=Quadrature2D(order=dofs.field(name).quadrature.order, nPoints=nPoints))
+                          for name in dofs.fields}
+        self._assembler = DistributedAssembler(dofs)
+        self._fieldAssemblers = {}
+        self._dirichlet = {} if dirichlet is None else dict(dirichlet)
+        self._blockDirichlet = DirichletCondition.combine(dofs, self._dirichlet)
+
+        # Element gathers of all fields through one halo exchange on the block DoF layout
+        self._dofLayout = ParallelLayout(dofs.geometry.mpiComm, dofs.ownershipRanges, dofs.dofMap[dofs.nOwnedDoFs:])
+        self._toDoFLayout = self._dofLayout.globalToLocal(dofs.dofMap)
+        self._residualEvaluations = 0
+        self._jacobianEvaluations = 0
+
+    @property
+    def dofs(self):
+        return self._dofs
+
+    @property
+    def fields(self):
+        return self._dofs.fields
+
+    @property
+    def layout(self):
+        return self._assembler.layout
+
+    @property
+    def residualEvaluations(self):
+        return self._residualEvaluations
+
+    @property
+    def jacobianEvaluations(self):
+        return self._jacobianEvaluations
+
+    def element(self, name):
+        return self._elements[name]
+
+    def dirichlet(self, name):
+        return self._dirichlet.get(name)
+
+    def fieldAssembler(self, name):
+        '''DistributedAssembler of a single field, built on first use'''
+        if name not in self._fieldAssemblers:
+            self._fieldAssemblers[name] = DistributedAssembler(self._dofs.field(name))
+        return self._fieldAssemblers[name]
+
+    def elementResidual(self, name, values):
+        raise NotImplementedError("CoupledProblem must implement elementResidual(name, values)")
+
+    def elementJacobian(self, row, col, values):
+        raise NotImplementedError("CoupledProblem must implement elementJacobian(row, col, values)")
+
+    def createVector(self, value=0.0):
+        '''Block vector filled with value (a constant or one per field) and the Dirichlet values imposed'''
+        x = DistributedVector(self.layout)
+        for name in self.fields:
+            x.owned[self._dofs.ownedPositions(name)] = value[name] if isinstance(value, dict) else value
+        return self._blockDirichlet.impose(x)
+
+    def fieldValues(self, x: DistributedVector):
+        '''Return {field: (element coefficients, values, gradients)} at the shared quadrature points'''
+        u = DistributedVector(self._dofLayout)
+        u.owned[:] = x.owned
+        u.updateGhosts()
+        local = u.values[self._toDoFLayout]
+        values = {}
+        for name in self.fields:
+            element = self._elements[name]
+            elementValues = element.elementValues(local[self._dofs.localIndices(name)])
+            values[name] = (elementValues,) + element.interpolate(elementValues)
+        return values
+
+    def residual(self, x: DistributedVector, F: DistributedVector = None):
+        self._residualEvaluations += 1
+        values = self.fieldValues(x)
+        local = zeros((len(self._dofs.dofConnectivity), self._dofs.dofsPerElement))
+        for name in self.fields:
+            local[:, self._dofs.slots(name)] = self.elementResidual(name, values)
+        result = self._assembler.assembleVector(local)
+        F = result if F is None else F
+        F.owned[:] = result.owned
+        self._blockDirichlet.constrainResidual(x, F)
+        return F
+
+    def jacobian(self, x: DistributedVector):
+        self._jacobianEvaluations += 1
+        values = self.fieldValues(x)
+        nBasis = self._dofs.dofsPerElement
+        local = zeros((len(self._dofs.dofConnectivity), nBasis, nBasis))
+        for row in self.fields:
+            for col in self.fields:
+                block = self.elementJacobian(row, col, values)
+                if block is not None:
+                    local[:, self._dofs.slots(row), self._dofs.slots(col)] = block
+        J = self._assembler.assembleMatrix(local)
+        self._blockDirichlet.apply(J)
+        return J
+
+    def fieldProblem(self, name, x: DistributedVector):
+        return FieldProblem(self, name, x)
+
+class FieldProblem():
+    '''One field of a CoupledProblem with the other fields frozen at their values in x
+
+    Residual and Jacobian are the field's rows and diagonal block on the layout of its own
+    assembler, so solving this problem is one operator-split (Picard) step for the field'''
+
+    def __init__(self, coupled: CoupledProblem, name, x: DistributedVector):
+        self._coupled, self._name, self._x = coupled, name, x
+        dofs = coupled.dofs.field(name)
+        self._element = coupled.element(name)
+        self._assembler = coupled.fieldAssembler(name)
+        self._dirichlet = coupled.dirichlet(name)
+        self._positions = coupled.dofs.ownedPositions(name)
+        self._frozen = coupled.fieldValues(x)
+
+        self._dofLayout = ParallelLayout(dofs.geometry.mpiComm, dofs.ownershipRanges, dofs.dofMap[dofs.nOwnedDoFs:])
+        self._toDoFLayout = self._dofLayout.globalToLocal(dofs.dofMap)
+
+    @property
+    def layout(self):
+        return self._assembler.layout
+
+    def createVector(self, value=None):
+        '''Field vector holding the field's values in x, or value, with the Dirichlet values imposed'''
+        xf = DistributedVector(self.layout)
+        xf.owned[:] = self._x.owned[self._positions] if value is None else value
+        if self._dirichlet is not None:
+            self._dirichlet.impose(xf)
+        return xf
+
+    def update(self, xf: DistributedVector, relaxation=1.0):
+        '''Copy a field solution into the coupled vector, relaxed against its previous values'''
+        previous = self._x.owned[self._positions]
+        self._x.owned[self._positions] = (1.0 - relaxation)*previous + relaxation*xf.owned
+        return self._x
+
+    def __values(self, xf):
+        u = DistributedVector(self._dofLayout)
+        u.owned[:] = xf.owned
+        u.updateGhosts()
+        elementValues = self._element.elementValues(u.values[self._toDoFLayout])
+        return {**self._frozen, self._name: (elementValues,) + self._element.interpolate(elementValues)}
+
+    def residual(self, xf: DistributedVector, F: DistributedVector = None):
+        result = self._assembler.assembleVector(self._coupled.elementResidual(self._name, self.__values(xf)))
+        F = result if F is None else F
+        F.owned[:] = result.owned
+        if self._dirichlet is not None:
+            self._dirichlet.constrainResidual(xf, F)
+        return F
+
+    def jacobian(self, xf: DistributedVector):
+        J = self._assembler.assembleMatrix(self._coupled.elementJacobian(self._name, self._name, self.__values(xf)))
+        if self._dirichlet is not None:
+            self._dirichlet.apply(J)
+        return J
+
+class HeatGeneration(CoupledProblem):
+    '''Temperature T heated by a diffusing, temperature dependent reacting species S
+
+        -div(k(T) grad T) = h S
+        -div(D grad S) + r(T) S = f
+
+    on a BlockDoFHandler with fields "temperature" and "source". h and D are constants, f a
+    constant or f(x, y) evaluated on arrays'''
+
+    def __init__(self, dofs: BlockDoFHandler, conductivity, dConductivity, reaction, dReaction,
+                 heating=1.0, diffusivity=1.0, supply=0.0, dirichlet=None):
+        assert set(dofs.fields) == {"temperature", "source"}, "HeatGeneration needs the fields temperature and source"
+        super().__init__(dofs, dirichlet)
+        self._k, self._dk = conductivity, dConductivity
+        self._r, self._dr = reaction, dReaction
+        self._h, self._D = heating, diffusivity
+
+        # The supply does not depend on the fields
+        f = supply if callable(supply) else (lambda x, y, c=float(supply): c + 0.0*x)
+        self._supply = self.element("source").rhsVectors(f)
+
+    def elementResidual(self, name, values):
+        element = self.element(name)
+        elementT, T, _ = values["temperature"]
+        elementS, S, _ = values["source"]
+        if name == "temperature":
+            return element.diffusionVectors(elementT, self._k(T)) - element.loadVectors(self._h*S)
+        return element.diffusionVectors(elementS, self._D) + element.loadVectors(self._r(T)*S) - self._supply
+
+    def elementJacobian(self, row, col, values):
+        _, T, gradT = values["temperature"]
+        _, S, _ = values["source"]
+        temperature, source = self.element("temperature"), self.element("source")
+        if (row, col) == ("temperature", "temperature"):
+            return temperature.stiffnessMatrices(self._k(T)) + \
+                temperature.gradientValueMatrices(self._dk(T)[...,None] * gradT)
+        if (row, col) == ("temperature", "source"):
+            return -self._h * temperature.mixedMassMatrices(source)
+        if (row, col) == ("source", "temperature"):
+            return source.mixedMassMatrices(temperature, self._dr(T)*S)
+        return self._D * source.stiffnessMatrices() + source.massMatrices(self._r(T))
@@ -0,0 +1,102 @@
+from ..DoFHandler.DoFHandler import DoFHandler
+from ..LinearAlgebra.LinearAlgebra import ParallelLayout, ContributionExchange, DistributedVector
+from .Assembly import ElementAssembler
+from numpy import asarray, ascontiguousarray, bincount, einsum, empty
+
+class MatrixFreeLaplacian():
+    '''Action of the assembled stiffness operator without forming element or global matrices
+
+    Element values are interpolated to the quadrature points and tested back by sum
+    factorization over the 1D tables (two small contractions per direction instead of one dense
+    nBasis x nBasis product). Only the geometric factors at quadrature points are stored.
+    Vectors live on the DoFHandler layout: owned DoFs followed by the DoFHandler ghosts'''
+
+    def __init__(self, dofs: DoFHandler, coefficient=None):
+        comm = dofs.geometry.mpiComm
+        quad = dofs.quadrature
+        self._B = asarray(quad.shapeValues1D)
+        self._D = asarray(quad.shapeGradients1D)
+        self._nq, self._nb = self._B.shape
+
+        # Symmetric metric scale * J^{-T} J^{-1} at every quadrature point (nElem, nq, nq, 2, 2)
+        factors = ElementAssembler(dofs).geometricFactors()
+        scale = factors.detJ * quad.weights
+        if coefficient is not None:
+            scale = scale * asarray(coefficient)
+        metric = (factors.metric * scale[...,None,None]).reshape(-1, self._nq, self._nq, 2, 2)
+        self._G00, self._G01, self._G11 = [ascontiguousarray(metric[...,a,b]) for a,b in ((0,0), (0,1), (1,1))]
+
+        # Element slots in tensor order, as indices into the layout (owned then ghosts)
+        nOwned = dofs.nOwnedDoFs
+        self._layout = ParallelLayout(comm, dofs.ownershipRanges, dofs.dofMap[nOwned:])
+        local = self._layout.globalToLocal(dofs.dofMap)
+        tensorSlot = empty(dofs.dofsPerElement, dtype="int64")
+        tensorSlot[dofs.localBasisOrdering] = range(dofs.dofsPerElement)
+        self._elementDoFs = local[asarray(dofs.dofConnectivity)[:, tensorSlot]]
+        self._signs = dofs.basisSigns[:, tensorSlot]
+
+        # Ghost rows are summed onto their owners
+        ghosts = self._layout.ghosts
+        self._exchange = ContributionExchange(comm, self._layout.owners(ghosts), ghosts)
+        self._received = self._exchange.receivedKeys - self._layout.ownedRange[0]
+
+    @property
+    def layout(self):
+        return self._layout
+
+    @property
+    def shape(self):
+        return self._layout.globalSize, self._layout.globalSize
+
+    @property
+    def nbytes(self):
+        '''Memory held by the operator (geometric factors and element DoF indices)'''
+        return self._G00.nbytes + self._G01.nbytes + self._G11.nbytes + self._elementDoFs.nbytes
+
+    def createVector(self):
+        return DistributedVector(self._layout)
+
+    def elementAction(self, u):
+        '''Apply every element operator to element coefficients u (nElem, nb, nb) in tensor order'''
+        B, D = self._B, self._D
+        # Reference gradients at quadrature points: contract eta, then xi
+        gradXi = contractFirst(D, contractSecond(B, u))
+        gradEta = contractFirst(B, contractSecond(D, u))
+
+        fluxXi = self._G00*gradXi + self._G01*gradEta
+        fluxEta = self._G01*gradXi + self._G11*gradEta
+
+        # Test against the gradients: contract xi, then eta
+        return contractSecond(B.T, contractFirst(D.T, fluxXi)) + contractSecond(D.T, contractFirst(B.T, fluxEta))
+
+    def diagonal(self):
+        '''Owned diagonal of the operator'''
+        B, D = self._B, self._D
+        local = einsum("eab,ai,bj->eij", self._G00, D*D, B*B) + \
+                einsum("eab,ai,bj->eij", 2.0*self._G01, D*B, B*D) + \
+                einsum("eab,ai,bj->eij", self._G11, B*B, D*D)
+        return self.__reduce(local.reshape(len(local), -1)).owned.copy()
+
+    def mult(self, x: DistributedVector, y: DistributedVector = None):
+        '''y = A x with a ghost update of x and a reduction of ghost rows to their owners'''
+        x.updateGhosts()
+        u = (x.values[self._elementDoFs] * self._signs).reshape(-1, self._nb, self._nb)
+        return self.__reduce(self.elementAction(u).reshape(len(u), -1) * self._signs, y)
+
+    def __reduce(self, elementValues, y=None):
+        y = self.createVector() if y is None else y
+        nOwned = self._layout.nOwned
+        local = bincount(self._elementDoFs.ravel(), weights=elementValues.ravel(), minlength=nOwned + self._layout.nGhosts)
+        handle = self._exchange.begin(local[nOwned:])
+        y.owned[:] = local[:nOwned]
+        y.owned[:] += bincount(self._received, weights=self._exchange.end(handle), minlength=nOwned)
+        return y
+
+# Batched 1D contractions as single large matrix products
+def contractSecond(M, X):
+    '''result[e,i,a] = sum_j M[a,j] X[e,i,j]'''
+    return (X.reshape(-1, X.shape[-1]) @ M.T).reshape(X.shape[0], X.shape[1], M.shape[0])
+
+def contractFirst(M, X):
+    '''result[e,a,j] = sum_i M[a,i] X[e,i,j]'''
+    return contractSecond(M, X.transpose(0, 2, 1)).transpose(0, 2, 1)
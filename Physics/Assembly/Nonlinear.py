@@ -0,0 +1,78 @@
+from ..DoFHandler.DoFHandler import DoFHandler
+from ..LinearAlgebra.LinearAlgebra import ParallelLayout, DistributedVector
+from .Assembly import ElementAssembler, DistributedAssembler
+
+class NonlinearDiffusion():
+    '''Residual and Jacobian of -div(k(T) grad T) = Q from Documentation/CoupledPhysics.tex
+
+    F_i = int k(T) grad b_i . grad T - int b_i Q
+    J_ij = int k(T) grad b_i . grad b_j + int k'(T) b_j grad b_i . grad T
+
+    Vectors live on the layout of the assembled Jacobian. With a DirichletCondition the
+    constrained rows of F hold T_c - g_c and the Jacobian is eliminated symmetrically'''
+
+    def __init__(self, dofs: DoFHandler, conductivity, dConductivity, source, dirichlet=None):
+        self._dofs = dofs
+        self._element = ElementAssembler(dofs)
+        self._assembler = DistributedAssembler(dofs)
+        self._k, self._dk = conductivity, dConductivity
+        self._dirichlet = dirichlet
+
+        # Element gathers need every DoF of the local cells, which the matrix layout may lack
+        self._dofLayout = ParallelLayout(dofs.geometry.mpiComm, dofs.ownershipRanges, dofs.dofMap[dofs.nOwnedDoFs:])
+        self._toDoFLayout = self._dofLayout.globalToLocal(dofs.dofMap)
+
+        # The source does not depend on T
+        g = source if callable(source) else (lambda x, y, c=float(source): c + 0.0*x)
+        self._load = self._element.rhsVectors(g)
+        self._residualEvaluations = 0
+        self._jacobianEvaluations = 0
+
+    @property
+    def layout(self):
+        return self._assembler.layout
+
+    @property
+    def residualEvaluations(self):
+        return self._residualEvaluations
+
+    @property
+    def jacobianEvaluations(self):
+        return self._jacobianEvaluations
+
+    def createVector(self, value=0.0):
+        '''Vector on the Jacobian layout filled with value and the Dirichlet values imposed'''
+        x = DistributedVector(self.layout)
+        x.owned[:] = value
+        if self._dirichlet is not None:
+            self._dirichlet.impose(x)
+        return x
+
+    def fieldAtQuadrature(self, x: DistributedVector):
+        '''Return element coefficients, T and grad T at the stiffness quadrature points'''
+        u = DistributedVector(self._dofLayout)
+        u.owned[:] = x.owned
+        u.updateGhosts()
+        elementValues = self._element.elementValues(u.values[self._toDoFLayout])
+        return (elementValues,) + self._element.interpolate(elementValues)
+
+    def residual(self, x: DistributedVector, F: DistributedVector = None):
+        self._residualEvaluations += 1
+        elementValues, T, _ = self.fieldAtQuadrature(x)
+        local = self._element.diffusionVectors(elementValues, self._k(T)) - self._load
+        result = self._assembler.assembleVector(local)
+        F = result if F is None else F
+        F.owned[:] = result.owned
+        if self._dirichlet is not None:
+            self._dirichlet.constrainResidual(x, F)
+        return F
+
+    def jacobian(self, x: DistributedVector):
+        self._jacobianEvaluations += 1
+        _, T, gradT = self.fieldAtQuadrature(x)
+        local = self._element.stiffnessMatrices(self._k(T)) + \
+            self._element.gradientValueMatrices(self._dk(T)[...,None] * gradT)
+        J = self._assembler.assembleMatrix(local)
+        if self._dirichlet is not None:
+            self._dirichlet.apply(J)
+        return J
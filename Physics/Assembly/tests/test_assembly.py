@@ -0,0 +1,169 @@
+from ..Assembly import ElementAssembler, GlobalAssembler, DistributedAssembler
+from ...DoFHandler.DoFHandler import DoFHandler
+from ...Geometry.Geometry2D import Geometry2D
+from ...Geometry.tests.test_gmsh import getTestGMshFile
+from ...Quadrature.Quadrature import Quadrature2D
+import pytest, os
+from numpy import array, zeros
+from numpy.linalg import inv
+
+def test_jacobians(tmpdir):
+    geom = helper_gmsh_geometry(tmpdir)
+    quad = Quadrature2D(order=2)
+    assembler = ElementAssembler(DoFHandler(geom, quad))
+
+    J, detJ, invJ = assembler.jacobians()
+    assert J.shape == (len(geom.localConnectivity), 9, 2, 2)
+    for it,cell in enumerate(geom):
+        for qt,(q_xi, q_eta, _) in enumerate(quad):
+            expected = cell.getJacobian(q_xi, q_eta)
+            assert J[it,qt] == pytest.approx(expected)
+            assert invJ[it,qt] == pytest.approx(inv(expected))
+            assert detJ[it,qt] > 0.0
+
+@pytest.mark.parametrize("order", [1, 2, 3])
+def test_stiffness(tmpdir, order):
+    geom = helper_gmsh_geometry(tmpdir)
+    assembler = ElementAssembler(DoFHandler(geom, Quadrature2D(order=order)))
+    K = assembler.stiffnessMatrices()
+
+    # Constants (unit vertex values) are in the null space of every element matrix
+    assert K[:,:,0:4].sum(axis=2) == pytest.approx(zeros(K.shape[0:2]), abs=1.0e-10)
+
+    # u = x is represented exactly by the vertex functions: integral of |grad u|^2 is the area
+    _, detJ, _ = assembler.jacobians()
+    area = (detJ * assembler._weights).sum()
+    energy = 0.0
+    for mat,cell in zip(K, geom):
+        u = zeros(len(mat))
+        u[0:4] = [v[0] for v in cell.vertices]
+        energy += u.dot(mat.dot(u))
+    assert energy == pytest.approx(area)
+
+def test_rhs(tmpdir):
+    geom = helper_gmsh_geometry(tmpdir)
+    assembler = ElementAssembler(DoFHandler(geom, Quadrature2D(order=2)))
+    F = assembler.rhsVectors(lambda x,y: 2.5 + 0.0*x)
+
+    # Vertex functions are a partition of unity
+    _, detJ, _ = assembler.jacobians()
+    area = (detJ * assembler._weights).sum()
+    assert F[:,0:4].sum() == pytest.approx(2.5*area)
+
+    # Compare against the per-element evaluation
+    quad = Quadrature2D(order=2)
+    ordering = DoFHandler(geom, quad).localBasisOrdering
+    for it,cell in enumerate(geom):
+        expected = zeros(len(ordering))
+        for q_xi, q_eta, q_w in quad:
+            J = cell.getJacobian(q_xi, q_eta)
+            x, y = cell.getPhysicalLocation(q_xi, q_eta)
+            expected += 2.5 * quad.get_local_shape_vector((q_xi,q_eta))[ordering] * (J[0,0]*J[1,1] - J[0,1]*J[1,0]) * q_w
+        assert F[it] == pytest.approx(expected)
+
+@pytest.mark.parametrize("order", [1, 3])
+def test_affineStiffness(order):
+    geom = Geometry2D()
+    geom.readInternal(xExtent=(0,2), nX=4, yExtent=(0,1), nY=3)
+    # Shear the rectangle into a parallelogram and pull one interior point off the lattice
+    points = geom.localPoints.copy()
+    points[:,0] += 0.4*points[:,1]
+    points[geom.localPointIds == 6] += [0.05, 0.03]
+    geom.updateCoordinates(points)
+    dofs = DoFHandler(geom, Quadrature2D(order=order))
+
+    fast, general = ElementAssembler(dofs), ElementAssembler(dofs, affineFastPath=False)
+    assert (fast.affineElements == ~(geom.localConnectivity == 6).any(axis=1)).all()
+    assert not general.affineElements.any()
+    assert fast.stiffnessMatrices() == pytest.approx(general.stiffnessMatrices(), abs=1.0e-12)
+
+def test_termRules(tmpdir):
+    from ...Quadrature.Quadrature import exactRules
+    geom = helper_gmsh_geometry(tmpdir)
+    full = ElementAssembler(DoFHandler(geom, Quadrature2D(order=3)))
+    reduced = ElementAssembler(DoFHandler(geom, Quadrature2D(order=3, rules=exactRules(3))))
+    assert reduced.termQuadrature("source")[0].nPoints == 2
+    assert reduced.termQuadrature("stiffness")[0].nPoints == 4
+
+    # Cell areas (detJ is bilinear) and the total load of a constant source agree between rules
+    areas = [(element.geometricFactors("source").detJ * element.termQuadrature("source")[2]).sum() for element in (full, reduced)]
+    assert areas[0] == pytest.approx(areas[1])
+    F = [element.rhsVectors(lambda x,y: 2.5 + 0.0*x) for element in (full, reduced)]
+    assert F[0][:,0:4].sum() == pytest.approx(F[1][:,0:4].sum())
+
+    # Vertex functions are a partition of unity
+    M = reduced.massMatrices()
+    assert M.shape == (len(geom.localConnectivity), 16, 16)
+    assert M[:,0:4,0:4].sum() == pytest.approx(areas[0])
+    assert M == pytest.approx(M.transpose(0, 2, 1))
+
+@pytest.mark.parametrize("renumber", [False, True])
+def test_global_assembly(tmpdir, renumber):
+    geom = helper_gmsh_geometry(tmpdir)
+    dofs = DoFHandler(geom, Quadrature2D(order=2))
+    if renumber:
+        dofs.renumberDoFs()
+    dofs.buildSparsity()
+
+    element = ElementAssembler(dofs)
+    local_mats = element.stiffnessMatrices()
+    local_rhs = element.rhsVectors(lambda x,y: 1.0 + x*y)
+
+    # Dense reference scatter
+    dofMap = array(dofs.dofMap)
+    expectedA = zeros((dofs.globalDoFsize, dofs.globalDoFsize))
+    expectedRHS = zeros(dofs.globalDoFsize)
+    for elem, mat, rhs in zip(dofs.dofConnectivity, local_mats, local_rhs):
+        globalDoFs = dofMap[elem]
+        for it,row in enumerate(globalDoFs):
+            for jt,col in enumerate(globalDoFs):
+                expectedA[row,col] += mat[it,jt]
+            expectedRHS[row] += rhs[it]
+
+    scatter = GlobalAssembler(dofs)
+    cooA = scatter.assembleMatrix(local_mats)
+    patternA = scatter.assembleMatrixInPattern(local_mats)
+    assert cooA.toarray() == pytest.approx(expectedA)
+    assert patternA.toarray() == pytest.approx(expectedA)
+    assert patternA.nnz == len(dofs.sparsity[1])
+    assert scatter.assembleVector(local_rhs) == pytest.approx(expectedRHS)
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("renumber", [False, True])
+def test_distributed_assembly(tmpdir, renumber):
+    geom = helper_gmsh_geometry(tmpdir)
+    dofs = DoFHandler(geom, Quadrature2D(order=2))
+    if renumber:
+        dofs.renumberDoFs()
+    dofs.buildSparsity()
+
+    element = ElementAssembler(dofs)
+    local_mats = element.stiffnessMatrices()
+    local_rhs = element.rhsVectors(lambda x,y: 1.0 + x*y)
+
+    # Reference: every proc's global-size contributions summed over procs
+    scatter = GlobalAssembler(dofs)
+    expectedA = geom.mpiComm.allreduce(scatter.assembleMatrix(local_mats).toarray())
+    expectedRHS = geom.mpiComm.allreduce(scatter.assembleVector(local_rhs))
+
+    distributed = DistributedAssembler(dofs)
+    A = distributed.assembleMatrix(local_mats)
+    b = distributed.assembleVector(local_rhs)
+    assert A.localMatrix().shape[0] == dofs.nOwnedDoFs
+    assert A.gather().toarray() == pytest.approx(expectedA)
+    assert b.gather() == pytest.approx(expectedRHS)
+
+    # Halo-exchange product matches the dense product
+    assert A.mult(b).gather() == pytest.approx(expectedA.dot(expectedRHS))
+
+###################################################################################################
+# Helper functions
+###################################################################################################
+def helper_gmsh_geometry(tmpdir):
+    filename = os.path.join(tmpdir, "test.msh")
+    with open(filename, "w") as f:
+        f.writelines(getTestGMshFile())
+
+    geom = Geometry2D()
+    geom.readGMsh(filename, boundaryNames=["inner", "yneg", "xneg", "xpos", "ypos"])
+    return geom
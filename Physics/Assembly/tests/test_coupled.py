@@ -0,0 +1,87 @@
+from ..Coupled import HeatGeneration
+from ...BoundaryConditions.BoundaryConditions import DirichletCondition
+from ...DoFHandler.BlockDoFHandler import BlockDoFHandler
+from ...DoFHandler.DoFHandler import DoFHandler
+from ...Geometry.Geometry2D import Geometry2D
+from ...Quadrature.Quadrature import Quadrature2D
+from ...Solver.Newton import NewtonKrylov, FiniteDifferenceJacobian
+import pytest
+from numpy import arange, cos, searchsorted
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("numbering, orders", [("split", (1, 2)), ("interlaced", (2, 2))])
+def test_coupledSolve(numbering, orders):
+    problem, exact = helper_problem(numbering, orders)
+    solver = NewtonKrylov(problem, preconditioner="block-jacobi", rtol=1.0e-10)
+    x = solver.solve(problem.createVector({"temperature": 1.0, "source": 0.0}))
+    assert solver.converged, solver.report()
+
+    # T = S = 1 + x + y is in both discrete spaces
+    for name in problem.fields:
+        assert helper_vertexValues(problem, x, name) == pytest.approx(helper_vertexExact(problem, name, exact), abs=1.0e-8)
+
+@pytest.mark.mpi(max_size=4)
+def test_coupledJacobian():
+    problem, _ = helper_problem("split", (2, 1))
+    # v is one on the free DoFs and zero on the constrained ones
+    v = problem.createVector(1.0)
+    v.owned[:] -= problem.createVector(0.0).owned
+    x = problem.createVector(1.0)
+    x.owned[:] += 0.25*cos(arange(*problem.layout.ownedRange))*v.owned
+    F = problem.residual(x)
+    J = problem.jacobian(x)
+
+    # Directions keeping the constraints see the same product as the finite difference Jacobian
+    fd = FiniteDifferenceJacobian(problem.residual, x, F).mult(v)
+    assert fd.gather() == pytest.approx(J.mult(v).gather(), rel=1.0e-6, abs=1.0e-5)
+
+    # Field problems see the diagonal blocks of the coupled Jacobian
+    for name in problem.fields:
+        field = problem.fieldProblem(name, x)
+        xf = field.createVector()
+        assert field.residual(xf).gather() == pytest.approx(F.gather()[helper_blockRows(problem, name)], abs=1.0e-12)
+        vf = field.createVector(1.0)
+        vf.owned[:] -= field.createVector(0.0).owned
+        blockProduct = J.mult(helper_embed(problem, x, name, vf)).gather()[helper_blockRows(problem, name)]
+        assert field.jacobian(xf).mult(vf).gather() == pytest.approx(blockProduct, abs=1.0e-10)
+
+###################################################################################################
+# Helper functions
+###################################################################################################
+def helper_problem(numbering, orders):
+    geom = Geometry2D()
+    geom.readInternal(xExtent=(0,2), nX=4, yExtent=(0,1), nY=4)
+    fields = {name: DoFHandler(geom, Quadrature2D(order=order)) for name, order in zip(["temperature", "source"], orders)}
+    dofs = BlockDoFHandler(fields, numbering=numbering)
+
+    # k = 1 + T^2 gives div(k grad T) = 4T, so h = -4 balances S = T; the reaction r = 1 + T^2
+    # then needs the supply f = r(T) T
+    exact = lambda x,y: 1.0 + x + y
+    boundaries = ["xneg", "xpos", "yneg", "ypos"]
+    dirichlet = {name: DirichletCondition(fields[name], {it: exact for it in boundaries}) for name in fields}
+    problem = HeatGeneration(dofs, lambda T: 1.0 + T**2, lambda T: 2.0*T, lambda T: 1.0 + T**2, lambda T: 2.0*T,
+                             heating=-4.0, diffusivity=0.5, supply=lambda x,y: (1.0 + exact(x, y)**2)*exact(x, y),
+                             dirichlet=dirichlet)
+    return problem, exact
+
+def helper_blockRows(problem, name):
+    # Global block numbers of a field's DoFs in field global order
+    field = problem.dofs.field(name)
+    return problem.dofs.blockNumbers(name, arange(field.globalDoFsize))
+
+def helper_embed(problem, x, name, vf):
+    v = x.duplicate()
+    v.owned[problem.dofs.ownedPositions(name)] = vf.owned
+    return v
+
+def helper_vertexValues(problem, x, name):
+    field = problem.dofs.field(name)
+    vertices = field.localDoFIds < field.geometry.globalNpoints
+    return x.gather()[problem.dofs.blockNumbers(name, field.dofMap[vertices])]
+
+def helper_vertexExact(problem, name, exact):
+    field = problem.dofs.field(name)
+    geom = field.geometry
+    vertices = field.localDoFIds < geom.globalNpoints
+    points = geom.localPoints[searchsorted(geom.localPointIds, field.localDoFIds[vertices])]
+    return exact(points[:,0], points[:,1])
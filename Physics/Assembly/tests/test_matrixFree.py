@@ -0,0 +1,28 @@
+from ..MatrixFree import MatrixFreeLaplacian
+from ..Assembly import ElementAssembler, DistributedAssembler
+from ...DoFHandler.DoFHandler import DoFHandler
+from ...Quadrature.Quadrature import Quadrature2D
+from ...LinearAlgebra.LinearAlgebra import DistributedVector
+from .test_assembly import helper_gmsh_geometry
+import pytest
+from numpy import sin, arange
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("order", [1, 2, 3])
+def test_matrixFreeAction(tmpdir, order):
+    geom = helper_gmsh_geometry(tmpdir)
+    dofs = DoFHandler(geom, Quadrature2D(order=order))
+    dofs.renumberDoFs()
+
+    element = ElementAssembler(dofs)
+    coefficient = 1.0 + element.physicalLocations()[...,0]**2
+    A = DistributedAssembler(dofs).assembleMatrix(element.stiffnessMatrices(coefficient))
+    operator = MatrixFreeLaplacian(dofs, coefficient)
+
+    # Same global vector on both layouts
+    globalX = sin(arange(dofs.globalDoFsize, dtype="float64"))
+    expected = A.mult(DistributedVector.fromGlobal(A.layout, globalX)).gather()
+    result = operator.mult(DistributedVector.fromGlobal(operator.layout, globalX))
+    assert result.gather() == pytest.approx(expected)
+    assert operator.diagonal() == pytest.approx(A.diagonal())
+    assert operator.nbytes > 0
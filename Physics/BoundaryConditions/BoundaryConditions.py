@@ -0,0 +1,141 @@
+from ..DoFHandler.DoFHandler import DoFHandler
+from ..Geometry.MeshTopology import boundaryEdges
+from ..LinearAlgebra.LinearAlgebra import DistributedMatrix, DistributedVector
+from ..Quadrature.Quadrature import Quadrature1D
+from numpy import arange, argsort, asarray, bincount, concatenate, diff, einsum, repeat, searchsorted, unique, zeros
+from numpy.linalg import solve
+
+class DirichletCondition():
+    '''Prescribed values on named boundaries of the mesh
+
+    values maps a boundary name to a constant or to g(x, y) evaluated on arrays. Vertex DoFs
+    interpolate g; higher-order edge DoFs hold the L2 projection of g minus its linear
+    interpolant along each boundary edge'''
+
+    def __init__(self, dofs: DoFHandler, values: dict):
+        self._dofs = dofs
+        geom = dofs.geometry
+        for name in values.keys():
+            assert name in geom.localBoundarySegments, f"Unknown boundary: {name}"
+
+        # Local DoF index of a mesh-based DoF id
+        idOrder = argsort(dofs.localDoFIds)
+        sortedIds = dofs.localDoFIds[idOrder]
+        self._localIndex = lambda ids: idOrder[searchsorted(sortedIds, ids)]
+
+        constrained, prescribed = [], []
+        for name, value in values.items():
+            g = value if callable(value) else (lambda x, y, c=float(value): c + 0.0*x)
+            ids, vals = self.__boundaryValues(name, g)
+            constrained.append(ids)
+            prescribed.append(vals)
+
+        # DoFs on several boundaries (corners) keep the first value given
+        ids, first = unique(concatenate([zeros(0, dtype="int64")] + constrained), return_index=True)
+        self._constrained = ids
+        self._values = concatenate([zeros(0)] + prescribed)[first]
+
+    @classmethod
+    def combine(cls, dofs, conditions: dict):
+        '''One condition on a BlockDoFHandler from the conditions of its fields (name: condition)'''
+        combined = cls.__new__(cls)
+        combined._dofs = dofs
+        combined._constrained = concatenate([zeros(0, dtype="int64")] +
+                                            [dofs.localIndices(name)[bc.constrainedDoFs] for name, bc in conditions.items()])
+        combined._values = concatenate([zeros(0)] + [bc.constrainedValues for bc in conditions.values()])
+        return combined
+
+    @property
+    def constrainedDoFs(self):
+        '''Local DoF indices (DoFHandler numbering) of the constrained DoFs on this proc'''
+        return self._constrained
+
+    @property
+    def constrainedValues(self):
+        return self._values
+
+    @property
+    def constrainedGlobalDoFs(self):
+        return self._dofs.dofMap[self._constrained]
+
+    def __boundaryValues(self, name, g):
+        geom = self._dofs.geometry
+        order = self._dofs.quadrature.order
+
+        # Vertex DoFs interpolate g
+        vertices = geom.localBoundaryNodes[name]
+        coords = geom.localPoints[searchsorted(geom.localPointIds, vertices)]
+        ids, vals = [vertices], [g(coords[:,0], coords[:,1]) + 0.0*coords[:,0]]
+
+        # Edge modes of the local cells' boundary edges
+        cell, edge = boundaryEdges(geom.localConnectivity, geom.localBoundarySegments[name])
+        if order > 1 and len(cell) > 0:
+            edgeIds = geom.localEdgeConnectivity[cell, edge]
+            # Edge modes are parametrised from the lower to the higher global vertex id
+            reverse = geom.localConnectivity[cell, edge] > geom.localConnectivity[cell, (edge + 1) % 4]
+            start = geom.localCoordinates[cell, (edge + reverse) % 4]
+            end = geom.localCoordinates[cell, (edge + 1 - reverse) % 4]
+            ids += [geom.globalNpoints + m*geom.globalNedges + edgeIds for m in range(order-1)]
+            vals += list(self.__projectEdgeModes(start, end, g, order).T)
+
+        return self._localIndex(concatenate(ids)), concatenate(vals)
+
+    def __projectEdgeModes(self, start, end, g, order):
+        # Coefficients (nEdges, order-1) of the edge modes minimizing the L2 error along each edge
+        quad = Quadrature1D(order=order)
+        t, w = quad.points[:,0], quad.weights
+        S = asarray(quad.shapeValues)
+        x = start[:,None,:] + 0.5*(t[None,:,None] + 1.0)*(end - start)[:,None,:]
+        values = g(x[...,0], x[...,1])
+        residual = values - g(start[:,0], start[:,1])[:,None]*S[:,0] - g(end[:,0], end[:,1])[:,None]*S[:,1]
+        modes = S[:,2:]
+        mass = einsum("q,qm,qn->mn", w, modes, modes)
+        return solve(mass, einsum("q,qm,eq->me", w, modes, residual)).T
+
+    def __ownedPositions(self, layout):
+        # Owned constrained DoFs as owned positions of a layout with the DoFHandler ownership
+        owned = self._constrained < self._dofs.nOwnedDoFs
+        return self._dofs.dofMap[self._constrained[owned]] - layout.ownedRange[0], self._values[owned]
+
+    def impose(self, x: DistributedVector):
+        '''Set the owned constrained entries of x to their prescribed values'''
+        positions, values = self.__ownedPositions(x.layout)
+        x.owned[positions] = values
+        return x
+
+    def constrainResidual(self, x: DistributedVector, F: DistributedVector):
+        '''Replace the constrained rows of a nonlinear residual by x_c - g_c'''
+        positions, values = self.__ownedPositions(x.layout)
+        F.owned[positions] = x.owned[positions] - values
+        return F
+
+    def apply(self, A: DistributedMatrix, b: DistributedVector = None):
+        '''Symmetric elimination on the CSR arrays of A, in place
+
+        Constrained rows and columns are zeroed except the diagonal, b is lifted by the
+        eliminated columns and b_c = A_cc g_c. Without b only the matrix is changed, as for a
+        Newton Jacobian whose iterates already satisfy the constraints'''
+        layout = A.layout
+        nOwned = self._dofs.nOwnedDoFs
+        owned = self._constrained < nOwned
+
+        # Flags and values of owned constrained DoFs, copied to every proc holding them as ghosts
+        flags, values = DistributedVector(layout), DistributedVector(layout)
+        positions = layout.globalToLocal(self._dofs.dofMap[self._constrained[owned]])
+        flags.values[positions] = 1.0
+        values.values[positions] = self._values[owned]
+        flags.updateGhosts()
+        values.updateGhosts()
+
+        local = A.localMatrix()
+        data, indptr, indices = local.data.copy(), local.indptr, local.indices
+        rowOf = repeat(arange(layout.nOwned), diff(indptr))
+        column, row = flags.values[indices] > 0.0, flags.values[rowOf] > 0.0
+        diagonal = row & (indices == rowOf)
+
+        if b is not None:
+            b.owned[:] -= bincount(rowOf[column & ~row], weights=data[column & ~row]*values.values[indices[column & ~row]], minlength=layout.nOwned)
+            b.owned[rowOf[diagonal]] = data[diagonal] * values.values[rowOf[diagonal]]
+        data[(column | row) & ~diagonal] = 0.0
+        A.setValues(data)
+        return A, b
@@ -0,0 +1,60 @@
+from ..BoundaryConditions import DirichletCondition
+from ...Assembly.Assembly import ElementAssembler, DistributedAssembler
+from ...DoFHandler.DoFHandler import DoFHandler
+from ...Geometry.Geometry2D import Geometry2D
+from ...Quadrature.Quadrature import Quadrature2D
+from ...Solver.Solver import ConjugateGradient
+import pytest
+from numpy import abs as npabs, searchsorted
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("order", [1, 2, 3])
+def test_constrainedDoFs(order):
+    geom = Geometry2D()
+    geom.readInternal(nX=2, nY=2)
+    dofs = DoFHandler(geom, Quadrature2D(order=order))
+    bc = DirichletCondition(dofs, {"xneg": 1.0, "xpos": 1.0, "yneg": 1.0, "ypos": 1.0})
+
+    # 8 boundary vertices and (order-1) modes on each of the 8 boundary edges
+    constrained = set().union(*geom.mpiComm.allgather(bc.constrainedGlobalDoFs.tolist()))
+    assert len(constrained) == 8 + 8*(order-1)
+    # A constant has no higher-order edge content
+    vertex = dofs.localDoFIds[bc.constrainedDoFs] < geom.globalNpoints
+    assert bc.constrainedValues[vertex] == pytest.approx([1.0]*vertex.sum())
+    assert bc.constrainedValues[~vertex] == pytest.approx([0.0]*(~vertex).sum())
+
+    with pytest.raises(AssertionError):
+        DirichletCondition(dofs, {"inner": 0.0})
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("order, exact, source", [
+    (1, lambda x,y: 1.0 + 2.0*x - y, lambda x,y: 0.0*x),
+    (2, lambda x,y: x**2 + x*y - 2.0*y**2, lambda x,y: 2.0 + 0.0*x),
+    (3, lambda x,y: x**3 - 3.0*x*y**2 + y**3, lambda x,y: -6.0*y),
+    (5, lambda x,y: x**5 + x**2*y**3 - y**4, lambda x,y: -20.0*x**3 - 2.0*y**3 - 6.0*x**2*y + 12.0*y**2),
+])
+def test_poissonSolve(order, exact, source):
+    geom = Geometry2D()
+    geom.readInternal(xExtent=(1,4), nX=3, yExtent=(1,3), nY=4)
+    dofs = DoFHandler(geom, Quadrature2D(order=order))
+    dofs.renumberDoFs()
+
+    element = ElementAssembler(dofs)
+    distributed = DistributedAssembler(dofs)
+    A = distributed.assembleMatrix(element.stiffnessMatrices())
+    b = distributed.assembleVector(element.rhsVectors(source))
+    bc = DirichletCondition(dofs, {name: exact for name in ["xneg", "xpos", "yneg", "ypos"]})
+    bc.apply(A, b)
+
+    # Elimination keeps the operator symmetric
+    globalA = A.gather()
+    assert npabs(globalA - globalA.T).max() < 1.0e-12
+
+    # The exact solution is in the discrete space
+    solver = ConjugateGradient(A, rtol=1.0e-12)
+    x = solver.solve(b)
+    assert solver.converged
+    solution = x.gather()
+    vertices = dofs.localDoFIds < geom.globalNpoints
+    points = geom.localPoints[searchsorted(geom.localPointIds, dofs.localDoFIds[vertices])]
+    assert solution[dofs.dofMap[vertices]] == pytest.approx(exact(points[:,0], points[:,1]))
@@ -0,0 +1,160 @@
+from .DoFHandler import elementSparsity
+from numpy import arange, array, asarray, concatenate, cumsum, diff, empty, searchsorted, where, zeros
+from scipy.sparse import csr_array
+
+class BlockDoFHandler():
+    '''Several fields on one Geometry2D numbered as a single block system
+
+    fields maps a field name to its own DoFHandler (each with its own quadrature order). Every
+    proc owns one contiguous block range holding its owned DoFs of all fields, either field
+    after field ("split") or alternating DoF by DoF ("interlaced", which needs fields with the
+    same distribution of DoFs). Local DoFs are the owned DoFs of every field in turn followed by
+    the ghosts of every field, so the block handler can stand in for a DoFHandler in the
+    assemblers'''
+
+    def __init__(self, fields: dict, numbering="split"):
+        assert len(fields) > 0, "BlockDoFHandler needs at least one field"
+        self._fields = dict(fields)
+        self._names = list(self._fields)
+        handlers = list(self._fields.values())
+        self._geom = handlers[0].geometry
+        assert all(dofs.geometry is self._geom for dofs in handlers), "Fields must share one Geometry2D"
+
+        # Owned DoFs of every field (rows) on every proc (columns)
+        counts = array([diff(dofs.ownershipRanges) for dofs in handlers])
+        if numbering == "split":
+            self._offsets = concatenate([zeros((1, counts.shape[1]), dtype=counts.dtype), cumsum(counts, axis=0)[:-1]])
+        elif numbering == "interlaced":
+            assert (counts == counts[0]).all(), "Interlaced numbering needs the same DoF distribution for every field"
+        else:
+            raise RuntimeError(f"Unsupported block numbering: {numbering}")
+        self._numbering = numbering
+        self._ownershipRanges = concatenate([[0], cumsum(counts.sum(axis=0))])
+
+        # Block local index of every field's local DoFs
+        nOwned = array([dofs.nOwnedDoFs for dofs in handlers])
+        nGhosts = array([dofs.nLocalDoFs for dofs in handlers]) - nOwned
+        ownedStart = concatenate([[0], cumsum(nOwned)])
+        ghostStart = nOwned.sum() + concatenate([[0], cumsum(nGhosts)])
+        self._nOwned = int(nOwned.sum())
+        self._localIndices = {}
+        for f, (name, dofs) in enumerate(self._fields.items()):
+            local = arange(dofs.nLocalDoFs)
+            self._localIndices[name] = where(local < nOwned[f], ownedStart[f] + local, ghostStart[f] + local - nOwned[f])
+
+        self._dofMap = empty(self._nOwned + int(nGhosts.sum()), dtype="int64")
+        for name, dofs in self._fields.items():
+            self._dofMap[self._localIndices[name]] = self.blockNumbers(name, dofs.dofMap)
+
+        # Element slots: the connectivity of every field in turn
+        self._dofConnectivity = concatenate([self._localIndices[name][asarray(dofs.dofConnectivity)]
+                                             for name, dofs in self._fields.items()], axis=1)
+        slotStart = concatenate([[0], cumsum([dofs.dofsPerElement for dofs in handlers])])
+        self._slots = {name: slice(int(slotStart[f]), int(slotStart[f+1])) for f, name in enumerate(self._names)}
+
+    @property
+    def geometry(self):
+        return self._geom
+
+    @property
+    def fields(self):
+        return self._names
+
+    def field(self, name):
+        return self._fields[name]
+
+    @property
+    def numbering(self):
+        return self._numbering
+
+    @property
+    def globalDoFsize(self):
+        return int(self._ownershipRanges[-1])
+
+    @property
+    def dofsPerElement(self):
+        return self._dofConnectivity.shape[1]
+
+    @property
+    def dofMap(self):
+        '''Global block number of every local DoF (owned first, then ghosts)'''
+        return self._dofMap
+
+    @property
+    def dofConnectivity(self):
+        '''Local block DoF indices of every local element (nElem, dofsPerElement)'''
+        return self._dofConnectivity
+
+    @property
+    def nOwnedDoFs(self):
+        return self._nOwned
+
+    @property
+    def nLocalDoFs(self):
+        return len(self._dofMap)
+
+    @property
+    def ownedRange(self):
+        rank = self._geom.mpiRank
+        return int(self._ownershipRanges[rank]), int(self._ownershipRanges[rank+1])
+
+    @property
+    def ownershipRanges(self):
+        return self._ownershipRanges
+
+    @property
+    def ghostOwners(self):
+        return searchsorted(self._ownershipRanges, self._dofMap[self._nOwned:], side="right") - 1
+
+    @property
+    def basisSigns(self):
+        return concatenate([dofs.basisSigns for dofs in self._fields.values()], axis=1)
+
+    def localIndices(self, name):
+        '''Block local index of every local DoF of a field (field DoFHandler numbering)'''
+        return self._localIndices[name]
+
+    def slots(self, name):
+        '''Slice of the element connectivity columns holding a field'''
+        return self._slots[name]
+
+    def blockNumbers(self, name, globals):
+        '''Global block numbers of global DoF numbers of a field'''
+        f = self._names.index(name)
+        ranges = self._fields[name].ownershipRanges
+        globals = asarray(globals, dtype="int64")
+        owner = searchsorted(ranges, globals, side="right") - 1
+        local = globals - ranges[owner]
+        if self._numbering == "split":
+            return self._ownershipRanges[owner] + self._offsets[f, owner] + local
+        return self._ownershipRanges[owner] + len(self._names)*local + f
+
+    def ownedPositions(self, name):
+        '''Position in the owned block range of each owned DoF of a field, in field global order'''
+        start, end = self._fields[name].ownedRange
+        return self.blockNumbers(name, arange(start, end)) - self.ownedRange[0]
+
+    @property
+    def indexSets(self):
+        '''Owned positions of every field, e.g. for a field-split preconditioner'''
+        return {name: self.ownedPositions(name) for name in self._names}
+
+    @property
+    def sparsity(self):
+        '''Return (rowPtr, colIndices)'''
+        return self._rowPointer, self._columnIndices
+
+    def buildSparsity(self, couplings=None):
+        '''Global-size CSR pattern of the local element couplings
+
+        couplings optionally lists the (row field, column field) blocks that are nonzero; by
+        default every field couples to every other'''
+        blocks = None if couplings is None else [(self._slots[row], self._slots[col]) for row, col in couplings]
+        self._rowPointer, self._columnIndices = elementSparsity(self._dofMap[self._dofConnectivity], self.globalDoFsize, blocks)
+
+    def sparsityTemplate(self, dtype="float64"):
+        assert hasattr(self, "_columnIndices") and hasattr(self, "_rowPointer"), "Sparsity not Built. Must Call BlockDoFHandler.buildSparsity() first"
+        size = self.globalDoFsize
+        A = csr_array((zeros(len(self._columnIndices), dtype=dtype), self._columnIndices, self._rowPointer), shape=(size, size))
+        A.has_sorted_indices = True
+        return A
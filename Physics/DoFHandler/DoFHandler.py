@@ -1,9 +1,28 @@
 from ..Geometry.Geometry2D import Geometry2D
 from ..Quadrature.Quadrature import Quadrature2D
-from numpy import array, cumsum, empty
+from numpy import array, cumsum, empty, arange, unique, where, full, searchsorted, concatenate, flatnonzero, \
+    argsort, bincount, ascontiguousarray, lexsort, ones, repeat, asarray, tile, zeros
+from mpi4py import MPI
+from .Ordering import adjacencyGraph, reverseCuthillMcKee, bandwidth, profile
 from matplotlib import pyplot as plt
 from scipy.sparse import csr_array
 
+def elementSparsity(elementDoFs, size, blocks=None):
+    '''Global-size CSR (rowPtr, colIndices) of the couplings within every element's DoFs
+
+    blocks optionally restricts the couplings to pairs of column slices (rows, cols) of elementDoFs'''
+    elementDoFs = asarray(elementDoFs, dtype="int64")
+    blocks = [(slice(None), slice(None))] if blocks is None else blocks
+    keys = []
+    for rows, cols in blocks:
+        rowDoFs, colDoFs = elementDoFs[:, rows], elementDoFs[:, cols]
+        keys.append(repeat(rowDoFs, colDoFs.shape[1], axis=1).ravel()*size + tile(colDoFs, (1, rowDoFs.shape[1])).ravel())
+
+    # Deduplicate every element (row, col) pair through one sorted key
+    keys = unique(concatenate(keys))
+    indexType = "int32" if size < 2**31 and len(keys) < 2**31 else "int64"
+    return concatenate([[0], cumsum(bincount(keys // size, minlength=size))]).astype(indexType), (keys % size).astype(indexType)
+
 class DoFHandler():
 
     def __init__(self, geom: Geometry2D, quadrature: Quadrature2D):
@@ -15,7 +34,15 @@ class DoFHandler():
         self._globalDoFsize = self._geom.globalNpoints + \
             self._geom.globalNedges*(self._quad.order-1) + \
             self._geom.globalNelements*(self._quad.order-1)**2
-        self.dof_map, self.dof_graph = self.__build_dof_map()
+        self.__build_dof_map()
+
+    @property
+    def geometry(self):
+        return self._geom
+
+    @property
+    def quadrature(self):
+        return self._quad
 
     @property
     def globalDoFsize(self):
@@ -27,101 +54,219 @@ class DoFHandler():
     
     @property
     def dofMap(self):
+        '''Global DoF number of every local DoF (owned first, then ghosts)'''
         return self.dof_map
     
     @property
     def dofConnectivity(self):
+        '''Local DoF indices of every local element (nElem, dofsPerElement)'''
         return self.dof_connectivity
-    
+
+    @property
+    def nOwnedDoFs(self):
+        return self._nOwned
+
+    @property
+    def nLocalDoFs(self):
+        return len(self.dof_map)
+
+    @property
+    def ownedRange(self):
+        '''Contiguous [start, end) global numbers owned by this proc'''
+        rank = self._geom.mpiRank
+        return int(self._ownershipRanges[rank]), int(self._ownershipRanges[rank+1])
+
+    @property
+    def ownershipRanges(self):
+        '''Start of every proc's owned range, followed by the global size'''
+        return self._ownershipRanges
+
+    @property
+    def ghostOwners(self):
+        '''Owning proc of every ghost DoF (local indices nOwnedDoFs and up)'''
+        return self._ghostOwners
+
+    @property
+    def localDoFIds(self):
+        '''Mesh-based DoF id (vertex, edge mode, bubble) of every local DoF'''
+        return self._localDoFIds
+
+    @property
+    def localBasisOrdering(self):
+        '''Index into the Quadrature2D tensor basis for each slot of an element's DoF connectivity'''
+        n = self._quad.order + 1
+        tensor = lambda i,j: i*n + j
+        # Vertices counter-clockwise from (-1,-1); edge k joins vertex k to vertex k+1
+        vertices = [tensor(0,0), tensor(1,0), tensor(1,1), tensor(0,1)]
+        edges = [e for m in range(2,n) for e in (tensor(m,0), tensor(1,m), tensor(m,1), tensor(0,m))]
+        bubbles = [tensor(i,j) for i in range(2,n) for j in range(2,n)]
+        return array(vertices + edges + bubbles)
+
+    @property
+    def basisSigns(self):
+        '''Sign (nElem, dofsPerElement) of each connectivity slot's reference function
+
+        Edge mode m has parity (-1)^m along its edge. Shared edges are parametrised from their
+        lower to their higher global vertex, so odd modes flip on cells whose reference edge
+        runs the other way'''
+        n = self._quad.order + 1
+        conn = self._geom.localConnectivity
+        # Reference parameter of edge k runs from vertex start[k] to vertex end[k]
+        start, end = [0, 1, 3, 0], [1, 2, 2, 3]
+        edgeSign = where(conn[:,start] < conn[:,end], 1.0, -1.0)
+        signs = ones((len(conn), self.dofsPerElement))
+        for m in range(3, n, 2):
+            signs[:, 4*(m-1):4*m] = edgeSign
+        return signs
+
     @property
     def sparsity(self):
         '''Return (rowPtr, colIndices)'''
         return self._rowPointer, self._columnIndices
 
     def __build_dof_map(self):
+        comm = self._geom.mpiComm
+        rank = self._geom.mpiRank
+        order = self._quad.order
+        nGlobalPoints = self._geom.globalNpoints
+        nGlobalEdges = self._geom.globalNedges
+
         # Will need to know the number of elements for each proc to number higher-order dofs
         # per element
-        nElementsPerProc = self._geom.mpiComm.allgather(len(self._geom.localConnectivity))
-        myElementOffset = 0
-        for it in range(self._geom.mpiRank):
-            myElementOffset += nElementsPerProc[it]
+        myElementOffset = comm.exscan(len(self._geom.localConnectivity)) or 0
 
         # Build DoF Connectivity
         # Each cell should have a mapping to several DoFs, which correspond to basis
-        # functions
-        pointsPerElement = 4 + (self._quad.order-1)*4 + (self._quad.order-1)**2
-        nGlobalPoints = self._geom.globalNpoints
-        nGlobalEdges = self._geom.globalNedges
-        self.dof_connectivity = [[0]*pointsPerElement for _ in self._geom.localConnectivity]
-        for it,(elem,edge) in enumerate(zip(self._geom.localConnectivity, self._geom.localEdgeConnectivity)):
-            # Vertex Dofs
-            self.dof_connectivity[it][0:4] = list(elem)
-            # Edge Dofs
-            edge_end = self._quad.order*4
-            self.dof_connectivity[it][4:edge_end] = [nGlobalPoints + it*nGlobalEdges + e for it in range(self._quad.order-1) for e in edge]
-            # Bubble Dofs
-            start = self._geom.globalNpoints + self._geom.globalNedges*(self._quad.order-1) + (it+myElementOffset)*(pointsPerElement-4*self._quad.order)
-            end = start + (pointsPerElement-4*self._quad.order)
-            self.dof_connectivity[it][edge_end:] = list(range(start,end))
-
-        # print(f"Rank {self._geom.mpiRank} {self.dof_connectivity} {self._geom.localEdgeConnectivity}")
-        # DoF graph
-        localGraph = {it:set() for it in range(self._globalDoFsize)}
-        for elem in self.dof_connectivity:
-            for it in elem:
-                for jt in elem:
-                    localGraph[it].add(jt)
-
-        # DoF Mapping [Identity]
-        dof_map = [it for it in localGraph.keys()]
-
-        return dof_map, localGraph
-    
+        # functions. Ids are based on the mesh: vertices, then edge modes, then bubbles
+        localConn = self._geom.localConnectivity.astype("int64").reshape(-1, 4)
+        edgeConn = self._geom.localEdgeConnectivity.astype("int64").reshape(-1, 4)
+        bubblesPerElement = (order-1)**2
+        bubbleStart = nGlobalPoints + nGlobalEdges*(order-1)
+        elements = myElementOffset + arange(len(localConn))
+        edgeDoFs = [nGlobalPoints + it*nGlobalEdges + edgeConn for it in range(order-1)]
+        bubbleDoFs = bubbleStart + elements[:,None]*bubblesPerElement + arange(bubblesPerElement)
+        conn = concatenate([localConn] + edgeDoFs + [bubbleDoFs], axis=1)
+        localIds = unique(conn)
+
+        # DoF Ownership
+        # Vertex and edge DoFs may be shared; each belongs to the lowest rank touching its
+        # mesh entity. Bubble DoFs are always owned by the element's proc
+        shared = localIds < bubbleStart
+        entity = where(localIds < nGlobalPoints, localIds, nGlobalPoints + (localIds - nGlobalPoints) % max(nGlobalEdges, 1))[shared]
+        entities = unique(entity)
+        owner = full(len(localIds), rank)
+        owner[shared] = self.__entityOwners(entities, nGlobalPoints + nGlobalEdges)[searchsorted(entities, entity)]
+        owned = owner == rank
+
+        # Contiguous per-rank numbering of owned DoFs in order of their ids
+        self._nOwned = int(owned.sum())
+        self._ownershipRanges = array([0] + list(cumsum(comm.allgather(self._nOwned))))
+        localOrder = concatenate([flatnonzero(owned), flatnonzero(~owned)])
+        self._localDoFIds = localIds[localOrder]
+        self._ghostOwners = owner[localOrder][self._nOwned:]
+
+        self.dof_map = empty(len(localIds), dtype="int64")
+        self.dof_map[:self._nOwned] = self._ownershipRanges[rank] + arange(self._nOwned)
+        self.__update_ghost_numbers()
+
+        position = empty(len(localIds), dtype="int64")
+        position[localOrder] = arange(len(localIds))
+        self.dof_connectivity = position[searchsorted(localIds, conn)]
+
+    def __entityOwners(self, entities, nEntities):
+        # Rendezvous: each entity has a directory rank which collects every rank touching it
+        # and answers with the lowest of them
+        size = self._geom.mpiSize
+        directory = (entities * size) // max(nEntities, 1)
+        received, sources, replyTo = self.__exchange(entities, directory)
+
+        order = lexsort((sources, received))
+        first = ones(len(order), dtype=bool)
+        first[1:] = received[order][1:] != received[order][:-1]
+        ids, lowest = received[order][first], sources[order][first]
+        return replyTo(lowest[searchsorted(ids, received)])
+
+    def __update_ghost_numbers(self):
+        # Ask the owner of every ghost DoF for its global number
+        received, _, replyTo = self.__exchange(self._localDoFIds[self._nOwned:], self._ghostOwners)
+        ownedIds = self._localDoFIds[:self._nOwned]
+        self.dof_map[self._nOwned:] = replyTo(self.dof_map[searchsorted(ownedIds, received)])
+
+    def __exchange(self, values, dest):
+        '''Send values[i] to rank dest[i]
+
+        Returns the received values, their source ranks, and a function sending one reply per
+        received value back, which returns the replies aligned with the original values'''
+        comm = self._geom.mpiComm
+        size = self._geom.mpiSize
+        order = argsort(dest, kind="stable")
+        sendbuf = ascontiguousarray(values[order], dtype="int64")
+        sendCounts = bincount(dest, minlength=size)
+        recvCounts = array(comm.alltoall(sendCounts.tolist()))
+        displs = lambda counts: concatenate([[0], cumsum(counts)[:-1]]).tolist()
+
+        recvbuf = empty(recvCounts.sum(), dtype="int64")
+        comm.Alltoallv([sendbuf, (sendCounts.tolist(), displs(sendCounts))], [recvbuf, (recvCounts.tolist(), displs(recvCounts))])
+        sources = repeat(arange(size), recvCounts)
+
+        def replyTo(replies):
+            replies = ascontiguousarray(replies, dtype="int64")
+            answers = empty(len(sendbuf), dtype="int64")
+            comm.Alltoallv([replies, (recvCounts.tolist(), displs(recvCounts))], [answers, (sendCounts.tolist(), displs(sendCounts))])
+            result = empty(len(sendbuf), dtype="int64")
+            result[order] = answers
+            return result
+
+        return recvbuf, sources, replyTo
+
     def renumberDoFs(self):
-        # Collect graphs
-        allGraphs = self._geom.mpiComm.allgather(self.dof_graph)
-        globalGraph = {it:set() for it in range(self._globalDoFsize)}
-        for graph in allGraphs:
-            for key,val in graph.items():
-                for v in val:
-                    globalGraph[key].add(v)
-
-        # Determine Starting index
-        rank = [len(val) for val in globalGraph.values()]
-        start = rank.index(min(rank))
-
-        # Breadth First Search
-        self.dof_map = [None for _ in globalGraph.keys()]
-        visited = set([start])
-        queue = [start]
-        count = 0
-        while len(queue) > 0:
-            it = queue.pop(0)
-            self.dof_map[it] = count
-            count += 1
-            for v in globalGraph[it]:
-                if v not in visited:
-                    visited.add(v)
-                    queue.append(v)
-
-        order = sorted([it for it,val in enumerate(self.dof_map) if val is not None], key=lambda x: self.dof_map[x])
-
-        # Renumber graph connections
-        self.dof_graph = {it:set() for it in range(self._globalDoFsize)}
-        for elem in self.dof_connectivity:
-            for it in elem:
-                for jt in elem:
-                    self.dof_graph[self.dof_map[it]].add(self.dof_map[jt])
+        '''Reverse Cuthill-McKee renumbering of the DoFs owned by this proc
+
+        Owned ranges stay contiguous; ghost numbers are refreshed from their owners afterwards.
+        Returns the bandwidth and profile of the owned diagonal blocks (max and sum over procs)
+        before and after renumbering'''
+        comm = self._geom.mpiComm
+        nOwned = self._nOwned
+        conn = asarray(self.dof_connectivity, dtype="int64")
+        rows = repeat(conn, conn.shape[1], axis=1).ravel()
+        cols = tile(conn, (1, conn.shape[1])).ravel()
+        mine = (rows < nOwned) & (cols < nOwned)
+        graph = adjacencyGraph(rows[mine], cols[mine], nOwned)
+
+        # Owned DoFs currently sit in owned-range order
+        current = self.dof_map[:nOwned] - self.ownedRange[0]
+        before = graph[argsort(current)][:, argsort(current)]
+        permutation = reverseCuthillMcKee(graph)
+        newNumber = empty(nOwned, dtype="int64")
+        newNumber[permutation] = arange(nOwned)
+        after = graph[permutation][:, permutation]
+
+        report = {
+            "bandwidth": tuple(comm.allreduce(bandwidth(it), op=MPI.MAX) for it in (before, after)),
+            "profile": tuple(comm.allreduce(profile(it), op=MPI.SUM) for it in (before, after)),
+        }
+
+        self.dof_map[:nOwned] = self.ownedRange[0] + newNumber
+        self.__update_ghost_numbers()
 
         # Clear sparsity if it has been built
         if hasattr(self, "_columnIndices"):
             del self._columnIndices
         if hasattr(self, "_rowPointer"):
             del self._rowPointer
+        return report
 
     def buildSparsity(self):
-        self._columnIndices = [it for val in self.dof_graph.values() for it in val]
-        self._rowPointer = [0] + list(cumsum([len(val) for val in self.dof_graph.values()]))
+        '''Global-size CSR pattern of the local element couplings with sorted columns'''
+        self._rowPointer, self._columnIndices = elementSparsity(self.dof_map[self.dof_connectivity], self._globalDoFsize)
+
+    def sparsityTemplate(self, dtype="float64"):
+        '''Zero csr_array on the sparsity pattern, sharing its index arrays'''
+        assert hasattr(self, "_columnIndices") and hasattr(self, "_rowPointer"), "Sparsity not Built. Must Call DoFHandler.buildSparsity() first"
+        size = self._globalDoFsize
+        A = csr_array((zeros(len(self._columnIndices), dtype=dtype), self._columnIndices, self._rowPointer), shape=(size, size))
+        A.has_sorted_indices = True
+        return A
 
     def plotSparsity(self, fileroot="dof_sparsity", show=False, colorByRank=True):
         assert hasattr(self, "_columnIndices") and hasattr(self, "_rowPointer"), "Sparsity not Built. Must Call DoFHandler.buildSparsity() first"
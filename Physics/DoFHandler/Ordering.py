@@ -0,0 +1,81 @@
+from numpy import arange, argmin, concatenate, cumsum, diff, flatnonzero, isfinite, lexsort, ones, \
+    repeat, sort, unique, zeros, abs as npabs, minimum
+from scipy.sparse import csr_array
+from scipy.sparse.csgraph import connected_components, shortest_path
+
+def adjacencyGraph(rows, cols, size):
+    '''Symmetric csr_array structure (no diagonal) from (row, col) couplings'''
+    keep = rows != cols
+    graph = csr_array((ones(keep.sum()), (rows[keep], cols[keep])), shape=(size, size))
+    graph = (graph + graph.T).tocsr()
+    graph.sum_duplicates()
+    graph.data[:] = 1.0
+    return graph
+
+def pseudoPeripheralNode(graph, start):
+    '''George-Liu search: restart from a minimum degree vertex of the last level until the
+    eccentricity stops growing'''
+    degree = diff(graph.indptr)
+    levels = shortest_path(graph, directed=False, unweighted=True, indices=start)
+    while True:
+        reached = isfinite(levels)
+        depth = levels[reached].max()
+        last = flatnonzero(reached & (levels == depth))
+        candidate = last[argmin(degree[last])]
+        newLevels = shortest_path(graph, directed=False, unweighted=True, indices=candidate)
+        if newLevels[reached].max() <= depth:
+            return start
+        start, levels = candidate, newLevels
+
+def cuthillMcKee(graph, start):
+    '''Cuthill-McKee order of the component containing start, one level at a time
+
+    Every vertex is numbered after the earliest numbered neighbour, children of one parent in
+    increasing degree'''
+    indptr, indices = graph.indptr, graph.indices
+    degree = diff(indptr)
+    visited = zeros(graph.shape[0], dtype=bool)
+    visited[start] = True
+    frontier = arange(start, start+1)
+    order = [frontier]
+    while len(frontier) > 0:
+        counts = degree[frontier]
+        offsets = arange(counts.sum()) - repeat(cumsum(counts) - counts, counts)
+        neighbours = indices[repeat(indptr[frontier], counts) + offsets]
+        parent = repeat(arange(len(frontier)), counts)
+        keep = ~visited[neighbours]
+        neighbours, parent = neighbours[keep], parent[keep]
+
+        neighbours = neighbours[lexsort((neighbours, degree[neighbours], parent))]
+        _, first = unique(neighbours, return_index=True)
+        frontier = neighbours[sort(first)]
+        visited[frontier] = True
+        order.append(frontier)
+    return concatenate(order)
+
+def reverseCuthillMcKee(graph):
+    '''Return the RCM permutation (new index -> vertex) of a symmetric csr_array'''
+    n = graph.shape[0]
+    if n == 0:
+        return zeros(0, dtype="int64")
+    degree = diff(graph.indptr)
+    nComponents, labels = connected_components(graph, directed=False)
+
+    order = []
+    for it in range(nComponents):
+        members = flatnonzero(labels == it)
+        start = pseudoPeripheralNode(graph, members[argmin(degree[members])])
+        order.append(cuthillMcKee(graph, start))
+    return concatenate(order)[::-1].astype("int64")
+
+def bandwidth(graph):
+    '''Largest |row - col| of the stored entries'''
+    A = graph.tocoo()
+    return int(npabs(A.row.astype("int64") - A.col).max()) if A.nnz > 0 else 0
+
+def profile(graph):
+    '''Sum over rows of the distance from the first stored column to the diagonal'''
+    A = graph.tocoo()
+    first = arange(graph.shape[0])
+    minimum.at(first, A.row, A.col.astype("int64"))
+    return int((arange(graph.shape[0]) - first).sum())
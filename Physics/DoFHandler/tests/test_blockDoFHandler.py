@@ -0,0 +1,60 @@
+from ..BlockDoFHandler import BlockDoFHandler
+from ..DoFHandler import DoFHandler
+from ...Assembly.Assembly import ElementAssembler, DistributedAssembler
+from ...Geometry.Geometry2D import Geometry2D
+from ...Quadrature.Quadrature import Quadrature2D
+import pytest
+from numpy import arange, zeros, unique, ix_
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("numbering, orders", [("split", (1, 2)), ("split", (3, 1)), ("interlaced", (2, 2))])
+def test_blockNumbering(numbering, orders):
+    geom = Geometry2D()
+    geom.readInternal(xExtent=(0,2), nX=4, yExtent=(0,1), nY=3)
+    fields = {f"u{it}": DoFHandler(geom, Quadrature2D(order=order)) for it,order in enumerate(orders)}
+    fields["u0"].renumberDoFs()
+    dofs = BlockDoFHandler(fields, numbering=numbering)
+
+    # Every proc owns a contiguous range holding its owned DoFs of every field
+    start, end = dofs.ownedRange
+    assert dofs.globalDoFsize == sum(it.globalDoFsize for it in fields.values())
+    assert sorted(dofs.dofMap[:dofs.nOwnedDoFs]) == list(range(start, end))
+    assert sorted(unique(dofs.dofMap)) == sorted(dofs.dofMap)
+    positions = [dofs.ownedPositions(name) for name in dofs.fields]
+    assert sorted(p for it in positions for p in it) == list(range(end - start))
+    if numbering == "interlaced":
+        assert list(positions[1]) == list(arange(1, end - start, 2))
+
+    # The block assembly of uncoupled fields is the block diagonal of the field assemblies
+    comm = geom.mpiComm
+    nBasis = dofs.dofsPerElement
+    local = zeros((len(dofs.dofConnectivity), nBasis, nBasis))
+    expected = zeros((dofs.globalDoFsize, dofs.globalDoFsize))
+    for name, field in fields.items():
+        K = ElementAssembler(field).stiffnessMatrices()
+        local[:, dofs.slots(name), dofs.slots(name)] = K
+        blocks = dofs.blockNumbers(name, arange(field.globalDoFsize))
+        expected[ix_(blocks, blocks)] = DistributedAssembler(field).assembleMatrix(K).gather().toarray()
+    A = DistributedAssembler(dofs).assembleMatrix(local).gather().toarray()
+    assert A == pytest.approx(expected)
+
+    # Block sparsity drops the couplings between fields
+    dofs.buildSparsity()
+    full = len(dofs.sparsity[1])
+    dofs.buildSparsity(couplings=[(name, name) for name in dofs.fields])
+    fieldNnz = 0
+    for field in fields.values():
+        field.buildSparsity()
+        fieldNnz += len(field.sparsity[1])
+    assert comm.allreduce(len(dofs.sparsity[1])) == comm.allreduce(fieldNnz)
+    assert full > len(dofs.sparsity[1])
+    assert dofs.sparsityTemplate().nnz == len(dofs.sparsity[1])
+
+def test_interlacedSizes():
+    geom = Geometry2D()
+    geom.readInternal(nX=2, nY=2)
+    fields = {"T": DoFHandler(geom, Quadrature2D(order=1)), "S": DoFHandler(geom, Quadrature2D(order=2))}
+    with pytest.raises(AssertionError):
+        BlockDoFHandler(fields, numbering="interlaced")
+    with pytest.raises(RuntimeError):
+        BlockDoFHandler(fields, numbering="random")
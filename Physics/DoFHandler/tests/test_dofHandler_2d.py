@@ -1,9 +1,9 @@
 from ..DoFHandler import DoFHandler
 from ...Geometry.Geometry2D import Geometry2D
 from ...Quadrature.Quadrature import Quadrature2D
-import pytest
+import pytest, os
 from scipy.sparse import csr_array
-from numpy import array
+from numpy import array, cumsum, ones, zeros, flatnonzero
 
 def test_dof_constructor():
     geom = Geometry2D()
@@ -15,8 +15,41 @@ def test_dof_constructor():
     #       N global dofs = nPoints + nEdges*(q-1) + nElements*(q-1)**2
     # One DoF for each vertex, then one for every edge and order above linear, then bubble functions growing at (q-1)**2
     assert dofs.globalDoFsize == 9 + 12*(2-1) + 4*(2-1)**2
-    # Expecting the dof map to be identity [ range(nDofs) ]
-    assert dofs.dofMap == [it for it in range(25)]
+    # Owned DoFs are numbered contiguously on each proc and ghosts agree with their owners
+    start, end = dofs.ownedRange
+    assert list(dofs.dofMap[:dofs.nOwnedDoFs]) == [it for it in range(start, end)]
+    assert list(dofs.ownershipRanges) == [0] + list(cumsum(geom.mpiComm.allgather(dofs.nOwnedDoFs)))
+    assert (helper_global_numbering(dofs) >= 0).all()
+    # Expecting the dof map to be identity [ range(nDofs) ] on a single proc
+    if geom.mpiSize == 1:
+        assert list(dofs.dofMap) == [it for it in range(25)]
+
+@pytest.mark.mpi(min_size=4, max_size=4)
+def test_dof_ownership():
+    geom = Geometry2D()
+    geom.readInternal(nX=2,nY=2)
+    dofs = DoFHandler(geom=geom, quadrature=Quadrature2D(order=2))
+
+    # Shared vertex and edge DoFs belong to the lowest rank touching them
+    #
+    #   6 ---19--- 7 ---20--- 8         10 ---13--- 12 ---23--- 21
+    #   |          |          |          |           |           |
+    #  15    22    17   24    18        11    14    12   24     22
+    #   |          |          |          |           |           |
+    #   3 ---14--- 4 ---16--- 5   ==>    2 ----7---- 3 ---19--- 16
+    #   |          |          |          |           |           |
+    #  10    21    12   23    13         5     8     6    20    18
+    #   |          |          |          |           |           |
+    #   0 ----9--- 1 ---11--- 2          0 ----4---- 1 ---17--- 15
+    #
+    expectedOwned = [9, 6, 6, 4]
+    expectedDoFs = [[0, 1, 2, 3, 4, 5, 6, 7, 8],
+                    [2, 3, 7, 9, 10, 11, 12, 13, 14],
+                    [1, 3, 6, 15, 16, 17, 18, 19, 20],
+                    [3, 10, 12, 16, 19, 21, 22, 23, 24]]
+    assert dofs.nOwnedDoFs == expectedOwned[geom.mpiRank]
+    assert sorted(dofs.dofMap) == expectedDoFs[geom.mpiRank]
+    assert dofs.nLocalDoFs == 9
 
 def test_dof_renumbering():
     geom = Geometry2D()
@@ -24,25 +57,34 @@ def test_dof_renumbering():
     quad = Quadrature2D(order=2)
 
     dofs = DoFHandler(geom=geom, quadrature=quad)
-    dofs.renumberDoFs()
-
-    # DoF map should be breadth first of nodes from start
-    #
-    #   6 ---15--- 7 ---20--- 8
-    #   |          |          |
-    #  17    22    19   24    12
-    #   |          |          |
-    #   3 ---11--- 4 ---16--- 5
-    #   |          |          |
-    #  13    21    14   23    18
-    #   |          |          |
-    #   0 ----9--- 1 ---10--- 2
-    #
-    # Node Ordering: [0 1 3 4 9 11 13 14 21 2 5 10 16 18 23 6 7 15 17 19 22 8 12 20 24]           [0, 1, 3, 4, 9, 2, 5, 11, 6, 7, 10, 8, 12]
-    # Map should be inverse of this ordering
-    order = [0, 1, 3, 4, 9, 11, 13, 14, 21, 2, 5, 10, 16, 18, 23, 6, 7, 15, 17, 19, 22, 8, 12, 20, 24]
-    expected = sorted([it for it in range(25)], key=lambda x: order[x])
-    assert dofs.dofMap == expected
+    report = dofs.renumberDoFs()
+
+    # Renumbering permutes each proc's owned range and keeps ghosts consistent
+    start, end = dofs.ownedRange
+    assert sorted(dofs.dofMap[:dofs.nOwnedDoFs]) == [it for it in range(start, end)]
+    assert sorted(helper_global_numbering(dofs)) == [it for it in range(25)]
+    assert report["bandwidth"][1] <= report["bandwidth"][0]
+    assert report["profile"][1] <= report["profile"][0]
+
+    if geom.mpiSize == 1:
+        # Reverse Cuthill-McKee from the pseudo-peripheral corner vertex 0
+        #
+        #   6 ---19--- 7 ---20--- 8
+        #   |          |          |
+        #  15    23    17   24    18
+        #   |          |          |
+        #   3 ---14--- 4 ---16--- 5
+        #   |          |          |
+        #  10    21    12   22    13
+        #   |          |          |
+        #   0 ----9--- 1 ---11--- 2
+        #
+        # Node Ordering: [24 20 18 8 17 7 23 19 15 6 16 5 22 13 11 2 4 14 12 3 1 21 10 9 0]
+        # Map should be inverse of this ordering
+        order = [24, 20, 18, 8, 17, 7, 23, 19, 15, 6, 16, 5, 22, 13, 11, 2, 4, 14, 12, 3, 1, 21, 10, 9, 0]
+        expected = sorted([it for it in range(25)], key=lambda x: order[x])
+        assert list(dofs.dofMap) == expected
+        assert report == {"bandwidth": (21, 16), "profile": (260, 152)}
 
 @pytest.mark.mpi(min_size=4, max_size=4)
 def test_sparsity():
@@ -54,26 +96,68 @@ def test_sparsity():
     dofs.buildSparsity()
     row, col = dofs.sparsity
 
-    if geom.mpiRank == 0:
-        expectedRow = [0, 9, 18, 18, 27, 36, 36, 36, 36, 36, 45, 45, 54, 54, 63, 72, 72, 72, 72, 72, 72, 72, 81, 81, 81, 81]
-        expectedCol = [it for _ in range(9) for it in [0, 1, 3, 4, 9, 11, 13, 14, 21]]
-        assert expectedRow == row
-        assert expectedCol == col
-    elif geom.mpiRank == 1:
-        expectedRow = [0, 0, 0, 0, 9, 18, 18, 27, 36, 36, 36, 36, 45, 45, 45, 45, 54, 54, 63, 63, 72, 72, 72, 81, 81, 81]
-        expectedCol = [it for _ in range(9) for it in [3, 4, 6, 7, 11, 15, 17, 19, 22]]
-        assert expectedRow == row
-        assert expectedCol == col
-    elif geom.mpiRank == 2:
-        expectedRow = [0, 0, 9, 18, 18, 27, 36, 36, 36, 36, 36, 45, 45, 45, 45, 54, 54, 63, 63, 72, 72, 72, 72, 72, 81, 81]
-        expectedCol = [it for _ in range(9) for it in [1, 2, 4, 5, 10, 14, 16, 18, 23]]
-        assert expectedRow == row
-        assert expectedCol == col
-    elif geom.mpiRank == 3:
-        expectedRow = [0, 0, 0, 0, 0, 9, 18, 18, 27, 36, 36, 36, 36, 45, 45, 45, 45, 54, 54, 54, 63, 72, 72, 72, 72, 81]
-        expectedCol = [it for _ in range(9) for it in [4, 5, 7, 8, 12, 16, 19, 20, 24]]
-        assert expectedRow == row
-        assert expectedCol == col
+    # Each rank holds one element (global numbering from test_dof_ownership)
+    elementDoFs = [[0, 1, 2, 3, 4, 5, 6, 7, 8],
+                   [2, 3, 7, 9, 10, 11, 12, 13, 14],
+                   [1, 3, 6, 15, 16, 17, 18, 19, 20],
+                   [3, 10, 12, 16, 19, 21, 22, 23, 24]]
+    expectedCol = [it for _ in range(9) for it in elementDoFs[geom.mpiRank]]
+    expectedRow = [0] + list(cumsum([9 if it in elementDoFs[geom.mpiRank] else 0 for it in range(25)]))
+    assert expectedRow == list(row)
+    assert expectedCol == list(col)
+
+@pytest.mark.parametrize("order", [1, 2, 3])
+def test_sparsity_pattern(order):
+    geom = Geometry2D()
+    geom.readInternal(nX=3,nY=2)
+    dofs = DoFHandler(geom=geom, quadrature=Quadrature2D(order=order))
+    dofs.renumberDoFs()
+    dofs.buildSparsity()
+    row, col = dofs.sparsity
+
+    # Dense reference of every local element coupling
+    expected = zeros((dofs.globalDoFsize, dofs.globalDoFsize), dtype=bool)
+    for elem in dofs.dofMap[dofs.dofConnectivity]:
+        for it in elem:
+            expected[it, elem] = True
+    assert row.dtype == "int32" and col.dtype == "int32"
+    assert list(row) == [0] + list(cumsum(expected.sum(axis=1)))
+    assert list(col) == [it for r in expected for it in flatnonzero(r)]
+
+    # Template shares the pattern and starts from zero
+    A = dofs.sparsityTemplate()
+    assert A.has_sorted_indices and A.nnz == len(col) and (A.data == 0.0).all()
+    assert (A.indices == col).all() and (A.indptr == row).all()
+
+@pytest.mark.parametrize("order", [3, 4])
+def test_edgeOrientation(tmpdir, order):
+    from ...Geometry.tests.test_gmsh import getTestGMshFile
+    from numpy.random import default_rng
+    with open(os.path.join(tmpdir, "test.msh"), "w") as f:
+        f.writelines(getTestGMshFile())
+    geom = Geometry2D()
+    geom.readGMsh(os.path.join(tmpdir, "test.msh"), boundaryNames=["inner", "yneg", "xneg", "xpos", "ypos"])
+    quad = Quadrature2D(order=order)
+    dofs = DoFHandler(geom=geom, quadrature=quad)
+    signs = dofs.basisSigns
+    assert (signs == -1.0).any()
+
+    # Traces of a random field agree on both sides of every edge, sampled from the lower to the
+    # higher global vertex
+    u = default_rng(0).random(dofs.nLocalDoFs)
+    ordering = dofs.localBasisOrdering
+    start, end = [0, 1, 3, 0], [1, 2, 2, 3]
+    reference = [lambda r: (r, -1.0), lambda r: (1.0, r), lambda r: (r, 1.0), lambda r: (-1.0, r)]
+    traces = {}
+    for it,cell in enumerate(geom):
+        coefficients = u[dofs.dofConnectivity[it]] * signs[it]
+        for k in range(4):
+            direction = 1.0 if cell[start[k]] < cell[end[k]] else -1.0
+            trace = [coefficients.dot(quad.get_local_shape_vector(reference[k](direction*t))[ordering]) for t in (-0.7, 0.1, 0.6)]
+            traces.setdefault(geom.localEdgeConnectivity[it,k], []).append(trace)
+    for values in traces.values():
+        assert values[0] == pytest.approx(values[-1])
+    assert max(len(values) for values in traces.values()) == 2
 
 @pytest.mark.mpi(max_size=4)
 def test_sparse_mult():
@@ -96,8 +180,9 @@ def test_sparse_mult():
     from mpi4py import MPI
     globalB = geom.mpiComm.allreduce(localB, op=MPI.SUM)
 
-    matVect = array([9, 18, 9, 18, 36, 18, 9, 18, 9, 9, 9, 18, 9, 9, 18, 9, 18, 9, 9, 18, 9, 9, 9, 9, 9])
-    assert (globalB == matVect).all()
+    # Expected result per mesh DoF id: 9 times the number of elements sharing the DoF
+    matVect = array([9, 18, 9, 18, 36, 18, 9, 18, 9, 9, 9, 9, 18, 9, 18, 9, 18, 18, 9, 9, 9, 9, 9, 9, 9])
+    assert (globalB[helper_global_numbering(dofs)] == matVect).all()
 
     # Check Renumbering
     dofs.renumberDoFs()
@@ -110,6 +195,15 @@ def test_sparse_mult():
     globalB = geom.mpiComm.allreduce(localB, op=MPI.SUM)
 
     # Permute matvec array based on renumbered node ordering
-    order = sorted([it for it in range(len(dofs.dofMap))], key=lambda x: dofs.dofMap[x])
-    matVec_renum = array([matVect[it] for it in order])
-    assert (globalB == matVec_renum).all()
\ No newline at end of file
+    assert (globalB[helper_global_numbering(dofs)] == matVect).all()
+
+###################################################################################################
+# Helper functions
+###################################################################################################
+def helper_global_numbering(dofs):
+    # Global number of every mesh DoF id, gathered from all procs
+    numbering = -ones(dofs.globalDoFsize, dtype="int64")
+    for ids, numbers in dofs.geometry.mpiComm.allgather((dofs.localDoFIds, dofs.dofMap)):
+        assert (numbering[ids][numbering[ids] >= 0] == numbers[numbering[ids] >= 0]).all()
+        numbering[ids] = numbers
+    return numbering
\ No newline at end of file
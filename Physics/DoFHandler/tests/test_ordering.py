@@ -0,0 +1,41 @@
+from ..Ordering import adjacencyGraph, pseudoPeripheralNode, cuthillMcKee, reverseCuthillMcKee, bandwidth, profile
+from numpy import array, arange, concatenate
+from numpy.random import default_rng
+
+def test_path():
+    # Shuffled path graph is restored to a band of width 1
+    label = default_rng(3).permutation(10)
+    graph = adjacencyGraph(label[:-1], label[1:], 10)
+    assert bandwidth(graph) > 1
+
+    start = pseudoPeripheralNode(graph, label[4])
+    assert start in [label[0], label[-1]]
+    assert sorted(cuthillMcKee(graph, start)) == list(range(10))
+
+    order = reverseCuthillMcKee(graph)
+    permuted = graph[order][:, order]
+    assert bandwidth(permuted) == 1
+    assert profile(permuted) == 9
+
+def test_grid():
+    # 5-point stencil on an 8x6 grid, numbered column by column
+    nX, nY = 8, 6
+    ids = arange(nX*nY).reshape(nX, nY)
+    rows = concatenate([ids[:-1,:].ravel(), ids[:,:-1].ravel()])
+    cols = concatenate([ids[1:,:].ravel(), ids[:,1:].ravel()])
+    graph = adjacencyGraph(rows, cols, nX*nY)
+    assert bandwidth(graph) == nY
+
+    # Corners are peripheral
+    assert pseudoPeripheralNode(graph, ids[3,3]) in ids[[0,0,-1,-1],[0,-1,0,-1]]
+    order = reverseCuthillMcKee(graph)
+    permuted = graph[order][:, order]
+    assert bandwidth(permuted) <= nY
+    assert profile(permuted) < profile(graph)
+
+def test_components():
+    # Two disconnected triangles and an isolated vertex
+    graph = adjacencyGraph(array([0, 1, 2, 4, 5, 6]), array([1, 2, 0, 5, 6, 4]), 7)
+    order = reverseCuthillMcKee(graph)
+    assert sorted(order) == list(range(7))
+    assert bandwidth(graph[order][:, order]) == 2
@@ -0,0 +1,70 @@
+from numpy import array, ascontiguousarray, empty, einsum, flatnonzero, zeros, abs as npabs
+
+# Reference coordinates of the bilinear cell vertices (counter-clockwise)
+REFERENCE_VERTICES = array([[-1.0, -1.0], [1.0, -1.0], [1.0, 1.0], [-1.0, 1.0]])
+
+def mappingTables(points):
+    '''Return bilinear map values (nq, 4) and reference gradients (nq, 4, 2) at reference points (nq, 2)'''
+    xi, eta = points[:,0], points[:,1]
+    vx, vy = REFERENCE_VERTICES[:,0], REFERENCE_VERTICES[:,1]
+    values = 0.25 * (1.0 + xi[:,None]*vx) * (1.0 + eta[:,None]*vy)
+    grads = zeros((len(xi), 4, 2))
+    grads[:,:,0] = 0.25 * vx * (1.0 + eta[:,None]*vy)
+    grads[:,:,1] = 0.25 * vy * (1.0 + xi[:,None]*vx)
+    return values, grads
+
+def jacobians(coords, points):
+    '''Return J (nElem, nq, 2, 2), detJ (nElem, nq) and J^{-1} (nElem, nq, 2, 2)
+
+    J[e,q,a,b] = dx_b/dxi_a, matching MeshCell2D.getJacobian'''
+    _, grads = mappingTables(points)
+    J = einsum("qva,evb->eqab", grads, coords)
+
+    # Closed-form 2x2 inverse
+    detJ = J[...,0,0]*J[...,1,1] - J[...,0,1]*J[...,1,0]
+    invJ = empty(J.shape)
+    invJ[...,0,0] =  J[...,1,1] / detJ
+    invJ[...,0,1] = -J[...,0,1] / detJ
+    invJ[...,1,0] = -J[...,1,0] / detJ
+    invJ[...,1,1] =  J[...,0,0] / detJ
+    return J, detJ, invJ
+
+class GeometricFactors():
+    '''Mapping data of every local cell at the points of one quadrature rule
+
+    Stored as contiguous (nElem, nq, ...) arrays: detJ, J^{-1} and the metric
+    G = J^{-1}J^{-T} in the usual dx/dxi convention, so that grad_x u . grad_x v =
+    grad_xi u . G grad_xi v'''
+
+    def __init__(self, coords, points, tolerance=1.0e-12):
+        self._J, self._detJ, self._invJ = jacobians(coords, points)
+        self._metric = ascontiguousarray(einsum("eqca,eqcb->eqab", self._invJ, self._invJ))
+
+        # Degenerate cells have detJ small against the squared cell size, inverted cells negative
+        scale = npabs(self._J).max(axis=(1,2,3))**2 if len(coords) > 0 else zeros(0)
+        self._invalid = flatnonzero((self._detJ <= tolerance*scale[:,None]).any(axis=1))
+
+    @property
+    def jacobian(self):
+        return self._J
+
+    @property
+    def detJ(self):
+        return self._detJ
+
+    @property
+    def invJ(self):
+        return self._invJ
+
+    @property
+    def metric(self):
+        return self._metric
+
+    @property
+    def invalidElements(self):
+        '''Local cells with an inverted or degenerate map at some quadrature point'''
+        return self._invalid
+
+    @property
+    def nbytes(self):
+        return self._J.nbytes + self._detJ.nbytes + self._invJ.nbytes + self._metric.nbytes
@@ -1,17 +1,28 @@
 import meshio
-from numpy import linspace, sum, array
-from numpy.linalg import inv
+from numpy import linspace, array, asarray, ascontiguousarray, unique, argsort, bincount, cumsum, concatenate, \
+    empty, zeros, searchsorted, stack, lexsort, repeat, arange, intersect1d, prod
 from mpi4py import MPI
+from .Partitioner import Partitioner, CartesianPartitioner
+from .MeshTopology import uniqueEdges
+from .MeshCache import MeshCache
+from .GeometricFactors import GeometricFactors
+from .Writer import VTKWriter, XDMFWriter, AsyncWriter
 
 class Geometry2D():
-    def __init__(self):
+    def __init__(self, partitioner: Partitioner = None, cartComm=None):
         self._comm = MPI.COMM_WORLD
-        self._mpiRank = self._comm.Get_rank()
-        self._mpiSize = self._comm.Get_size()
 
-        # Parallel Decomposition
-        nBlockX, nBlockY = MPI.Compute_dims(self._mpiSize, 2)
-        self.cartComm = self._comm.Create_cart([nBlockX, nBlockY], [False, False], True)
+        # Parallel Decomposition; related meshes (e.g. multigrid levels) share one topology
+        if cartComm is None:
+            nBlockX, nBlockY = MPI.Compute_dims(self._comm.Get_size(), 2)
+            cartComm = self._comm.Create_cart([nBlockX, nBlockY], [False, False], True)
+        self.cartComm = cartComm
+        self._mpiRank = self.cartComm.Get_rank()
+        self._mpiSize = self.cartComm.Get_size()
+
+        # Cells are assigned to ranks by the partitioner on rank 0
+        self._partitioner = CartesianPartitioner(self.cartComm) if partitioner is None else partitioner
+        self._structuredGrid = None
 
     def __iter__(self):
         return GeometryIterator(self)
@@ -30,7 +41,7 @@ class Geometry2D():
     
     @property
     def globalNpoints(self):
-        return len(self._globalPoints)
+        return self._nGlobalPoints
     
     @property
     def globalNedges(self):
@@ -42,7 +53,42 @@ class Geometry2D():
     
     @property
     def localConnectivity(self):
+        '''Global vertex ids of the local cells (nElem, 4)'''
         return self._localConn
+
+    @property
+    def localCoordinates(self):
+        '''Vertex coordinates of the local cells (nElem, 4, 2)'''
+        return self._localCoords
+
+    @property
+    def localPointIds(self):
+        '''Sorted global ids of the points referenced by the local cells'''
+        return self._localPointIds
+
+    @property
+    def localPoints(self):
+        '''Coordinates (nPoints, 2) matching localPointIds'''
+        return self._localPoints
+
+    def updateCoordinates(self, points):
+        '''Move the local points (nPoints, 2) matching localPointIds; cached geometric factors are dropped'''
+        points = asarray(points, dtype="float64")
+        assert points.shape == self._localPoints.shape, "Expected one coordinate pair per local point"
+        self._localPoints = points.copy()
+        self._localCoords = ascontiguousarray(self._localPoints[searchsorted(self._localPointIds, self._localConn)])
+        self._geometricFactors = {}
+
+    def geometricFactors(self, quadrature):
+        '''GeometricFactors of the local cells at the quadrature points, cached by the rule's
+        number of points (the basis order does not enter)'''
+        factors = self._geometricFactors.get(quadrature.nPoints)
+        if factors is None:
+            factors = self._geometricFactors[quadrature.nPoints] = GeometricFactors(self._localCoords, quadrature.points)
+        return factors
+
+    def cell(self, index):
+        return MeshCell2D(self._localConn[index], self._localCoords[index])
     
     @property
     def localEdgeConnectivity(self):
@@ -50,147 +96,186 @@ class Geometry2D():
     
     @property
     def localBoundaryNodes(self):
+        '''Sorted global ids of this proc's points on each boundary, keyed by boundary name'''
         return self._boundaryNodes
 
+    @property
+    def localBoundarySegments(self):
+        '''Boundary line segments (nSeg, 2) touching this proc, keyed by boundary name'''
+        return self._boundarySegments
+
+    @property
+    def structuredGrid(self):
+        '''readInternal arguments (xExtent, nX, yExtent, nY) of a structured mesh, None otherwise'''
+        return self._structuredGrid
+
+    def coarsen(self):
+        '''Structured mesh with half the cells in each direction, on the same topology and partitioner'''
+        assert self._structuredGrid is not None, "Only readInternal meshes can be coarsened"
+        xExtent, nX, yExtent, nY = self._structuredGrid
+        assert nX % 2 == 0 and nY % 2 == 0, f"Cannot halve a {nX} x {nY} grid"
+        coarse = Geometry2D(self._partitioner, self.cartComm)
+        coarse.readInternal(xExtent=xExtent, nX=nX//2, yExtent=yExtent, nY=nY//2)
+        return coarse
+
     def readInternal(self, xExtent=(0,1), nX=4, yExtent=(0,1), nY=5):
-        xCoor = linspace(xExtent[0], xExtent[1], nX+1)
-        yCoor = linspace(yExtent[0], yExtent[1], nY+1)
-        self._globalPoints = array([[x,y,0] for y in yCoor for x in xCoor], dtype="float64")
-        cells = array([[jt*(nX+1)+it, jt*(nX+1)+it+1, (jt+1)*(nX+1)+it+1, (jt+1)*(nX+1)+it] for jt in range(nY) for it in range(nX)])
-        self._nGlobalElements = len(cells)
-
-        nBlockX, nBlockY = self.cartComm.dims
-        xDomain = linspace(xExtent[0], xExtent[1], nBlockX+1)
-        yDomain = linspace(yExtent[0], yExtent[1], nBlockY+1)
-        myExtentX = [ xDomain[self.cartComm.coords[0]], xDomain[self.cartComm.coords[0]+1] ]
-        myExtentY = [ yDomain[self.cartComm.coords[1]], yDomain[self.cartComm.coords[1]+1] ]
-    
-        myCell = lambda x: x[0] >= myExtentX[0] and x[0] < myExtentX[1] and x[1] >= myExtentY[0] and x[1] < myExtentY[1]
-        self._localConn = [MeshCell2D(v,self._globalPoints) for v in cells if myCell(sum( self._globalPoints[v], axis=0 )/4.0)]
-
-        edges = set()
-        for elem in cells:
-            for it,v in enumerate(elem):
-                e = tuple( sorted([v,elem[(it+1)%len(elem)]]) )
-                edges.add(e)
-        self._nGlobalEdges = len(edges)
-
-        # Construct Edge Connectivity
-        edge_indices = {e:it for it,e in enumerate(edges)}
-        self._local_edge_conn = []
-        for elem in self._localConn:
-            self._local_edge_conn.append([])
-            for it,v in enumerate(elem):
-                e = tuple( sorted([v,elem[(it+1)%len(elem)]]) )
-                self._local_edge_conn[-1].append(edge_indices[e])
-
-    def readGMsh(self, filename, boundaryNames = []):
+        # Boundaries are named like the GMsh rectangle: yneg, xneg, xpos, ypos
+        # Point (it, jt) has id jt*(nX+1)+it and cell (it, jt) starts from it
+        self._structuredGrid = (tuple(xExtent), nX, tuple(yExtent), nY)
+        points = cells = None
+        boundary = []
+        if self._mpiRank == 0:
+            xCoor = linspace(xExtent[0], xExtent[1], nX+1)
+            yCoor = linspace(yExtent[0], yExtent[1], nY+1)
+            points = array([[x,y] for y in yCoor for x in xCoor], dtype="float64")
+            cells = array([[jt*(nX+1)+it, jt*(nX+1)+it+1, (jt+1)*(nX+1)+it+1, (jt+1)*(nX+1)+it] for jt in range(nY) for it in range(nX)], dtype="int64")
+            ids = arange((nX+1)*(nY+1)).reshape(nY+1, nX+1)
+            boundary = [stack([line[:-1], line[1:]], axis=1) for line in (ids[0,:], ids[:,0], ids[:,-1], ids[-1,:])]
+        self.__distributeMesh(points, cells, ["yneg", "xneg", "xpos", "ypos"], boundary)
+
+    def readGMsh(self, filename, boundaryNames = [], cacheDirectory = None):
+        '''Read and decompose a GMsh file; with a cacheDirectory the decomposed mesh is stored
+        per rank after the first read and memory mapped by later runs of the same configuration'''
         assert filename[-4:] == ".msh", f"Expected GMsh *.msh found *{filename[-4:]}"
-        localMesh = None
-        if self.mpiRank == 0:
-            localMesh = meshio.read(filename, file_format="gmsh")
-        mesh = self.mpiComm.bcast(localMesh, root=0)
-        self._globalPoints = mesh.points
-
-        # Decompose the domain over processors
-        # Let MPI compute number of procs per dimension, then partition Lx Ly into that
-        # many sub regions
-        nBlockX, nBlockY = self.cartComm.dims
-        xExtent = [ min([x[0] for x in mesh.points]), max([x[0] for x in mesh.points]) ]
-        yExtent = [ min([x[1] for x in mesh.points]), max([x[1] for x in mesh.points]) ]
-        xDomain = linspace(xExtent[0], xExtent[1], nBlockX+1)
-        yDomain = linspace(yExtent[0], yExtent[1], nBlockY+1)
-
-        # Get the Extent of the domain for this proc.
-        # Use a cartesian topology to get the X,Y bounds for this proc
-        myExtentX = [ xDomain[self.cartComm.coords[0]], xDomain[self.cartComm.coords[0]+1] ]
-        myExtentY = [ yDomain[self.cartComm.coords[1]], yDomain[self.cartComm.coords[1]+1] ]
-
-        # Partition the connectivity
-        # Compute the centroid for a cell and determine whether it is bound by the current
-        # processor's extent. Assume there is only one region in the mesh
-        cells = [cell for cell in mesh.cells if cell.type == "quad"][0] # Reading in only quad elements, expecting only 1 region
-        self._nGlobalElements = len(cells)
-        myCell = lambda x: x[0] >= myExtentX[0] and x[0] < myExtentX[1] and x[1] >= myExtentY[0] and x[1] < myExtentY[1]
-        self._localConn = [MeshCell2D(v,self._globalPoints) for v in cells.data if myCell(sum( mesh.points[v], axis=0 )/4.0)]
-
-        # Calculate unique edge in mesh
-        # Iterate over all edges in an element, collect sorted pairs in a set
-        edges = set()
-        for elem in cells.data:
-            for it,v in enumerate(elem):
-                e = tuple( sorted([v,elem[(it+1)%len(elem)]]) )
-                edges.add(e)
-        self._nGlobalEdges = len(edges)
-
-        # Construct Edge Connectivity
-        edge_indices = {e:it for it,e in enumerate(edges)}
-        self._local_edge_conn = []
-        for elem in self._localConn:
-            self._local_edge_conn.append([])
-            for it,v in enumerate(elem):
-                e = tuple( sorted([v,elem[(it+1)%len(elem)]]) )
-                self._local_edge_conn[-1].append(edge_indices[e])
-        
-        # Boundary sets
-        # Boundaries show up as line-type cells. The order for the rectangle with hole
-        # starts at the hole and then goes -y, -x, +x, +y. Labeling physical lines in
-        # Gmsh disrupts the surface cell numbering for some reason.
-        # boundaryNames = ["inner", "yneg", "xneg", "xpos", "ypos"] # imposed based on hole geometry
-        boundary = [cell for cell in mesh.cells if cell.type == "line"]
-        assert len(boundary) == len(boundaryNames), "Boundary names don't match"
-
-        # Calculate the intersection between nodes contained in this proc's connectivity
-        # and the nodes on a given boundary.
-        nodeSet = set([vertex for elem in self._localConn for vertex in elem])
-        self._boundaryNodes = {key: list(set([vertex for elem in lines.data for vertex in elem]).intersection(nodeSet)) for key,lines in zip(boundaryNames, boundary)}
-
-    def writeVTKsolution(self, fileroot="solution", in_cell_data = {}, in_point_data = {}):
-        self.__writePVTU(fileroot)
-
-        # Add Domain decomposition data to output
-        local_point_data = {key:value for key,value in in_point_data.items()}
-        local_cell_data = {key:value for key,value in in_cell_data.items()}
-        local_cell_data["Rank"] = [ array([self._mpiRank for _ in self._localConn], dtype="int64") ]
-
-        # Create a new local mesh object
-        newMesh = meshio.Mesh(
-            self._globalPoints,
-            [("quad", [v.connectivity for v in self._localConn])],
-            cell_data=local_cell_data,
-            point_data=local_point_data
-        )
-        newMesh.write(f"solution_{self._mpiRank:0>5d}.vtu")
-
-    def __writePVTU(self, fileroot):
-        # Only write out 1 pvtu file for all procs
-        if self._mpiRank != 0:
-            return
-
-        # Output Header and parallel cell data
-        data = [
-            "<?xml version=\"1.0\"?>\n",
-            "<VTKFile type=\"PUnstructuredGrid\" version=\"0.1\" byte_order=\"LittleEndian\">\n",
-            "  <PUnstructuredGrid GhostLevel=\"0\">\n",
-            "    <PPoints>\n",
-            "      <PDataArray type=\"Float64\" Name=\"Points\" NumberOfComponents=\"3\" format=\"binary\"/>\n",
-            "    </PPoints>\n",
-            "    <PCellData>\n",
-            "      <PDataArray type=\"Int64\" Name=\"Rank\" format=\"binary\"/>\n",
-            "    </PCellData>\n"
-        ]
-
-        # Output parallel pieces
-        data += [f"    <Piece Source=\"{fileroot}_{it:0>5d}.vtu\"/>\n" for it in range(self._mpiSize)]
-
-        # Output Footer
-        data += [
-            "  </PUnstructuredGrid>\n",
-            "</VTKFile>\n"
-        ]
-
-        with open(fileroot+".pvtu", "w") as f:
-            f.writelines(data)
+        self._structuredGrid = None
+        if cacheDirectory is not None:
+            cache = MeshCache(cacheDirectory, filename, self._mpiSize, self._partitioner, boundaryNames) if self._mpiRank == 0 else None
+            cache = self.cartComm.bcast(cache, root=0)
+            exists = self.cartComm.bcast(cache.exists() if self._mpiRank == 0 else None, root=0)
+            if exists:
+                self.__setLocalMesh(boundaryNames, **cache.load(self._mpiRank))
+                return
+
+        points = cells = None
+        boundary = []
+        if self._mpiRank == 0:
+            mesh = meshio.read(filename, file_format="gmsh")
+            points = mesh.points[:,0:2]
+            # Reading in only quad elements, expecting only 1 region
+            cells = [cell for cell in mesh.cells if cell.type == "quad"][0].data
+
+            # Boundary sets
+            # Boundaries show up as line-type cells. The order for the rectangle with hole
+            # starts at the hole and then goes -y, -x, +x, +y. Labeling physical lines in
+            # Gmsh disrupts the surface cell numbering for some reason.
+            # boundaryNames = ["inner", "yneg", "xneg", "xpos", "ypos"] # imposed based on hole geometry
+            boundary = [cell.data for cell in mesh.cells if cell.type == "line"]
+        nBoundaries = self.cartComm.bcast(len(boundary), root=0)
+        assert nBoundaries == len(boundaryNames), "Boundary names don't match"
+
+        arrays = self.__distributeMesh(points, cells, boundaryNames, boundary)
+        if cacheDirectory is not None:
+            cache.save(self.cartComm, arrays)
+
+    def __distributeMesh(self, points, cells, boundaryNames, boundary):
+        # Rank 0 holds the global mesh. Every other rank receives only its own cells, the
+        # points those cells reference and the boundary segments touching them
+        sizes = owner = edgeConn = pointIds = pointRank = pointCoords = segments = segmentRank = None
+        if self._mpiRank == 0:
+            edges, edgeConn = uniqueEdges(cells)
+            sizes = (len(points), len(cells), len(edges))
+            owner = self._partitioner.partition(points, cells, self._mpiSize)
+
+            # Unique (rank, point) incidence, ordered by rank then point id
+            incidence = unique(stack([owner.repeat(4), cells.ravel()], axis=1), axis=0)
+            pointRank, pointIds = incidence[:,0], incidence[:,1]
+            pointCoords = points[pointIds]
+            segments, segmentRank = self.__boundarySegments(boundary, pointIds, pointRank)
+        sizes = self.cartComm.bcast(sizes, root=0)
+
+        indexType = "int32" if sizes[0] < 2**31 else "int64"
+        arrays = {"sizes": array(sizes, dtype="int64"),
+                  "connectivity": self.__scatterRows(cells, owner, indexType),
+                  "edgeConnectivity": self.__scatterRows(edgeConn, owner, "int64"),
+                  "pointIds": self.__scatterRows(pointIds, pointRank, "int64"),
+                  "points": self.__scatterRows(pointCoords, pointRank, "float64"),
+                  "segments": self.__scatterRows(segments, segmentRank, "int64")}
+        self.__setLocalMesh(boundaryNames, **arrays)
+        return arrays
+
+    def __setLocalMesh(self, boundaryNames, sizes, connectivity, edgeConnectivity, pointIds, points, segments):
+        self._nGlobalPoints, self._nGlobalElements, self._nGlobalEdges = [int(it) for it in sizes]
+        self._localConn = connectivity
+        self._local_edge_conn = edgeConnectivity
+        self._localPointIds = pointIds
+        self._localPoints = points
+        self._localCoords = ascontiguousarray(self._localPoints[searchsorted(self._localPointIds, self._localConn)])
+        self._geometricFactors = {}
+
+        # Boundary nodes are the intersection of this proc's points with each boundary
+        self._boundarySegments = {key: segments[segments[:,2] == it, 0:2] for it,key in enumerate(boundaryNames)}
+        self._boundaryNodes = {key: intersect1d(lines, self._localPointIds) for key,lines in self._boundarySegments.items()}
+
+    def __boundarySegments(self, boundary, pointIds, pointRank):
+        # Segment rows [node0, node1, boundary index], sent to every rank touching either node
+        if len(boundary) == 0:
+            return zeros((0, 3), dtype="int64"), zeros(0, dtype="int64")
+        segments = concatenate([concatenate([lines, zeros((len(lines),1), dtype=lines.dtype) + it], axis=1) for it,lines in enumerate(boundary)])
+
+        # Ranks touching each segment node from the point incidence sorted by point id
+        order = lexsort((pointRank, pointIds))
+        sortedIds, sortedRanks = pointIds[order], pointRank[order]
+        nodes = segments[:,0:2].ravel()
+        start = searchsorted(sortedIds, nodes, side="left")
+        counts = searchsorted(sortedIds, nodes, side="right") - start
+        offsets = arange(counts.sum()) - repeat(cumsum(counts) - counts, counts)
+        pairs = unique(stack([repeat(arange(len(nodes))//2, counts), sortedRanks[repeat(start, counts) + offsets]], axis=1), axis=0)
+        return segments[pairs[:,0]], pairs[:,1]
+
+    def __scatterRows(self, rows, owner, dtype):
+        # Scatterv the rows of a rank 0 array to their owning ranks, keeping their order
+        sendbuf = counts = rowShape = None
+        if self._mpiRank == 0:
+            order = argsort(owner, kind="stable")
+            sendbuf = ascontiguousarray(rows[order], dtype=dtype)
+            rowShape = sendbuf.shape[1:]
+            counts = bincount(owner, minlength=self._mpiSize) * int(prod(rowShape))
+        rowShape = self.cartComm.bcast(rowShape, root=0)
+        count = self.cartComm.scatter(counts, root=0)
+
+        recvbuf = empty(count, dtype=dtype)
+        if self._mpiRank == 0:
+            displs = concatenate([[0], cumsum(counts)[:-1]])
+            self.cartComm.Scatterv([sendbuf, (counts.tolist(), displs.tolist())], recvbuf, root=0)
+        else:
+            self.cartComm.Scatterv(None, recvbuf, root=0)
+        return recvbuf.reshape((-1,) + tuple(rowShape))
+
+    def writeVTKsolution(self, fileroot="solution", in_cell_data = {}, in_point_data = {}, compress=False):
+        '''Write this proc's piece {fileroot}_{rank}.vtu and the {fileroot}.pvtu index
+
+        Point data is given on localPointIds, cell data on the local cells (a one-block list as
+        used by meshio is also accepted)'''
+        unwrap = lambda data: {key: (value[0] if isinstance(value, list) else value) for key,value in data.items()}
+        return VTKWriter(self, fileroot, compress).write(pointData=unwrap(in_point_data), cellData=unwrap(in_cell_data))
+
+    def openOutput(self, fileroot="solution", format="vtk", asynchronous=True, maxPending=2, compress=False):
+        '''Start a time series written by writeOutput; asynchronous output uses a background thread'''
+        self.closeOutput()
+        if format == "vtk":
+            writer = VTKWriter(self, fileroot, compress)
+        elif format == "xdmf":
+            # The writer thread communicates on its own duplicate of the communicator
+            threaded = asynchronous and MPI.Query_thread() == MPI.THREAD_MULTIPLE
+            asynchronous = asynchronous and (threaded or self._mpiSize == 1)
+            writer = XDMFWriter(self, fileroot, comm=self.cartComm.Dup() if threaded else None)
+        else:
+            raise RuntimeError(f"Unsupported output format: {format}")
+        self._output = AsyncWriter(writer, maxPending) if asynchronous else writer
+        return self._output
+
+    def writeOutput(self, time, in_point_data = {}, in_cell_data = {}):
+        assert getattr(self, "_output", None) is not None, "No output open. Must Call Geometry2D.openOutput() first"
+        self._output.write(pointData=in_point_data, cellData=in_cell_data, time=time)
+
+    def flushOutput(self):
+        if isinstance(getattr(self, "_output", None), AsyncWriter):
+            self._output.flush()
+
+    def closeOutput(self):
+        output, self._output = getattr(self, "_output", None), None
+        if isinstance(output, AsyncWriter):
+            output.close()
 
 class GeometryIterator():
     def __init__(self, geom):
@@ -198,18 +283,21 @@ class GeometryIterator():
         self._index = 0
 
     def __next__(self):
-        if self._index < len(self._geom.localConn):
+        if self._index < len(self._geom.localConnectivity):
             self._index += 1
-            return self._geom.localConn[self._index-1]
+            return self._geom.cell(self._index-1)
         raise StopIteration
 
 class MeshCell2D():
-    def __init__(self, connectivity, points):
-        self.vertices = [points[c] for c in connectivity]
-        self.connectivity = [c for c in connectivity]
+    '''Lightweight view onto one row of the Geometry2D cell arrays'''
+    __slots__ = ("connectivity", "vertices")
+
+    def __init__(self, connectivity, vertices):
+        self.connectivity = connectivity
+        self.vertices = vertices
 
     def __iter__(self):
-        return MeshCellIterator(self)
+        return iter(self.connectivity)
 
     def __repr__(self):
         values = ", ".join([str(s) for s in self.connectivity])
@@ -222,25 +310,15 @@ class MeshCell2D():
         return self.connectivity[i]
 
     def getJacobian(self, xi, eta):
-        db_dxi  = 0.25 * array([-(1-eta), (1-eta), (1+eta), -(1+eta)])
-        db_deta = 0.25 * array([ -(1-xi), -(1+xi),  (1+xi),  (1-xi)])
-        return array([[ db_dxi.dot(array([v[0] for v in self.vertices])),  db_dxi.dot(array([v[1] for v in self.vertices]))],
-                      [db_deta.dot(array([v[0] for v in self.vertices])), db_deta.dot(array([v[1] for v in self.vertices]))]])
+        db = 0.25 * array([[-(1-eta), (1-eta), (1+eta), -(1+eta)],
+                           [ -(1-xi), -(1+xi),  (1+xi),  (1-xi)]])
+        return db.dot(self.vertices)
 
     def getInvJacobian(self, xi, eta):
-        return inv(self.getJacobian(xi,eta))
+        (a, b), (c, d) = self.getJacobian(xi, eta)
+        return array([[d, -b], [-c, a]]) / (a*d - b*c)
 
     def getPhysicalLocation(self, xi, eta):
         mapping = 0.25 * array([(1-xi)*(1-eta), (1+xi)*(1-eta), (1+xi)*(1+eta), (1-xi)*(1+eta)])
-        return mapping.dot(array([v[0] for v in self.vertices])), mapping.dot(array([v[1] for v in self.vertices]))
-
-class MeshCellIterator():
-    def __init__(self, meshCell):
-        self._cell = meshCell
-        self._index = 0
-
-    def __next__(self):
-        if self._index < len(self._cell.connectivity):
-            self._index += 1
-            return self._cell.connectivity[self._index-1]
-        raise StopIteration
\ No newline at end of file
+        x, y = mapping.dot(self.vertices)
+        return x, y
@@ -0,0 +1,59 @@
+from numpy import asarray, load, save
+from os import makedirs, path
+import hashlib
+
+# Per-rank arrays of a distributed mesh, one .npy file each so they can be memory mapped
+CACHE_ARRAYS = ["sizes", "connectivity", "edgeConnectivity", "pointIds", "points", "segments"]
+
+def fileHash(filename, blockSize=1 << 20):
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(blockSize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def partitionerSignature(partitioner):
+    '''Class name and plain parameters of a partitioner'''
+    params = sorted((key, value) for key, value in vars(partitioner).items() if isinstance(value, (int, float, str, bool)))
+    return f"{type(partitioner).__name__}{params}"
+
+class MeshCache():
+    '''Decomposed mesh stored per rank under {directory}/{key}/{rank}/
+
+    The key hashes the mesh file, the number of ranks, the partitioner and the boundary names,
+    so a cache is only reused for the same decomposition. Rank 0 writes a marker once every
+    rank has saved its arrays'''
+
+    def __init__(self, directory, filename, nParts, partitioner, boundaryNames):
+        signature = f"{fileHash(filename)}|{nParts}|{partitionerSignature(partitioner)}|{list(boundaryNames)}"
+        self._key = hashlib.sha1(signature.encode()).hexdigest()[:16]
+        self._root = path.join(directory, f"{path.splitext(path.basename(filename))[0]}_{self._key}")
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def root(self):
+        return self._root
+
+    def __marker(self):
+        return path.join(self._root, "complete")
+
+    def exists(self):
+        return path.exists(self.__marker())
+
+    def save(self, comm, arrays):
+        rank = comm.Get_rank()
+        directory = path.join(self._root, f"{rank:0>5d}")
+        makedirs(directory, exist_ok=True)
+        for name in CACHE_ARRAYS:
+            save(path.join(directory, name + ".npy"), asarray(arrays[name]))
+        comm.Barrier()
+        if rank == 0:
+            open(self.__marker(), "w").close()
+
+    def load(self, rank, mmapMode="r"):
+        '''Return the arrays of one rank, memory mapped read-only by default'''
+        directory = path.join(self._root, f"{rank:0>5d}")
+        return {name: load(path.join(directory, name + ".npy"), mmap_mode=mmapMode) for name in CACHE_ARRAYS}
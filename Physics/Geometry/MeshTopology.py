@@ -0,0 +1,29 @@
+from numpy import argsort, asarray, roll, searchsorted, sort, stack, unique, zeros
+
+def uniqueEdges(cells):
+    '''Return the global edges (nEdges, 2) and each cell's edge ids (nCells, nVertices)
+
+    Edge k of a cell joins vertex k to vertex k+1. Edges are numbered in lexicographic
+    order of their sorted vertex pairs, so the numbering only depends on the cells.'''
+    nCells, nVertices = cells.shape
+    pairs = sort(stack([cells, roll(cells, -1, axis=1)], axis=2).reshape(-1, 2), axis=1)
+    edges, inverse = unique(pairs, axis=0, return_inverse=True)
+    return edges, inverse.reshape(nCells, nVertices)
+
+def boundaryEdges(cells, segments):
+    '''Return (cell, local edge) of every segment (nSeg, 2) found among the cell edges
+
+    Segments without a matching cell edge are dropped'''
+    nCells, nVertices = cells.shape
+    if len(segments) == 0 or nCells == 0:
+        return zeros(0, dtype="int64"), zeros(0, dtype="int64")
+    pairs = sort(stack([cells, roll(cells, -1, axis=1)], axis=2).reshape(-1, 2), axis=1).astype("int64")
+    segments = sort(asarray(segments, dtype="int64"), axis=1)
+    base = max(pairs.max(), segments.max()) + 1
+    keys = pairs[:,0]*base + pairs[:,1]
+    segmentKeys = segments[:,0]*base + segments[:,1]
+
+    order = argsort(keys, kind="stable")
+    pos = searchsorted(keys[order], segmentKeys).clip(max=len(keys)-1)
+    found = order[pos[keys[order][pos] == segmentKeys]]
+    return found // nVertices, found % nVertices
@@ -0,0 +1,243 @@
+from numpy import array, arange, argsort, concatenate, flatnonzero, lexsort, linspace, minimum, ones, \
+    repeat, searchsorted, unique, zeros, bincount, where, argmax, ptp
+from numpy.random import default_rng
+from heapq import heapify, heappop, heappush
+from .MeshTopology import uniqueEdges
+from scipy.sparse import coo_array, csr_array, diags
+from scipy.sparse.csgraph import breadth_first_order
+
+class Partitioner():
+    '''Assign every global cell to a part; parts are ranks of the Geometry2D communicator'''
+
+    def partition(self, points, cells, nParts):
+        raise NotImplementedError("Partitioner must implement partition(points, cells, nParts)")
+
+class CartesianPartitioner(Partitioner):
+    '''Cells belong to the block of an MPI Cartesian topology containing their centroid'''
+
+    def __init__(self, cartComm):
+        self._cartComm = cartComm
+
+    def partition(self, points, cells, nParts):
+        assert nParts == self._cartComm.Get_size(), "Cartesian partition must match the communicator size"
+
+        # Let MPI compute number of procs per dimension, then partition Lx Ly into that
+        # many sub regions
+        nBlockX, nBlockY = self._cartComm.dims
+        lower, upper = points.min(axis=0), points.max(axis=0)
+        xDomain = linspace(lower[0], upper[0], nBlockX+1)
+        yDomain = linspace(lower[1], upper[1], nBlockY+1)
+
+        centroids = points[cells].mean(axis=1)
+        blockX = (searchsorted(xDomain, centroids[:,0], side="right") - 1).clip(0, nBlockX-1)
+        blockY = (searchsorted(yDomain, centroids[:,1], side="right") - 1).clip(0, nBlockY-1)
+        blockRank = array([[self._cartComm.Get_cart_rank([ix, iy]) for iy in range(nBlockY)] for ix in range(nBlockX)])
+        return blockRank[blockX, blockY]
+
+class RecursiveBisectionPartitioner(Partitioner):
+    '''Recursive coordinate bisection of the cell centroids along the longest extent'''
+
+    def partition(self, points, cells, nParts):
+        centroids = points[cells].mean(axis=1)
+        owner = zeros(len(cells), dtype="int64")
+        self.__bisect(centroids, arange(len(cells)), nParts, 0, owner)
+        return owner
+
+    def __bisect(self, centroids, ids, nParts, offset, owner):
+        if nParts == 1:
+            owner[ids] = offset
+            return
+
+        # Split the cell count in proportion to the number of parts on each side
+        nLeft = nParts // 2
+        local = centroids[ids]
+        axis = argmax(ptp(local, axis=0)) if len(ids) > 0 else 0
+        order = argsort(local[:,axis], kind="stable")
+        split = (len(ids) * nLeft) // nParts
+        self.__bisect(centroids, ids[order[:split]], nLeft, offset, owner)
+        self.__bisect(centroids, ids[order[split:]], nParts-nLeft, offset+nLeft, owner)
+
+class GraphPartitioner(Partitioner):
+    '''Multilevel recursive bisection of the cell dual graph
+
+    Each bisection coarsens by heavy-edge matching, bisects the coarsest graph by greedy
+    graph growing and refines the cut with boundary moves while uncoarsening'''
+
+    def __init__(self, imbalance=0.01, coarsestSize=64, refinementPasses=8, seed=0):
+        self._imbalance = imbalance
+        self._coarsestSize = coarsestSize
+        self._passes = refinementPasses
+        self._seed = seed
+
+    def partition(self, points, cells, nParts):
+        graph = dualGraph(cells)
+        owner = zeros(len(cells), dtype="int64")
+        rng = default_rng(self._seed)
+        self.__recursiveBisection(graph, ones(len(cells)), arange(len(cells)), nParts, 0, owner, rng)
+        return owner
+
+    def __recursiveBisection(self, graph, weights, ids, nParts, offset, owner, rng):
+        if nParts == 1:
+            owner[ids] = offset
+            return
+
+        nLeft = nParts // 2
+        side = self.bisect(graph, weights, nLeft/nParts, rng)
+        for s, n, start in ((0, nLeft, offset), (1, nParts-nLeft, offset+nLeft)):
+            sub = flatnonzero(side == s)
+            self.__recursiveBisection(graph[sub][:,sub], weights[sub], ids[sub], n, start, owner, rng)
+
+    def bisect(self, graph, weights, fraction, rng=None):
+        '''Return side (0/1) per vertex with a fraction of the total weight on side 0'''
+        rng = default_rng(self._seed) if rng is None else rng
+        n = graph.shape[0]
+        if n <= self._coarsestSize:
+            return self.__initialBisection(graph, weights, fraction, rng)
+
+        aggregate = heavyEdgeMatching(graph, rng)
+        nCoarse = aggregate.max() + 1
+        if nCoarse > 0.95*n:
+            # Coarsening has stalled
+            return self.__initialBisection(graph, weights, fraction, rng)
+
+        P = csr_array((ones(n), (arange(n), aggregate)), shape=(n, nCoarse))
+        coarse = (P.T @ graph @ P).tocsr()
+        coarse = (coarse - diags(coarse.diagonal())).tocsr()
+        coarse.eliminate_zeros()
+        side = self.bisect(coarse, P.T @ weights, fraction, rng)[aggregate]
+        return self.__refine(graph, weights, side, fraction)
+
+    def __initialBisection(self, graph, weights, fraction, rng):
+        # Greedy graph growing from a few seeds; keep the smallest refined cut
+        n = graph.shape[0]
+        best, bestCut = None, None
+        for seed in unique(concatenate([[0], rng.integers(0, max(n,1), size=3)])):
+            if n == 0:
+                break
+            visited = breadth_first_order(graph, seed, directed=False, return_predecessors=False)
+            rest = flatnonzero(~bincount(visited, minlength=n).astype(bool))
+            order = concatenate([visited, rest])
+            grown = searchsorted(weights[order].cumsum(), fraction*weights.sum(), side="right")
+            side = ones(n, dtype="int64")
+            side[order[:max(grown, 1)]] = 0
+            side = self.__refine(graph, weights, side, fraction)
+            cut = cutWeight(graph, side)
+            if bestCut is None or cut < bestCut:
+                best, bestCut = side, cut
+        return best if best is not None else zeros(0, dtype="int64")
+
+    def __refine(self, graph, weights, side, fraction):
+        # Restore balance with forced moves off the heavy side, then Fiduccia-Mattheyses passes
+        side = side.copy()
+        total = weights.sum()
+        target = fraction * total
+        tol = max(self._imbalance*min(target, total-target), weights.max() if len(weights) > 0 else 0.0)
+        w0 = weights[side == 0].sum()
+        while abs(w0 - target) > tol:
+            heavy = 0 if w0 > target else 1
+            gains = vertexGains(graph, side)
+            candidates = flatnonzero(side == heavy)
+            v = candidates[argmax(gains[candidates])]
+            side[v] = 1 - heavy
+            w0 += -weights[v] if heavy == 0 else weights[v]
+
+        for _ in range(self._passes):
+            side, improvement = self.__fmPass(graph, weights, side, target, tol)
+            if improvement <= 0:
+                break
+        return side
+
+    def __fmPass(self, graph, weights, side, target, tol, maxStall=100):
+        # Move boundary vertices in order of decreasing gain (each at most once), then roll
+        # back to the best balanced prefix of the move sequence
+        indptr, indices, data = graph.indptr, graph.indices, graph.data
+        gains = vertexGains(graph, side)
+        degree = bincount(graph.tocoo().row, weights=graph.tocoo().data, minlength=len(side))
+        locked = zeros(len(side), dtype=bool)
+        heap = [(-gains[v], v) for v in flatnonzero(gains > -degree)]
+        heapify(heap)
+
+        w0 = weights[side == 0].sum()
+        moves, cumulative, best, bestCount = [], 0.0, 0.0, 0
+        while heap and len(moves) - bestCount < maxStall:
+            g, v = heappop(heap)
+            if locked[v] or -g != gains[v]:
+                continue
+            newW0 = w0 - weights[v] if side[v] == 0 else w0 + weights[v]
+            if abs(newW0 - target) > tol:
+                continue
+
+            # Neighbours on the old side gain, neighbours on the new side lose
+            for u, w in zip(indices[indptr[v]:indptr[v+1]], data[indptr[v]:indptr[v+1]]):
+                gains[u] += 2.0*w if side[u] == side[v] else -2.0*w
+                if not locked[u]:
+                    heappush(heap, (-gains[u], u))
+            side[v] = 1 - side[v]
+            gains[v] = -gains[v]
+            locked[v] = True
+            w0 = newW0
+            cumulative += -g
+            moves.append(v)
+            if cumulative > best:
+                best, bestCount = cumulative, len(moves)
+
+        for v in moves[bestCount:]:
+            side[v] = 1 - side[v]
+        return side, best
+
+def dualGraph(cells):
+    '''Cell adjacency (csr_array) through shared edges'''
+    nCells, nVertices = cells.shape
+    _, edgeId = uniqueEdges(cells)
+    edgeId = edgeId.ravel()
+    cellOf = repeat(arange(nCells), nVertices)
+
+    # Interior edges appear twice once sorted by edge id
+    order = argsort(edgeId, kind="stable")
+    edgeId, cellOf = edgeId[order], cellOf[order]
+    shared = flatnonzero(edgeId[1:] == edgeId[:-1])
+    a, b = cellOf[shared], cellOf[shared+1]
+    return coo_array((ones(2*len(a)), (concatenate([a, b]), concatenate([b, a]))), shape=(nCells, nCells)).tocsr()
+
+def heavyEdgeMatching(graph, rng, rounds=4):
+    '''Return the coarse vertex of every vertex after matching mutual heaviest neighbours'''
+    n = graph.shape[0]
+    match = -ones(n, dtype="int64")
+    A = graph.tocoo()
+    rows, cols = A.row, A.col
+    weight = A.data + 1.0e-6*rng.random(len(A.data))
+    for _ in range(rounds):
+        free = match < 0
+        keep = free[rows] & free[cols]
+        if not keep.any():
+            break
+        r, c, w = rows[keep], cols[keep], weight[keep]
+        order = lexsort((-w, r))
+        r, c = r[order], c[order]
+        first = ones(len(r), dtype=bool)
+        first[1:] = r[1:] != r[:-1]
+        best = -ones(n, dtype="int64")
+        best[r[first]] = c[first]
+        chosen = flatnonzero(best >= 0)
+        mutual = chosen[best[best[chosen]] == chosen]
+        match[mutual] = best[mutual]
+
+    match = where(match < 0, arange(n), match)
+    _, aggregate = unique(minimum(arange(n), match), return_inverse=True)
+    return aggregate.ravel()
+
+def vertexGains(graph, side):
+    '''Cut reduction from moving each vertex to the other side'''
+    A = graph.tocoo()
+    external = side[A.row] != side[A.col]
+    return bincount(A.row, weights=where(external, A.data, -A.data), minlength=graph.shape[0])
+
+def cutWeight(graph, side):
+    A = graph.tocoo()
+    return A.data[side[A.row] != side[A.col]].sum() / 2.0
+
+def partitionQuality(cells, owner, nParts):
+    '''Return (max/mean element imbalance, number of cut edges, elements per part)'''
+    counts = bincount(owner, minlength=nParts)
+    graph = dualGraph(cells)
+    return counts.max() / (len(cells)/nParts), int(cutWeight(graph, owner)), counts
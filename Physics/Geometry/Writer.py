@@ -0,0 +1,305 @@
+from numpy import arange, array, ascontiguousarray, asarray, copyto, empty, full, searchsorted, uint8, zeros
+from os import path
+from queue import Queue
+from threading import Thread
+from time import perf_counter
+import zlib
+
+# VTK cell type of a bilinear quad
+VTK_QUAD = 9
+
+VTK_TYPES = {"float64": "Float64", "float32": "Float32", "int64": "Int64", "int32": "Int32", "uint8": "UInt8"}
+
+def localMesh(geom):
+    '''Return this proc's points (nPoints, 3) and quads renumbered to them (nElem, 4)'''
+    points = zeros((len(geom.localPoints), 3))
+    points[:,0:2] = geom.localPoints
+    return points, searchsorted(geom.localPointIds, geom.localConnectivity).astype("int64")
+
+def dataArrayShape(values):
+    values = asarray(values)
+    return values.dtype.name, (1 if values.ndim == 1 else values.shape[1])
+
+class VTKWriter():
+    '''Per-proc .vtu pieces of the local points and cells with binary appended data, plus one
+    .pvtu naming them. Successive writes form a time series indexed by a .pvd collection'''
+
+    def __init__(self, geom, fileroot="solution", compress=False):
+        self._geom = geom
+        self._fileroot = fileroot
+        self._compress = compress
+        self._steps = []
+        self._points, self._connectivity = localMesh(geom)
+
+    @property
+    def fileroot(self):
+        return self._fileroot
+
+    def pieceName(self, rank, step=None):
+        stem = path.basename(self._fileroot) if step is None else f"{path.basename(self._fileroot)}_{step:0>4d}"
+        return f"{stem}_{rank:0>5d}.vtu"
+
+    def write(self, pointData={}, cellData={}, time=None):
+        '''Write one output step; returns the .pvtu file name
+
+        A time of None writes {fileroot}.pvtu once, otherwise {fileroot}_{step}.pvtu and the
+        {fileroot}.pvd collection'''
+        step = None if time is None else len(self._steps)
+        cellData = dict(cellData)
+        cellData["Rank"] = full(len(self._connectivity), self._geom.mpiRank, dtype="int64")
+
+        directory = path.dirname(self._fileroot)
+        self.writePiece(path.join(directory, self.pieceName(self._geom.mpiRank, step)), pointData, cellData)
+        stem = self._fileroot if step is None else f"{self._fileroot}_{step:0>4d}"
+        if self._geom.mpiRank == 0:
+            self.__writePVTU(stem + ".pvtu", step, pointData, cellData)
+        if step is not None:
+            self._steps.append((time, path.basename(stem) + ".pvtu"))
+            if self._geom.mpiRank == 0:
+                self.__writePVD()
+        return stem + ".pvtu"
+
+    def writePiece(self, filename, pointData, cellData):
+        nCells = len(self._connectivity)
+        arrays = [("Points", self._points, "Points")]
+        arrays += [(name, values, "PointData") for name, values in pointData.items()]
+        arrays += [(name, values, "CellData") for name, values in cellData.items()]
+        arrays += [("connectivity", self._connectivity.ravel(), "Cells"),
+                   ("offsets", 4*arange(1, nCells+1, dtype="int64"), "Cells"),
+                   ("types", full(nCells, VTK_QUAD, dtype=uint8), "Cells")]
+
+        # Headers reference byte offsets into the appended block
+        blocks, offset, tags = [], 0, {"Points": [], "PointData": [], "CellData": [], "Cells": []}
+        for name, values, section in arrays:
+            values = ascontiguousarray(values)
+            block = self.__encode(values)
+            dtype, components = dataArrayShape(values)
+            tags[section].append(f"        <DataArray type=\"{VTK_TYPES[dtype]}\" Name=\"{name}\" NumberOfComponents=\"{components}\" format=\"appended\" offset=\"{offset}\"/>\n")
+            blocks.append(block)
+            offset += len(block)
+
+        compressor = " compressor=\"vtkZLibDataCompressor\"" if self._compress else ""
+        header = [
+            "<?xml version=\"1.0\"?>\n",
+            f"<VTKFile type=\"UnstructuredGrid\" version=\"1.0\" byte_order=\"LittleEndian\" header_type=\"UInt64\"{compressor}>\n",
+            "  <UnstructuredGrid>\n",
+            f"    <Piece NumberOfPoints=\"{len(self._points)}\" NumberOfCells=\"{nCells}\">\n",
+        ]
+        for section in ["PointData", "CellData", "Points", "Cells"]:
+            header += [f"      <{section}>\n"] + tags[section] + [f"      </{section}>\n"]
+        header += ["    </Piece>\n", "  </UnstructuredGrid>\n", "  <AppendedData encoding=\"raw\">\n   _"]
+
+        with open(filename, "wb") as f:
+            f.write("".join(header).encode())
+            for block in blocks:
+                f.write(block)
+            f.write(b"\n  </AppendedData>\n</VTKFile>\n")
+
+    def __encode(self, values):
+        raw = values.astype(values.dtype.newbyteorder("<")).tobytes()
+        if not self._compress:
+            return array([len(raw)], dtype="<u8").tobytes() + raw
+        # Single zlib block: [nBlocks, blockSize, lastBlockSize, compressedSize]
+        packed = zlib.compress(raw)
+        return array([1, len(raw), len(raw), len(packed)], dtype="<u8").tobytes() + packed
+
+    def __writePVTU(self, filename, step, pointData, cellData):
+        pdata = lambda name, values: "      <PDataArray type=\"{0}\" Name=\"{1}\" NumberOfComponents=\"{2}\"/>\n".format(VTK_TYPES[dataArrayShape(values)[0]], name, dataArrayShape(values)[1])
+        data = [
+            "<?xml version=\"1.0\"?>\n",
+            "<VTKFile type=\"PUnstructuredGrid\" version=\"1.0\" byte_order=\"LittleEndian\" header_type=\"UInt64\">\n",
+            "  <PUnstructuredGrid GhostLevel=\"0\">\n",
+            "    <PPointData>\n"] + [pdata(name, values) for name, values in pointData.items()] + [
+            "    </PPointData>\n",
+            "    <PCellData>\n"] + [pdata(name, values) for name, values in cellData.items()] + [
+            "    </PCellData>\n",
+            "    <PPoints>\n",
+            "      <PDataArray type=\"Float64\" Name=\"Points\" NumberOfComponents=\"3\"/>\n",
+            "    </PPoints>\n"
+        ]
+        data += [f"    <Piece Source=\"{self.pieceName(it, step)}\"/>\n" for it in range(self._geom.mpiSize)]
+        data += ["  </PUnstructuredGrid>\n", "</VTKFile>\n"]
+        with open(filename, "w") as f:
+            f.writelines(data)
+
+    def __writePVD(self):
+        data = ["<?xml version=\"1.0\"?>\n",
+                "<VTKFile type=\"Collection\" version=\"1.0\" byte_order=\"LittleEndian\">\n",
+                "  <Collection>\n"]
+        data += [f"    <DataSet timestep=\"{time}\" part=\"0\" file=\"{name}\"/>\n" for time, name in self._steps]
+        data += ["  </Collection>\n", "</VTKFile>\n"]
+        with open(self._fileroot + ".pvd", "w") as f:
+            f.writelines(data)
+
+class XDMFWriter():
+    '''Single shared HDF5 file with an XDMF index
+
+    The mesh (global points and cells) is written once; every step only appends field data.
+    Rank 0 gathers the rows of every proc and is the only one to open the file'''
+
+    def __init__(self, geom, fileroot="solution", comm=None):
+        try:
+            import h5py
+        except ImportError:
+            raise RuntimeError("XDMF output requires h5py")
+        self._h5py = h5py
+        self._geom = geom
+        self._fileroot = fileroot
+        self._steps = []
+
+        # A duplicate of the geometry communicator keeps writes off the solver's messages
+        self._comm = geom.mpiComm if comm is None else comm
+        self._cellOffset = self._comm.exscan(len(geom.localConnectivity)) or 0
+        self.__writeMesh()
+
+    @property
+    def h5Filename(self):
+        return self._fileroot + ".h5"
+
+    def __writeMesh(self):
+        geom = self._geom
+        points = zeros((len(geom.localPoints), 3))
+        points[:,0:2] = geom.localPoints
+        self.__writeRows("w", [("mesh/points", geom.globalNpoints, geom.localPointIds, points),
+                               ("mesh/cells", geom.globalNelements, self.__cellRows(), asarray(geom.localConnectivity, dtype="int64"))])
+
+    def __cellRows(self):
+        return self._cellOffset + arange(len(self._geom.localConnectivity))
+
+    def __writeRows(self, mode, datasets):
+        '''Gather (name, global rows, row ids, values) datasets on rank 0, which writes them;
+        shared rows carry the same values on every proc'''
+        comm = self._comm
+        gathered = [comm.gather((rows, asarray(values)), root=0) for _, _, rows, values in datasets]
+        if self._geom.mpiRank == 0:
+            with self._h5py.File(self.h5Filename, mode) as f:
+                for (name, nRows, _, values), parts in zip(datasets, gathered):
+                    result = empty((nRows,) + asarray(values).shape[1:], dtype=asarray(values).dtype)
+                    for rows, part in parts:
+                        result[rows] = part
+                    f.create_dataset(name, data=result)
+        comm.Barrier()
+
+    def write(self, pointData={}, cellData={}, time=None):
+        '''Append one step of point data (values on localPointIds) and cell data; returns the .xmf name'''
+        geom = self._geom
+        step = len(self._steps)
+        datasets = [(f"fields/{step:0>4d}/{name}", geom.globalNpoints, geom.localPointIds, values) for name, values in pointData.items()]
+        datasets += [(f"fields/{step:0>4d}/{name}", geom.globalNelements, self.__cellRows(), values) for name, values in cellData.items()]
+        self.__writeRows("a", datasets)
+        self._steps.append((float(step) if time is None else time,
+                            [(name, "Node", dataArrayShape(v)) for name, v in pointData.items()] +
+                            [(name, "Cell", dataArrayShape(v)) for name, v in cellData.items()]))
+        if geom.mpiRank == 0:
+            self.__writeXDMF()
+        return self._fileroot + ".xmf"
+
+    def __writeXDMF(self):
+        geom = self._geom
+        h5 = path.basename(self.h5Filename)
+        numberType = lambda dtype: ("Float", 8) if dtype.startswith("float") else ("Int", 8 if dtype.endswith("64") else 4)
+        data = ["<?xml version=\"1.0\"?>\n",
+                "<Xdmf Version=\"3.0\">\n",
+                "  <Domain>\n",
+                "    <Grid Name=\"TimeSeries\" GridType=\"Collection\" CollectionType=\"Temporal\">\n"]
+        for step, (time, fields) in enumerate(self._steps):
+            data += [
+                f"      <Grid Name=\"step_{step:0>4d}\" GridType=\"Uniform\">\n",
+                f"        <Time Value=\"{time}\"/>\n",
+                f"        <Topology TopologyType=\"Quadrilateral\" NumberOfElements=\"{geom.globalNelements}\">\n",
+                f"          <DataItem Dimensions=\"{geom.globalNelements} 4\" NumberType=\"Int\" Precision=\"8\" Format=\"HDF\">{h5}:/mesh/cells</DataItem>\n",
+                "        </Topology>\n",
+                "        <Geometry GeometryType=\"XYZ\">\n",
+                f"          <DataItem Dimensions=\"{geom.globalNpoints} 3\" NumberType=\"Float\" Precision=\"8\" Format=\"HDF\">{h5}:/mesh/points</DataItem>\n",
+                "        </Geometry>\n"]
+            for name, center, (dtype, components) in fields:
+                rows = geom.globalNpoints if center == "Node" else geom.globalNelements
+                kind, precision = numberType(dtype)
+                attribute = "Scalar" if components == 1 else "Vector"
+                dims = f"{rows}" if components == 1 else f"{rows} {components}"
+                data += [
+                    f"        <Attribute Name=\"{name}\" AttributeType=\"{attribute}\" Center=\"{center}\">\n",
+                    f"          <DataItem Dimensions=\"{dims}\" NumberType=\"{kind}\" Precision=\"{precision}\" Format=\"HDF\">{h5}:/fields/{step:0>4d}/{name}</DataItem>\n",
+                    "        </Attribute>\n"]
+            data += ["      </Grid>\n"]
+        data += ["    </Grid>\n", "  </Domain>\n", "</Xdmf>\n"]
+        with open(self._fileroot + ".xmf", "w") as f:
+            f.writelines(data)
+
+class AsyncWriter():
+    '''Hand output steps of a VTKWriter or XDMFWriter to a background thread
+
+    write() copies the fields into one of maxPending+1 reusable buffer sets and returns; it
+    blocks only when every buffer set is still queued or being written (backpressure). Errors
+    raised by the writer thread are re-raised by write, flush and close'''
+
+    def __init__(self, writer, maxPending=2):
+        self._writer = writer
+        self._queue = Queue(maxsize=maxPending)
+        self._free = Queue()
+        for _ in range(maxPending+1):
+            self._free.put({})
+        self._error = None
+        self._stallTime = 0.0
+        self._thread = Thread(target=self.__run, daemon=True)
+        self._thread.start()
+
+    @property
+    def writer(self):
+        return self._writer
+
+    @property
+    def stallTime(self):
+        '''Seconds write() spent waiting for a free buffer set'''
+        return self._stallTime
+
+    def write(self, pointData={}, cellData={}, time=None):
+        self.__raise()
+        start = perf_counter()
+        buffers = self._free.get()
+        self._stallTime += perf_counter() - start
+
+        snapshot = {}
+        for section, data in (("point", pointData), ("cell", cellData)):
+            for name, values in data.items():
+                values = asarray(values)
+                buffer = buffers.get((section, name))
+                if buffer is None or buffer.shape != values.shape or buffer.dtype != values.dtype:
+                    buffer = buffers[(section, name)] = empty(values.shape, dtype=values.dtype)
+                copyto(buffer, values)
+                snapshot[(section, name)] = buffer
+        self._queue.put((buffers, snapshot, time))
+
+    def flush(self):
+        '''Wait until every queued step is written'''
+        self._queue.join()
+        self.__raise()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self.__raise()
+
+    def __raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def __run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            buffers, snapshot, time = item
+            try:
+                if self._error is None:
+                    pointData = {name: v for (section, name), v in snapshot.items() if section == "point"}
+                    cellData = {name: v for (section, name), v in snapshot.items() if section == "cell"}
+                    self._writer.write(pointData=pointData, cellData=cellData, time=time)
+            except Exception as error:
+                self._error = error
+            finally:
+                self._free.put(buffers)
+                self._queue.task_done()
@@ -0,0 +1,38 @@
+from ..Geometry2D import Geometry2D
+from ...Quadrature.Quadrature import Quadrature2D
+import pytest
+from numpy.linalg import inv
+
+@pytest.mark.mpi(max_size=4)
+def test_geometricFactors():
+    geom = Geometry2D()
+    geom.readInternal(xExtent=(0,2), nX=4, yExtent=(0,1), nY=2)
+    quad = Quadrature2D(order=2)
+
+    factors = geom.geometricFactors(quad)
+    assert geom.geometricFactors(quad) is factors
+    assert geom.geometricFactors(Quadrature2D(order=3)) is not factors
+    assert geom.geometricFactors(Quadrature2D(order=4, nPoints=3)) is factors
+    assert factors.detJ.shape == (len(geom.localConnectivity), 9)
+    assert factors.metric.flags["C_CONTIGUOUS"]
+    for it,cell in enumerate(geom):
+        for qt,(q_xi, q_eta, _) in enumerate(quad):
+            J = cell.getJacobian(q_xi, q_eta)
+            assert factors.invJ[it,qt] == pytest.approx(inv(J))
+            assert cell.getInvJacobian(q_xi, q_eta) == pytest.approx(inv(J))
+            assert factors.metric[it,qt] == pytest.approx(inv(J).T.dot(inv(J)))
+    assert len(factors.invalidElements) == 0
+
+    # Moving the mesh drops the cache
+    geom.updateCoordinates(2.0*geom.localPoints)
+    moved = geom.geometricFactors(quad)
+    assert moved is not factors
+    assert moved.detJ == pytest.approx(4.0*factors.detJ)
+
+    # Dragging point 6 (now x=1, y=1) past its right neighbours at x=2 inverts the cells between them
+    points = geom.localPoints.copy()
+    points[geom.localPointIds == 6] = [3.0, 0.5]
+    geom.updateCoordinates(points)
+    invalid = geom.localConnectivity[geom.geometricFactors(quad).invalidElements]
+    assert (invalid == 6).any(axis=1).all()
+    assert geom.mpiComm.allreduce(len(invalid)) > 0
@@ -57,10 +57,132 @@ def test_readGmshGeom(tmpdir):
         elif rank == 3:
             assert len(geom.localConnectivity) == 5.0
 
+@pytest.mark.mpi(max_size=4)
+def test_distributedRead(tmpdir):
+    import meshio
+    from numpy import unique, intersect1d
+    from mpi4py import MPI
+
+    with open(os.path.join(tmpdir, "test.msh"), "w") as f:
+        f.writelines(getTestGMshFile())
+    names = ["inner", "yneg", "xneg", "xpos", "ypos"]
+    geom = Geometry2D()
+    geom.readGMsh(os.path.join(tmpdir, "test.msh"), boundaryNames=names)
+    mesh = meshio.read(os.path.join(tmpdir, "test.msh"))
+
+    assert geom.globalNpoints == 28
+    assert geom.globalNelements == 18
+    # Every quad edge is shared twice except the 20 boundary segments
+    assert geom.globalNedges == (4*18 + 20) // 2
+    assert geom.mpiComm.allreduce(len(geom.localConnectivity), op=MPI.SUM) == 18
+
+    # Only the points referenced by local cells are held on this proc
+    assert list(geom.localPointIds) == list(unique(geom.localConnectivity))
+    assert geom.localCoordinates == pytest.approx(mesh.points[geom.localConnectivity, 0:2])
+
+    # Boundary nodes match the intersection with the full boundary sets
+    lines = [cell.data for cell in mesh.cells if cell.type == "line"]
+    for key,data in zip(names, lines):
+        assert list(geom.localBoundaryNodes[key]) == list(intersect1d(data, geom.localPointIds))
+        for segment in geom.localBoundarySegments[key]:
+            assert len(intersect1d(segment, geom.localPointIds)) > 0
+
+def test_uniqueEdges():
+    from ..MeshTopology import uniqueEdges
+    from numpy import array, bincount
+    cells = array([[0,1,4,3], [1,2,5,4], [3,4,7,6], [4,5,8,7]])
+    edges, edgeConn = uniqueEdges(cells)
+
+    assert edges.shape == (12, 2)
+    assert (edges[:,0] < edges[:,1]).all()
+    assert edgeConn.shape == (4, 4)
+    assert list(edgeConn[0]) == [0, 3, 5, 1]
+    # Four interior edges are shared by two cells
+    assert sorted(bincount(edgeConn.ravel())) == [1]*8 + [2]*4
+    for cell,conn in zip(cells, edgeConn):
+        for it,e in enumerate(conn):
+            assert sorted([cell[it], cell[(it+1)%4]]) == list(edges[e])
+
+def test_boundaryEdges():
+    from ..MeshTopology import boundaryEdges
+    from numpy import array
+    cells = array([[0,1,4,3], [1,2,5,4], [3,4,7,6], [4,5,8,7]])
+    # Bottom and right segments, one reversed, and one not on any cell edge
+    cell, edge = boundaryEdges(cells, array([[0,1], [2,1], [5,8], [0,8]]))
+    assert list(cell) == [0, 1, 3]
+    assert list(edge) == [0, 0, 1]
+
+@pytest.mark.mpi(max_size=4)
+def test_internalBoundaries():
+    geom = Geometry2D()
+    geom.readInternal(nX=3, nY=2)
+    assert sorted(geom.localBoundarySegments.keys()) == ["xneg", "xpos", "yneg", "ypos"]
+    nodes = {key: set().union(*geom.mpiComm.allgather(value.tolist())) for key,value in geom.localBoundaryNodes.items()}
+    assert nodes["yneg"] == {0, 1, 2, 3}
+    assert nodes["xneg"] == {0, 4, 8}
+    assert nodes["xpos"] == {3, 7, 11}
+    assert nodes["ypos"] == {8, 9, 10, 11}
+
+def test_arrayStorage():
+    from numpy import shares_memory, array
+    geom = Geometry2D()
+    geom.readInternal(xExtent=(0,2), nX=4, yExtent=(0,1), nY=2)
+
+    nElem = len(geom.localConnectivity)
+    assert geom.localConnectivity.shape == (nElem, 4)
+    assert geom.localConnectivity.dtype.kind == "i"
+    assert geom.localCoordinates.shape == (nElem, 4, 2)
+
+    # Cells are views onto the mesh arrays
+    for it,cell in enumerate(geom):
+        assert shares_memory(cell.vertices, geom.localCoordinates)
+        assert list(cell) == list(geom.localConnectivity[it])
+        J = cell.getJacobian(0.3, -0.2)
+        assert J == pytest.approx(array([[0.25, 0.0], [0.0, 0.25]]))
+    assert it == nElem-1
+
 
 #====================================================================================
 # Helper functions
 #====================================================================================
+@pytest.mark.mpi(max_size=4)
+def test_meshCache(tmpdir):
+    from mpi4py import MPI
+    from numpy import memmap
+    from ..Partitioner import RecursiveBisectionPartitioner
+
+    # Every proc must see rank 0's files
+    directory = MPI.COMM_WORLD.bcast(str(tmpdir), root=0)
+    filename = os.path.join(directory, "test.msh")
+    if MPI.COMM_WORLD.Get_rank() == 0:
+        with open(filename, "w") as f:
+            f.writelines(getTestGMshFile())
+    MPI.COMM_WORLD.Barrier()
+    names = ["inner", "yneg", "xneg", "xpos", "ypos"]
+
+    reference = Geometry2D()
+    reference.readGMsh(filename, boundaryNames=names, cacheDirectory=directory)
+    cached = Geometry2D()
+    cached.readGMsh(filename, boundaryNames=names, cacheDirectory=directory)
+
+    # The second read maps the arrays written by the first
+    assert isinstance(cached.localConnectivity, memmap)
+    assert (cached.globalNpoints, cached.globalNelements, cached.globalNedges) == \
+        (reference.globalNpoints, reference.globalNelements, reference.globalNedges)
+    assert (cached.localConnectivity == reference.localConnectivity).all()
+    assert (cached.localEdgeConnectivity == reference.localEdgeConnectivity).all()
+    assert (cached.localPointIds == reference.localPointIds).all()
+    assert (cached.localCoordinates == reference.localCoordinates).all()
+    for key in names:
+        assert (cached.localBoundaryNodes[key] == reference.localBoundaryNodes[key]).all()
+        assert (cached.localBoundarySegments[key] == reference.localBoundarySegments[key]).all()
+
+    # A different partitioner is a different decomposition
+    other = Geometry2D(RecursiveBisectionPartitioner())
+    other.readGMsh(filename, boundaryNames=names, cacheDirectory=directory)
+    assert not isinstance(other.localConnectivity, memmap)
+    assert len(os.listdir(directory)) == 3
+
 def getTestGMshFile():
     return [
         "$MeshFormat\n",
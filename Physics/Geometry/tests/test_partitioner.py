@@ -0,0 +1,66 @@
+from ..Partitioner import RecursiveBisectionPartitioner, GraphPartitioner, dualGraph, partitionQuality
+from ..Geometry2D import Geometry2D
+from .test_gmsh import getTestGMshFile
+import pytest, os
+from numpy import array, linspace
+
+def test_dualGraph():
+    points, cells = helper_grid(2, 2)
+    graph = dualGraph(cells)
+    assert graph.shape == (4, 4)
+    # Each cell of a 2x2 grid shares an edge with two others
+    assert list(graph.sum(axis=1)) == [2, 2, 2, 2]
+    assert graph[0,1] == 1 and graph[0,2] == 1 and graph[0,3] == 0
+
+@pytest.mark.parametrize("nParts", [2, 3, 4, 5, 8])
+@pytest.mark.parametrize("partitioner", [RecursiveBisectionPartitioner(), GraphPartitioner()])
+def test_balance(partitioner, nParts):
+    points, cells = helper_grid(16, 16)
+    owner = partitioner.partition(points, cells, nParts)
+    imbalance, cut, counts = partitionQuality(cells, owner, nParts)
+
+    assert len(counts) == nParts and counts.min() > 0
+    assert imbalance <= 1.05
+    # Straight cuts through a 16x16 grid cost 16 edges each
+    assert cut <= 16*nParts
+
+def test_graphPartitionHole():
+    mesh = helper_hole_mesh()
+    cells = [c for c in mesh.cells if c.type == "quad"][0].data
+    for nParts in [2, 3, 4, 5]:
+        graphOwner = GraphPartitioner().partition(mesh.points[:,0:2], cells, nParts)
+        rcbOwner = RecursiveBisectionPartitioner().partition(mesh.points[:,0:2], cells, nParts)
+        _, graphCut, counts = partitionQuality(cells, graphOwner, nParts)
+        _, rcbCut, _ = partitionQuality(cells, rcbOwner, nParts)
+        assert counts.min() > 0 and counts.sum() == 18
+        assert graphCut <= rcbCut
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("partitioner", [RecursiveBisectionPartitioner(), GraphPartitioner()])
+def test_readWithPartitioner(tmpdir, partitioner):
+    from mpi4py import MPI
+    with open(os.path.join(tmpdir, "test.msh"), "w") as f:
+        f.writelines(getTestGMshFile())
+
+    geom = Geometry2D(partitioner=partitioner)
+    geom.readGMsh(os.path.join(tmpdir, "test.msh"), boundaryNames=["inner", "yneg", "xneg", "xpos", "ypos"])
+    counts = geom.mpiComm.allgather(len(geom.localConnectivity))
+    assert sum(counts) == 18
+    assert min(counts) > 0
+    assert max(counts) - min(counts) <= 2
+
+###################################################################################################
+# Helper functions
+###################################################################################################
+def helper_grid(nX, nY):
+    xCoor, yCoor = linspace(0, 1, nX+1), linspace(0, 1, nY+1)
+    points = array([[x,y] for y in yCoor for x in xCoor])
+    cells = array([[jt*(nX+1)+it, jt*(nX+1)+it+1, (jt+1)*(nX+1)+it+1, (jt+1)*(nX+1)+it] for jt in range(nY) for it in range(nX)])
+    return points, cells
+
+def helper_hole_mesh():
+    import meshio, tempfile
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(os.path.join(tmpdir, "test.msh"), "w") as f:
+            f.writelines(getTestGMshFile())
+        return meshio.read(os.path.join(tmpdir, "test.msh"))
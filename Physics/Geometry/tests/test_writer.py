@@ -0,0 +1,165 @@
+from ..Geometry2D import Geometry2D
+from ..Writer import VTKWriter, XDMFWriter, AsyncWriter
+import pytest, os, re, zlib
+from time import sleep
+from numpy import arange, dtype, frombuffer, full
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("compress", [False, True])
+def test_vtkPieces(tmpdir, compress):
+    geom, fileroot = helper_geometry(tmpdir)
+    pvtu = geom.writeVTKsolution(fileroot=fileroot, in_point_data={"x": geom.localPoints[:,0]}, compress=compress)
+    geom.mpiComm.Barrier()
+
+    # Pieces follow the fileroot and hold only the local points
+    assert pvtu == fileroot + ".pvtu"
+    piece = helper_readPiece(f"{fileroot}_{geom.mpiRank:0>5d}.vtu")
+    assert len(piece["Points"]) == len(geom.localPointIds)
+    assert piece["Points"][:,0:2] == pytest.approx(geom.localPoints)
+    assert piece["x"].ravel() == pytest.approx(geom.localPoints[:,0])
+    assert (piece["connectivity"].reshape(-1, 4) == arange(len(geom.localPointIds))[geom.localPointIds.searchsorted(geom.localConnectivity)]).all()
+    assert (piece["offsets"].ravel() == 4*arange(1, len(geom.localConnectivity)+1)).all()
+    assert (piece["Rank"].ravel() == geom.mpiRank).all()
+
+    with open(pvtu) as f:
+        text = f.read()
+    for it in range(geom.mpiSize):
+        assert f"Source=\"{os.path.basename(fileroot)}_{it:0>5d}.vtu\"" in text
+    assert "Name=\"x\"" in text and "Name=\"Rank\"" in text
+
+@pytest.mark.mpi(max_size=4)
+def test_vtkTimeSeries(tmpdir):
+    geom, fileroot = helper_geometry(tmpdir)
+    writer = VTKWriter(geom, fileroot)
+    for step in range(3):
+        writer.write(pointData={"u": full(len(geom.localPointIds), float(step))}, time=0.5*step)
+    geom.mpiComm.Barrier()
+
+    assert os.path.exists(f"{fileroot}_0002_{geom.mpiRank:0>5d}.vtu")
+    with open(fileroot + ".pvd") as f:
+        text = f.read()
+    assert text.count("<DataSet") == 3 and "timestep=\"1.0\"" in text
+
+@pytest.mark.mpi(max_size=4)
+def test_xdmf(tmpdir):
+    h5py = pytest.importorskip("h5py")
+    geom, fileroot = helper_geometry(tmpdir)
+    writer = XDMFWriter(geom, fileroot)
+    for step in range(2):
+        writer.write(pointData={"u": geom.localPoints[:,0] + step},
+                     cellData={"Rank": full(len(geom.localConnectivity), geom.mpiRank)}, time=float(step))
+    geom.mpiComm.Barrier()
+
+    with h5py.File(fileroot + ".h5", "r") as f:
+        points, cells = f["mesh/points"][...], f["mesh/cells"][...]
+        assert points.shape == (geom.globalNpoints, 3) and cells.shape == (geom.globalNelements, 4)
+        assert points[geom.localPointIds, 0:2] == pytest.approx(geom.localPoints)
+        assert f["fields/0001/u"][...] == pytest.approx(points[:,0] + 1.0)
+        assert sorted(set(f["fields/0000/Rank"][...])) == list(range(geom.mpiSize))
+    # Mesh is referenced by every step but stored once
+    with open(fileroot + ".xmf") as f:
+        text = f.read()
+    assert text.count("/mesh/points") == 2 and text.count("<Time ") == 2
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("format", ["vtk", "xdmf"])
+def test_asyncTimeSeries(tmpdir, format):
+    if format == "xdmf":
+        h5py = pytest.importorskip("h5py")
+    geom, fileroot = helper_geometry(tmpdir)
+    geom.openOutput(fileroot, format=format)
+    u = geom.localPoints[:,0].copy()
+    for step in range(3):
+        geom.writeOutput(0.5*step, in_point_data={"u": u})
+        # The writer works on a snapshot, so the solver can overwrite its arrays right away
+        u += 1.0
+    geom.closeOutput()
+    geom.mpiComm.Barrier()
+
+    if format == "vtk":
+        piece = helper_readPiece(f"{fileroot}_0001_{geom.mpiRank:0>5d}.vtu")
+        assert piece["u"].ravel() == pytest.approx(geom.localPoints[:,0] + 1.0)
+        with open(fileroot + ".pvd") as f:
+            assert f.read().count("<DataSet") == 3
+    else:
+        with h5py.File(fileroot + ".h5", "r") as f:
+            assert f["fields/0002/u"][...] == pytest.approx(f["mesh/points"][:,0] + 2.0)
+
+class SlowWriter():
+    def __init__(self, delay=0.05, failAt=None):
+        self.delay, self.failAt, self.steps = delay, failAt, []
+
+    def write(self, pointData={}, cellData={}, time=None):
+        if len(self.steps) == self.failAt:
+            raise IOError("disk full")
+        sleep(self.delay)
+        self.steps.append((time, pointData["u"].copy()))
+
+def test_asyncBackpressure():
+    writer = SlowWriter()
+    output = AsyncWriter(writer, maxPending=1)
+    u = full(10, 0.0)
+    for step in range(5):
+        u[:] = step
+        output.write(pointData={"u": u}, time=float(step))
+    # Only two buffer sets exist, so write waits for the slow writer
+    assert output.stallTime > 0.0
+    output.flush()
+    assert [t for t,_ in writer.steps] == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert all((values == t).all() for t, values in writer.steps)
+    output.close()
+
+def test_asyncError():
+    output = AsyncWriter(SlowWriter(delay=0.0, failAt=1), maxPending=2)
+    output.write(pointData={"u": full(3, 1.0)}, time=0.0)
+    output.write(pointData={"u": full(3, 1.0)}, time=1.0)
+    with pytest.raises(IOError):
+        output.flush()
+    output.close()
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("format", ["vtk", "xdmf"])
+def test_synchronousOutput(tmpdir, format):
+    if format == "xdmf":
+        pytest.importorskip("h5py")
+    geom, fileroot = helper_geometry(tmpdir)
+    # Turning asynchronous output off is honoured for every format
+    output = geom.openOutput(fileroot, format=format, asynchronous=False)
+    assert not isinstance(output, AsyncWriter)
+    geom.writeOutput(0.0, in_point_data={"u": geom.localPoints[:,0]})
+    geom.closeOutput()
+
+###################################################################################################
+# Helper functions
+###################################################################################################
+def helper_geometry(tmpdir):
+    geom = Geometry2D()
+    geom.readInternal(nX=4, nY=3)
+    # Every proc writes into rank 0's directory
+    directory = geom.mpiComm.bcast(str(tmpdir), root=0)
+    return geom, os.path.join(directory, "solution")
+
+def helper_readPiece(filename):
+    # Decode every appended block at the offset of its header: a UInt64 length and the raw
+    # bytes, or [nBlocks, blockSize, lastBlockSize, compressedSize] and one zlib block
+    with open(filename, "rb") as f:
+        content = f.read()
+    marker = content.index(b"<AppendedData encoding=\"raw\">")
+    start = content.index(b"_", marker) + 1
+    header = content[:marker].decode()
+    compressed = "vtkZLibDataCompressor" in header
+    arrays, end = {}, start
+    for type, name, components, offset in re.findall(r'type="(\w+)" Name="(\w+)" NumberOfComponents="(\d+)" format="appended" offset="(\d+)"', header):
+        position = start + int(offset)
+        if compressed:
+            size = int(frombuffer(content, dtype="<u8", count=4, offset=position)[3])
+            payload = zlib.decompress(content[position+32:position+32+size])
+            end = max(end, position + 32 + size)
+        else:
+            size = int(frombuffer(content, dtype="<u8", count=1, offset=position)[0])
+            payload = content[position+8:position+8+size]
+            end = max(end, position + 8 + size)
+        arrays[name] = frombuffer(payload, dtype=dtype(type.lower()).newbyteorder("<")).reshape(-1, int(components))
+    # The blocks fill the appended section up to its closing tag
+    assert content[end:].startswith(b"\n  </AppendedData>")
+    return arrays
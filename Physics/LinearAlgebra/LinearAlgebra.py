@@ -0,0 +1,308 @@
+from numpy import arange, asarray, bincount, concatenate, cumsum, empty, flatnonzero, searchsorted, sqrt, stack, \
+    unique, zeros, diff, repeat, full, lexsort
+from scipy.sparse import csr_array
+from mpi4py import MPI
+
+HALO_TAG = 71
+CONTRIBUTION_TAG = 72
+
+def postExchange(comm, sendbufs, sendRanks, recvbufs, recvRanks, tag):
+    '''Post nonblocking receives then sends of one buffer per neighbour rank'''
+    requests = [comm.Irecv(buf, source=r, tag=tag) for buf,r in zip(recvbufs, recvRanks)]
+    requests += [comm.Isend(buf, dest=r, tag=tag) for buf,r in zip(sendbufs, sendRanks)]
+    return requests
+
+def allToAllCounts(comm, counts):
+    return asarray(comm.alltoall([int(it) for it in counts]), dtype="int64")
+
+def splitCounts(array, counts):
+    offsets = concatenate([[0], cumsum(counts)])
+    return [array[offsets[it]:offsets[it+1]] for it in range(len(counts))]
+
+class ParallelLayout():
+    '''Contiguous owned range of global numbers plus sorted ghost numbers owned elsewhere
+
+    Local index: owned entries in global order, then ghosts. The halo pattern (which owned
+    entries every neighbour needs) is set up once with point-to-point messages'''
+
+    def __init__(self, comm, ownershipRanges, ghosts=None):
+        self._comm = comm
+        rank, size = comm.Get_rank(), comm.Get_size()
+        self._ranges = asarray(ownershipRanges, dtype="int64")
+        assert len(self._ranges) == size+1, "Expected one ownership range per proc"
+        self._start, self._end = int(self._ranges[rank]), int(self._ranges[rank+1])
+
+        self._ghosts = unique(asarray([] if ghosts is None else ghosts, dtype="int64"))
+        assert not ((self._ghosts >= self._start) & (self._ghosts < self._end)).any(), "Ghosts must be owned by another proc"
+        self._ghostOwners = self.owners(self._ghosts)
+
+        # Sorted ghosts are grouped by owner; tell every owner which of its entries we need
+        self._recvRanks, self._recvCounts = unique(self._ghostOwners, return_counts=True)
+        requestCounts = allToAllCounts(comm, bincount(self._ghostOwners, minlength=size))
+        self._sendRanks = flatnonzero(requestCounts)
+        requested = [empty(requestCounts[r], dtype="int64") for r in self._sendRanks]
+        MPI.Request.Waitall(postExchange(comm, splitCounts(self._ghosts, self._recvCounts), self._recvRanks,
+                                         requested, self._sendRanks, HALO_TAG))
+        self._sendIndices = [buf - self._start for buf in requested]
+
+    @property
+    def comm(self):
+        return self._comm
+
+    @property
+    def ownershipRanges(self):
+        return self._ranges
+
+    @property
+    def ownedRange(self):
+        return self._start, self._end
+
+    @property
+    def globalSize(self):
+        return int(self._ranges[-1])
+
+    @property
+    def nOwned(self):
+        return self._end - self._start
+
+    @property
+    def nGhosts(self):
+        return len(self._ghosts)
+
+    @property
+    def ghosts(self):
+        '''Sorted global numbers of the ghost entries'''
+        return self._ghosts
+
+    def owners(self, globals):
+        return searchsorted(self._ranges, globals, side="right") - 1
+
+    def globalToLocal(self, globals):
+        globals = asarray(globals, dtype="int64")
+        owned = (globals >= self._start) & (globals < self._end)
+        ghost = searchsorted(self._ghosts, globals[~owned])
+        assert (ghost < len(self._ghosts)).all() and (self._ghosts[ghost.clip(max=len(self._ghosts)-1)] == globals[~owned]).all(), \
+            "Global number is neither owned nor a ghost"
+        local = globals - self._start
+        local[~owned] = self.nOwned + ghost
+        return local
+
+    def beginHalo(self, values):
+        '''Start sending owned values to the procs holding them as ghosts'''
+        offsets = self.nOwned + concatenate([[0], cumsum(self._recvCounts)])
+        recvbufs = [values[offsets[it]:offsets[it+1]] for it in range(len(self._recvRanks))]
+        sendbufs = [values[idx] for idx in self._sendIndices]
+        return postExchange(self._comm, sendbufs, self._sendRanks, recvbufs, self._recvRanks, HALO_TAG), sendbufs
+
+    def endHalo(self, handle):
+        requests, _ = handle
+        MPI.Request.Waitall(requests)
+
+class ContributionExchange():
+    '''Fixed pattern reducing contributions keyed by global id onto the procs owning them
+
+    Off-proc contributions are summed per (destination, key) into a send buffer; the keys are
+    sent once at setup and only values travel afterwards'''
+
+    def __init__(self, comm, dest, keys):
+        self._comm = comm
+        rank, size = comm.Get_rank(), comm.Get_size()
+        dest, keys = asarray(dest, dtype="int64"), asarray(keys, dtype="int64")
+        self._local = flatnonzero(dest == rank)
+        self._offRank = flatnonzero(dest != rank)
+
+        pairs, self._inverse = unique(stack([dest[self._offRank], keys[self._offRank]], axis=1).reshape(-1, 2), axis=0, return_inverse=True)
+        self._inverse = self._inverse.ravel()
+        self._nSend = len(pairs)
+        self._sendRanks, self._sendCounts = unique(pairs[:,0], return_counts=True)
+        recvCounts = allToAllCounts(comm, bincount(pairs[:,0], minlength=size))
+        self._recvRanks = flatnonzero(recvCounts)
+        self._recvCounts = recvCounts[self._recvRanks]
+
+        received = [empty(count, dtype="int64") for count in self._recvCounts]
+        sendKeys = splitCounts(pairs[:,1].copy(), self._sendCounts)
+        MPI.Request.Waitall(postExchange(comm, sendKeys, self._sendRanks, received, self._recvRanks, CONTRIBUTION_TAG))
+        self._receivedKeys = concatenate([zeros(0, dtype="int64")] + received)
+
+    @property
+    def localEntries(self):
+        '''Indices of the contributions owned by this proc'''
+        return self._local
+
+    @property
+    def receivedKeys(self):
+        '''Keys of the summed contributions received from other procs'''
+        return self._receivedKeys
+
+    def begin(self, values):
+        values = asarray(values, dtype="float64")
+        sendbuf = bincount(self._inverse, weights=values[self._offRank], minlength=self._nSend)
+        recvbuf = empty(len(self._receivedKeys))
+        requests = postExchange(self._comm, splitCounts(sendbuf, self._sendCounts), self._sendRanks,
+                                splitCounts(recvbuf, self._recvCounts), self._recvRanks, CONTRIBUTION_TAG)
+        return requests, sendbuf, recvbuf
+
+    def end(self, handle):
+        '''Wait for the exchange and return the received values aligned with receivedKeys'''
+        requests, _, recvbuf = handle
+        MPI.Request.Waitall(requests)
+        return recvbuf
+
+class DistributedVector():
+    '''Owned entries of a global vector followed by ghost copies, on a ParallelLayout'''
+
+    def __init__(self, layout: ParallelLayout, values=None):
+        self._layout = layout
+        self._values = zeros(layout.nOwned + layout.nGhosts) if values is None else asarray(values, dtype="float64")
+        assert len(self._values) == layout.nOwned + layout.nGhosts, "Vector length must match the layout"
+
+    @classmethod
+    def fromGlobal(cls, layout, globalValues):
+        start, end = layout.ownedRange
+        globalValues = asarray(globalValues, dtype="float64")
+        return cls(layout, concatenate([globalValues[start:end], globalValues[layout.ghosts]]))
+
+    @property
+    def layout(self):
+        return self._layout
+
+    @property
+    def values(self):
+        return self._values
+
+    @property
+    def owned(self):
+        return self._values[:self._layout.nOwned]
+
+    @property
+    def ghosts(self):
+        return self._values[self._layout.nOwned:]
+
+    def duplicate(self):
+        return DistributedVector(self._layout)
+
+    def copy(self):
+        return DistributedVector(self._layout, self._values.copy())
+
+    def beginGhostUpdate(self):
+        return self._layout.beginHalo(self._values)
+
+    def endGhostUpdate(self, handle):
+        self._layout.endHalo(handle)
+
+    def updateGhosts(self):
+        self.endGhostUpdate(self.beginGhostUpdate())
+
+    def dot(self, other):
+        return self._layout.comm.allreduce(float(self.owned.dot(other.owned)), op=MPI.SUM)
+
+    def norm(self):
+        return sqrt(self.dot(self))
+
+    def gather(self):
+        '''Full global vector on every proc'''
+        result = empty(self._layout.globalSize)
+        counts = diff(self._layout.ownershipRanges)
+        self._layout.comm.Allgatherv(self.owned.copy(), [result, (counts.tolist(), self._layout.ownershipRanges[:-1].tolist())])
+        return result
+
+class DistributedMatrix():
+    '''Owned rows of a sparse matrix, columns in the local index of its ParallelLayout
+
+    Rows are split into the owned-column (diagonal) block and the ghost-column block so the
+    product with owned entries overlaps the halo exchange'''
+
+    def __init__(self, layout: ParallelLayout, indptr, indices, data=None):
+        self._layout = layout
+        nOwned = layout.nOwned
+        self._indptr, self._indices = asarray(indptr), asarray(indices)
+        rowOf = repeat(arange(nOwned), diff(self._indptr))
+
+        self._diagMask = self._indices < nOwned
+        split = lambda mask, offset: csr_array((zeros(mask.sum()), self._indices[mask] - offset,
+            concatenate([[0], cumsum(bincount(rowOf[mask], minlength=nOwned))])), shape=(nOwned, nOwned if offset == 0 else layout.nGhosts))
+        self._diag = split(self._diagMask, 0)
+        self._offDiag = split(~self._diagMask, nOwned)
+        self._data = zeros(len(self._indices))
+        if data is not None:
+            self.setValues(data)
+
+    @property
+    def layout(self):
+        return self._layout
+
+    @property
+    def shape(self):
+        return self._layout.globalSize, self._layout.globalSize
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def diagonalBlock(self):
+        return self._diag
+
+    @property
+    def offDiagonalBlock(self):
+        return self._offDiag
+
+    def localMatrix(self):
+        '''Owned rows as csr_array (nOwned, nOwned+nGhosts)'''
+        return csr_array((self._data, self._indices, self._indptr), shape=(self._layout.nOwned, self._layout.nOwned + self._layout.nGhosts))
+
+    def setValues(self, data):
+        self._data[:] = data
+        self._diag.data[:] = self._data[self._diagMask]
+        self._offDiag.data[:] = self._data[~self._diagMask]
+
+    def createVector(self):
+        return DistributedVector(self._layout)
+
+    def diagonal(self):
+        return self._diag.diagonal()
+
+    def mult(self, x: DistributedVector, y: DistributedVector = None):
+        '''y = A x; the diagonal block product runs while ghost values are in flight'''
+        y = self.createVector() if y is None else y
+        handle = x.beginGhostUpdate()
+        y.owned[:] = self._diag @ x.owned
+        x.endGhostUpdate(handle)
+        y.owned[:] += self._offDiag @ x.ghosts
+        return y
+
+    def subMatrix(self, positions):
+        '''Square block on the owned positions of every proc (an index set), numbered in the given order
+
+        The block gets its own layout owning len(positions) entries per proc; its ghosts are the
+        index set entries of other procs coupled to the selected rows'''
+        layout = self._layout
+        comm = layout.comm
+        positions = asarray(positions, dtype="int64")
+        ranges = concatenate([[0], cumsum(comm.allgather(len(positions)))])
+        start = ranges[comm.Get_rank()]
+
+        # Number of every local column within the index set, -1 outside, copied to the ghosts
+        numbers = DistributedVector(layout, full(layout.nOwned + layout.nGhosts, -1.0))
+        numbers.owned[positions] = start + arange(len(positions))
+        numbers.updateGhosts()
+
+        local = self.localMatrix()[positions]
+        rowOf = repeat(arange(len(positions)), diff(local.indptr))
+        cols = numbers.values[local.indices].astype("int64")
+        keep = cols >= 0
+        rowOf, cols, data = rowOf[keep], cols[keep], local.data[keep]
+        sub = ParallelLayout(comm, ranges, cols[(cols < start) | (cols >= start + len(positions))])
+        localCols = sub.globalToLocal(cols)
+        order = lexsort((localCols, rowOf))
+        indptr = concatenate([[0], cumsum(bincount(rowOf, minlength=len(positions)))])
+        return DistributedMatrix(sub, indptr, localCols[order], data[order])
+
+    def gather(self):
+        '''Full global csr_array on every proc'''
+        A = self.localMatrix().tocoo()
+        globalCols = concatenate([arange(*self._layout.ownedRange), self._layout.ghosts])
+        rows = A.row + self._layout.ownedRange[0]
+        parts = self._layout.comm.allgather((rows, globalCols[A.col], A.data))
+        rows, cols, data = [concatenate([p[it] for p in parts]) for it in range(3)]
+        return csr_array((data, (rows, cols)), shape=self.shape)
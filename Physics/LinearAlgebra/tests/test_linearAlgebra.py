@@ -0,0 +1,81 @@
+from ..LinearAlgebra import ParallelLayout, ContributionExchange, DistributedVector, DistributedMatrix
+from ...Solver.tests.test_solver import helper_laplacian
+import pytest
+from mpi4py import MPI
+from numpy import arange, array, concatenate
+
+@pytest.mark.mpi(max_size=4)
+def test_ghostUpdate():
+    layout = helper_chain_layout(3)
+    start, end = layout.ownedRange
+    assert layout.nOwned == 3 and layout.globalSize == 3*MPI.COMM_WORLD.Get_size()
+    assert list(layout.globalToLocal(arange(start, end))) == [0, 1, 2]
+
+    # Ghost copies take the owners' values
+    x = DistributedVector(layout)
+    x.owned[:] = arange(start, end)
+    x.updateGhosts()
+    assert list(x.ghosts) == list(layout.ghosts)
+    assert list(x.gather()) == list(range(layout.globalSize))
+    assert x.dot(x) == pytest.approx(sum(it**2 for it in range(layout.globalSize)))
+
+@pytest.mark.mpi(max_size=4)
+def test_contributionExchange():
+    comm = MPI.COMM_WORLD
+    rank, size = comm.Get_rank(), comm.Get_size()
+    # Every proc adds rank+1 to key 7 on proc 0 twice, and keeps one local entry
+    exchange = ContributionExchange(comm, array([0, 0, rank]), array([7, 7, 100+rank]))
+    handle = exchange.begin(array([rank+1.0, rank+1.0, 5.0]))
+    received = exchange.end(handle)
+    if rank == 0:
+        assert list(exchange.localEntries) == [0, 1, 2]
+        assert list(exchange.receivedKeys) == [7]*(size-1)
+        assert list(received) == [2.0*(it+1) for it in range(1, size)]
+    else:
+        assert list(exchange.localEntries) == [2]
+        assert len(received) == 0
+
+@pytest.mark.mpi(max_size=4)
+def test_spmv():
+    # 1D Laplacian (2,-1) on the chain, owned rows only
+    layout = helper_chain_layout(3)
+    start, end = layout.ownedRange
+    n = layout.globalSize
+    indptr, indices, data = [0], [], []
+    for row in range(start, end):
+        cols = [it for it in [row-1, row, row+1] if 0 <= it < n]
+        indices += list(layout.globalToLocal(cols))
+        data += [2.0 if it == row else -1.0 for it in cols]
+        indptr.append(len(indices))
+    A = DistributedMatrix(layout, array(indptr), array(indices), array(data))
+
+    globalX = arange(n, dtype="float64")**2
+    y = A.mult(DistributedVector.fromGlobal(layout, globalX))
+    dense = A.gather().toarray()
+    assert dense == pytest.approx(2.0*(arange(n)[:,None] == arange(n)) - (abs(arange(n)[:,None] - arange(n)) == 1))
+    assert y.gather() == pytest.approx(dense.dot(globalX))
+    assert A.diagonal() == pytest.approx([2.0]*3)
+
+@pytest.mark.mpi(max_size=4)
+def test_subMatrix():
+    A = helper_laplacian(6)
+    comm = A.layout.comm
+    start, _ = A.layout.ownedRange
+
+    # Every other owned row, in reverse order
+    positions = arange(A.layout.nOwned)[::-2]
+    sub = A.subMatrix(positions)
+    assert sub.layout.nOwned == len(positions)
+    selected = concatenate(comm.allgather(start + positions))
+    assert sub.gather().toarray() == pytest.approx(A.gather().toarray()[selected][:, selected])
+
+###################################################################################################
+# Helper functions
+###################################################################################################
+def helper_chain_layout(nOwned):
+    comm = MPI.COMM_WORLD
+    rank, size = comm.Get_rank(), comm.Get_size()
+    ranges = arange(size+1) * nOwned
+    start, end = ranges[rank], ranges[rank+1]
+    ghosts = [it for it in [start-1, end] if 0 <= it < ranges[-1]]
+    return ParallelLayout(comm, ranges, ghosts)
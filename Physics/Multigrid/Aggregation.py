@@ -0,0 +1,243 @@
+from ..LinearAlgebra.LinearAlgebra import ParallelLayout, ContributionExchange, DistributedMatrix, DistributedVector
+from ..Solver.Preconditioner import ChebyshevPreconditioner
+from .Multigrid import MultigridPreconditioner, Transfer
+from mpi4py import MPI
+from numpy import arange, array_equal, asarray, bincount, concatenate, cumsum, diff, flatnonzero, full, int8, \
+    lexsort, maximum, ones, repeat, searchsorted, sqrt, unique, where, zeros, abs as npabs
+from numpy.random import default_rng
+from scipy.sparse import csr_array, identity
+
+def strengthGraph(A: DistributedMatrix, strength):
+    '''Symmetric strong couplings |a_ij| >= strength sqrt(|a_ii a_jj|) of the owned block, i != j'''
+    D = A.diagonalBlock.tocoo()
+    d = npabs(A.diagonal())
+    strong = (D.row != D.col) & (npabs(D.data) >= strength*sqrt(d[D.row]*d[D.col]))
+    S = csr_array((ones(strong.sum()), (D.row[strong], D.col[strong])), shape=D.shape)
+    return csr_array((S + S.T) != 0)
+
+def aggregate(S, seed=0):
+    '''Aggregate of every node of a strength graph, -1 for nodes without strong couplings
+
+    Roots form a distance-2 maximal independent set chosen by random weights, every node joins
+    a root next to it or the aggregate of a neighbour that did. Returns (aggregates, nAggregates)'''
+    n = S.shape[0]
+    isolated = diff(S.indptr) == 0
+    G = csr_array(S + identity(n, format="csr"))
+    G.sort_indices()
+    rowMax = lambda values: maximum.reduceat(values[G.indices], G.indptr[:-1]) if n > 0 else values
+    weights = default_rng(seed).random(n)
+
+    # 1 root, -1 within distance 2 of a root (or isolated), 0 undecided
+    state = zeros(n, dtype=int8)
+    state[isolated] = -1
+    while (state == 0).any():
+        key = where(state == 0, weights, -1.0)
+        state[(state == 0) & (key == rowMax(rowMax(key)))] = 1
+        covered = rowMax(rowMax((state == 1).astype(float)))
+        state[(state == 0) & (covered > 0.0)] = -1
+
+    roots = flatnonzero(state == 1)
+    aggregates = full(n, -1, dtype="int64")
+    aggregates[roots] = arange(len(roots))
+    for _ in range(2):
+        pending = (aggregates < 0) & ~isolated
+        aggregates[pending] = rowMax(aggregates)[pending]
+    return aggregates, len(roots)
+
+def entryPairs(rowsOfX, Yptr):
+    '''Pairs (p, q) of an entry p of X and every entry q in row rowsOfX[p] of the csr Y'''
+    counts = diff(Yptr)[rowsOfX]
+    p = repeat(arange(len(rowsOfX)), counts)
+    q = Yptr[rowsOfX][p] + arange(len(p)) - repeat(cumsum(counts) - counts, counts)
+    return p, q
+
+class GalerkinProduct():
+    '''Coarse operator P^T A P for matrices sharing the sparsity of A
+
+    The symbolic phase pairs the entries of P and A once and sets up the exchanges; compute
+    then only multiplies, sums and sends values. Products with fine DoFs owned elsewhere are
+    sent to their owner, which completes them with its own rows of P, so no ghost rows of P
+    are needed'''
+
+    def __init__(self, A: DistributedMatrix, transfer: Transfer):
+        layout = A.layout
+        comm = layout.comm
+        nOwned, nFine = layout.nOwned, layout.globalSize
+        fineStart, _ = layout.ownedRange
+        coarseLayout = transfer.coarseLayout
+        coarseStart, coarseEnd = coarseLayout.ownedRange
+        nCoarse = coarseLayout.globalSize
+        P = transfer.matrix
+        coarseGlobals = concatenate([arange(coarseStart, coarseEnd), coarseLayout.ghosts])
+        fineGlobals = concatenate([arange(*layout.ownedRange), layout.ghosts])
+
+        # B = P^T A from the P entries of row i and the A entries of row i
+        pRows = repeat(arange(nOwned), diff(P.indptr))
+        self._p1, self._q1 = entryPairs(pRows, asarray(A.localMatrix().indptr))
+        keys = coarseGlobals[P.indices[self._p1]] * nFine + fineGlobals[asarray(A.localMatrix().indices)[self._q1]]
+        self._keys1, self._inverse1 = unique(keys, return_inverse=True)
+        fine = self._keys1 % nFine
+        self._remote = flatnonzero((fine < fineStart) | (fine >= fineStart + nOwned))
+        self._owned = flatnonzero((fine >= fineStart) & (fine < fineStart + nOwned))
+        self._exchange1 = ContributionExchange(comm, layout.owners(fine[self._remote]), self._keys1[self._remote])
+
+        # C = B P from the B entries of column j and the owned row j of P
+        bKeys = concatenate([self._keys1[self._owned], self._exchange1.receivedKeys])
+        self._p2, self._q2 = entryPairs(bKeys % nFine - fineStart, P.indptr)
+        keys = (bKeys // nFine)[self._p2] * nCoarse + coarseGlobals[P.indices[self._q2]]
+        self._keys2, self._inverse2 = unique(keys, return_inverse=True)
+        rows = self._keys2 // nCoarse
+        self._exchange2 = ContributionExchange(comm, searchsorted(transfer.coarseRanges, rows, side="right") - 1, self._keys2)
+
+        # Owned rows of the coarse operator, as DistributedAssembler builds them
+        ownedKeys = unique(concatenate([self._keys2[self._exchange2.localEntries], self._exchange2.receivedKeys]))
+        patternRows, patternCols = ownedKeys // nCoarse - coarseStart, ownedKeys % nCoarse
+        self._layout = ParallelLayout(comm, transfer.coarseRanges, patternCols[(patternCols < coarseStart) | (patternCols >= coarseEnd)])
+        localCols = self._layout.globalToLocal(patternCols)
+        order = lexsort((localCols, patternRows))
+        position = zeros(len(order), dtype="int64")
+        position[order] = arange(len(order))
+        self._indptr = concatenate([[0], cumsum(bincount(patternRows, minlength=coarseEnd - coarseStart))])
+        self._indices = localCols[order]
+        self._local = position[searchsorted(ownedKeys, self._keys2[self._exchange2.localEntries])]
+        self._received = position[searchsorted(ownedKeys, self._exchange2.receivedKeys)]
+        self._transfer = transfer
+
+    @property
+    def layout(self):
+        return self._layout
+
+    def compute(self, A: DistributedMatrix):
+        '''Coarse DistributedMatrix of P^T A P for A with the sparsity of the setup matrix'''
+        P = self._transfer.matrix
+        B = bincount(self._inverse1, weights=P.data[self._p1]*A.data[self._q1], minlength=len(self._keys1))
+        handle = self._exchange1.begin(B[self._remote])
+        values = concatenate([B[self._owned], self._exchange1.end(handle)])
+
+        C = bincount(self._inverse2, weights=values[self._p2]*P.data[self._q2], minlength=len(self._keys2))
+        handle = self._exchange2.begin(C)
+        nnz = len(self._indices)
+        data = bincount(self._local, weights=C[self._exchange2.localEntries], minlength=nnz)
+        data += bincount(self._received, weights=self._exchange2.end(handle), minlength=nnz)
+        return DistributedMatrix(self._layout, self._indptr, self._indices, data)
+
+def smoothedProlongator(A: DistributedMatrix, nearNullspace, strength, omega, seed=0):
+    '''Smoothed aggregation prolongator of one level and the coarse near nullspace
+
+    Aggregates stay on the proc owning their nodes. The tentative prolongator holds the near
+    nullspace normalized over each aggregate; one damped Jacobi step with A smooths it, using
+    the tentative rows of the ghosts'''
+    layout = A.layout
+    comm = layout.comm
+    nOwned = layout.nOwned
+    aggregates, nAggregates = aggregate(strengthGraph(A, strength), seed + comm.Get_rank())
+
+    # Aggregates without near nullspace content would give empty columns
+    valid = aggregates >= 0
+    norms = sqrt(bincount(aggregates[valid], weights=nearNullspace[valid]**2, minlength=nAggregates))
+    kept = norms > 0.0
+    renumber = cumsum(kept) - 1
+    ranges = concatenate([[0], cumsum(comm.allgather(int(kept.sum())))])
+    start = ranges[comm.Get_rank()]
+    valid[valid] = kept[aggregates[valid]]
+
+    columns = DistributedVector(layout, full(nOwned + layout.nGhosts, -1.0))
+    values = DistributedVector(layout)
+    columns.owned[valid] = start + renumber[aggregates[valid]]
+    values.owned[valid] = nearNullspace[valid] / norms[aggregates[valid]]
+    columns.updateGhosts()
+    values.updateGhosts()
+    tentativeRows = flatnonzero(columns.values >= 0.0)
+    T = csr_array((values.values[tentativeRows], (tentativeRows, columns.values[tentativeRows].astype("int64"))),
+                  shape=(nOwned + layout.nGhosts, int(ranges[-1])))
+
+    lambdaMax = ChebyshevPreconditioner(A).eigenBounds[1]
+    AT = (A.localMatrix() @ T).tocoo()
+    P = (T[:nOwned] - csr_array(((omega/lambdaMax) * AT.data / A.diagonal()[AT.row], (AT.row, AT.col)), shape=AT.shape)).tocoo()
+    P.eliminate_zeros()
+    transfer = Transfer(comm, layout.ownershipRanges, ranges, P.row + layout.ownedRange[0], P.col, P.data)
+    return transfer, norms[kept]
+
+class SmoothedAggregation():
+    '''Smoothed aggregation AMG hierarchy of a DistributedMatrix
+
+    Levels are added until the coarse operator has at most maxCoarse rows, maxLevels are
+    reached or aggregation stalls. nearNullspace holds the owned entries of the fine near
+    nullspace (ones by default; for the hierarchical basis the constant is one on the vertex
+    DoFs only). Prolongators and the symbolic Galerkin products are kept: a later matrix with
+    the same sparsity only recomputes the coarse operator values'''
+
+    def __init__(self, strength=0.08, omega=4.0/3.0, maxCoarse=50, maxLevels=10, nearNullspace=None, seed=0):
+        self._strength, self._omega = strength, omega
+        self._maxCoarse, self._maxLevels = maxCoarse, maxLevels
+        self._nearNullspace = nearNullspace
+        self._seed = seed
+        self._pattern = None
+        self._transfers, self._products = [], []
+        self._setups, self._reuses = 0, 0
+        self._setupTime = 0.0
+
+    @property
+    def setupTime(self):
+        '''Wall time of the last setup, full or reused'''
+        return self._setupTime
+
+    @property
+    def setups(self):
+        return self._setups
+
+    @property
+    def reuses(self):
+        return self._reuses
+
+    @property
+    def transfers(self):
+        return self._transfers
+
+    def samePattern(self, A: DistributedMatrix):
+        '''True on every proc when A has the sparsity of the cached setup on every proc'''
+        same = self._pattern is not None and all(array_equal(old, new) for old, new in
+            zip(self._pattern, (A.layout.ownershipRanges, A.layout.ghosts, A.localMatrix().indptr, A.localMatrix().indices)))
+        return A.layout.comm.allreduce(same, op=MPI.LAND)
+
+    def operators(self, A: DistributedMatrix):
+        '''Level operators for A, finest first, reusing the cached setup when the sparsity matches'''
+        comm = A.layout.comm
+        comm.Barrier()
+        start = MPI.Wtime()
+        if self.samePattern(A):
+            operators = [A]
+            for product in self._products:
+                operators.append(product.compute(operators[-1]))
+            self._reuses += 1
+        else:
+            operators = self.__setup(A)
+            self._setups += 1
+        self._setupTime = MPI.Wtime() - start
+        return operators
+
+    def __setup(self, A):
+        local = A.localMatrix()
+        self._pattern = (A.layout.ownershipRanges.copy(), A.layout.ghosts.copy(), local.indptr.copy(), local.indices.copy())
+        self._transfers, self._products = [], []
+        operators = [A]
+        nullspace = ones(A.layout.nOwned) if self._nearNullspace is None else asarray(self._nearNullspace, dtype="float64")
+        while len(operators) < self._maxLevels and operators[-1].layout.globalSize > self._maxCoarse:
+            fine = operators[-1]
+            transfer, coarseNullspace = smoothedProlongator(fine, nullspace, self._strength, self._omega, self._seed + len(operators))
+            if transfer.coarseLayout.globalSize == 0 or transfer.coarseLayout.globalSize > 0.8*fine.layout.globalSize:
+                break
+            product = GalerkinProduct(fine, transfer)
+            self._transfers.append(transfer)
+            self._products.append(product)
+            operators.append(product.compute(fine))
+            nullspace = coarseNullspace
+        return operators
+
+    def preconditioner(self, A: DistributedMatrix, **options):
+        '''MultigridPreconditioner on the hierarchy of A; options go to the cycle'''
+        operators = self.operators(A)
+        return MultigridPreconditioner(operators, self._transfers, **options)
+
+    def report(self):
+        return f"Smoothed aggregation: {self._setups} setups, {self._reuses} reuses, last setup {self._setupTime:.3e}s"
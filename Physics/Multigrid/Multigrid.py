@@ -0,0 +1,372 @@
+from ..DoFHandler.DoFHandler import DoFHandler
+from ..LinearAlgebra.LinearAlgebra import ParallelLayout, ContributionExchange, DistributedVector
+from ..Quadrature.Quadrature import Quadrature2D, gaussLegendre, integratedLegendre
+from ..Solver.Preconditioner import Preconditioner, ChebyshevPreconditioner, createPreconditioner
+from mpi4py import MPI
+from numpy import arange, argsort, array, asarray, ascontiguousarray, bincount, concatenate, cumsum, einsum, empty, \
+    hstack, repeat, searchsorted, stack, unique, zeros, abs as npabs
+from numpy.linalg import solve
+from scipy.sparse import csr_array
+
+def refinementMatrix(coarseOrder, fineOrder, child=None):
+    '''Coefficients E (fineOrder+1, coarseOrder+1) of the 1D coarse basis in the fine basis
+
+    child None keeps the element (p-coarsening), child 0 or 1 is the lower or upper half of the
+    coarse element. The fine space contains the coarse one, so matching at fineOrder+1 points
+    is exact'''
+    assert coarseOrder <= fineOrder, "Coarse order cannot exceed the fine order"
+    samples, _ = gaussLegendre(fineOrder+1)
+    coarsePoints = samples if child is None else 0.5*(samples + 2*child - 1)
+    fine, _ = integratedLegendre(samples, fineOrder)
+    coarse, _ = integratedLegendre(coarsePoints, coarseOrder)
+    E = solve(fine, coarse)
+    E[npabs(E) < 1.0e-13] = 0.0
+    return E
+
+def elementRefinement(coarse: DoFHandler, fine: DoFHandler, childX=None, childY=None):
+    '''Element matrix (fine slots, coarse slots) of the tensor basis, before edge signs'''
+    p, q = coarse.quadrature.order, fine.quadrature.order
+    Ex, Ey = refinementMatrix(p, q, childX), refinementMatrix(p, q, childY)
+    # Tensor index i*(order+1)+j with i along xi and j along eta
+    E = einsum("ac,bd->abcd", Ex, Ey).reshape((q+1)**2, (p+1)**2)
+    return E[fine.localBasisOrdering][:, coarse.localBasisOrdering]
+
+def routeRows(comm, rows, dest, width):
+    '''Send row i of a float64 array (n, width) to rank dest[i]
+
+    Returns the received rows grouped by source rank, their sources and the permutation that
+    sorted the sent rows by destination'''
+    size = comm.Get_size()
+    rows = ascontiguousarray(rows, dtype="float64").reshape(len(dest), width)
+    order = argsort(dest, kind="stable")
+    sendCounts = bincount(dest, minlength=size)
+    recvCounts = array(comm.alltoall(sendCounts.tolist()))
+    displs = lambda counts: (concatenate([[0], cumsum(counts)[:-1]])*width).tolist()
+    received = empty((recvCounts.sum(), width))
+    comm.Alltoallv([ascontiguousarray(rows[order]), ((sendCounts*width).tolist(), displs(sendCounts))],
+                   [received, ((recvCounts*width).tolist(), displs(recvCounts))])
+    return received, repeat(arange(size), recvCounts), order
+
+def int64Keys(values):
+    return asarray(values, dtype="int64").reshape(-1)
+
+def rendezvous(comm, keys, rows, requests, nKeys):
+    '''Rows published under unique global keys (0 <= key < nKeys) by whichever proc holds them;
+    return the rows of the requested keys. Directory ranks hold contiguous key ranges'''
+    size = comm.Get_size()
+    width = rows.shape[1]
+    directory = lambda k: (int64Keys(k) * size) // max(nKeys, 1)
+    published, _, _ = routeRows(comm, hstack([int64Keys(keys)[:,None], rows]), directory(keys), width+1)
+    table = published[argsort(published[:,0])]
+
+    asked, sources, order = routeRows(comm, int64Keys(requests)[:,None], directory(requests), 1)
+    answers = table[searchsorted(table[:,0], asked[:,0]), 1:]
+    replies, _, _ = routeRows(comm, answers, sources, width)
+    result = empty((len(requests), width))
+    result[order] = replies
+    return result
+
+class Transfer():
+    '''Prolongation P between two row distributions and restriction R = P^T
+
+    rows and cols are global fine and coarse numbers of the entries of P on this proc; only
+    fine owned rows may appear, and entries repeated from several cells are kept once. P acts
+    on owned arrays, so it works with any layout sharing the ownership ranges; restriction
+    reduces contributions to coarse entries owned elsewhere onto their owners'''
+
+    def __init__(self, comm, fineRanges, coarseRanges, rows, cols, values):
+        rank = comm.Get_rank()
+        fineStart, fineEnd = fineRanges[rank], fineRanges[rank+1]
+        coarseStart, coarseEnd = coarseRanges[rank], coarseRanges[rank+1]
+        nCoarse = coarseRanges[-1]
+
+        keys, first = unique(asarray(rows, dtype="int64") * nCoarse + cols, return_index=True)
+        rows, cols, values = keys // nCoarse, keys % nCoarse, asarray(values)[first]
+        self._coarseRanges = asarray(coarseRanges, dtype="int64")
+        self._coarseLayout = ParallelLayout(comm, coarseRanges, cols[(cols < coarseStart) | (cols >= coarseEnd)])
+        nColumns = self._coarseLayout.nOwned + self._coarseLayout.nGhosts
+        self._P = csr_array((values, (rows - fineStart, self._coarseLayout.globalToLocal(cols))), shape=(fineEnd - fineStart, nColumns))
+        self._PT = self._P.T.tocsr()
+
+        globals = concatenate([arange(coarseStart, coarseEnd), self._coarseLayout.ghosts])
+        self._exchange = ContributionExchange(comm, self._coarseLayout.owners(globals), globals)
+        self._local = globals[self._exchange.localEntries] - coarseStart
+        self._received = self._exchange.receivedKeys - coarseStart
+        self._coarse = DistributedVector(self._coarseLayout)
+
+    @property
+    def coarseRanges(self):
+        return self._coarseRanges
+
+    @property
+    def coarseLayout(self):
+        '''Layout of the coarse entries P reads: coarse ownership plus the coupled ghosts'''
+        return self._coarseLayout
+
+    @property
+    def matrix(self):
+        '''Local rows of P (nFineOwned, nCoarseOwned+nCoarseGhosts)'''
+        return self._P
+
+    @property
+    def nnz(self):
+        return self._P.nnz
+
+    def prolong(self, coarseOwned):
+        '''Fine owned values of P x_c'''
+        self._coarse.owned[:] = coarseOwned
+        self._coarse.updateGhosts()
+        return self._P @ self._coarse.values
+
+    def restrict(self, fineOwned):
+        '''Coarse owned values of P^T r_f'''
+        values = self._PT @ fineOwned
+        handle = self._exchange.begin(values)
+        nOwned = self._coarseLayout.nOwned
+        result = bincount(self._local, weights=values[self._exchange.localEntries], minlength=nOwned)
+        result += bincount(self._received, weights=self._exchange.end(handle), minlength=nOwned)
+        return result
+
+def elementTransfer(coarse, fine, parentDoFs, parentSigns, parentFixed, matrices, fineFixed):
+    '''Transfer from element matrices (nFineCells, fine slots, coarse slots) and the global DoFs,
+    signs and constraint flags of every fine cell's parent; constrained DoFs get no entries'''
+    local = fine.dofConnectivity
+    values = fine.basisSigns[:,:,None] * matrices * parentSigns[:,None,:]
+    keep = (local < fine.nOwnedDoFs)[:,:,None] & ~fineFixed[local][:,:,None] & ~parentFixed[:,None,:] & (values != 0.0)
+    rows = repeat(fine.dofMap[local][:,:,None], parentDoFs.shape[1], axis=2)
+    cols = repeat(parentDoFs[:,None,:], local.shape[1], axis=1)
+    return Transfer(fine.geometry.mpiComm, fine.ownershipRanges, coarse.ownershipRanges, rows[keep], cols[keep], values[keep])
+
+def hTransfer(coarse: DoFHandler, fine: DoFHandler, coarseFixed=None, fineFixed=None):
+    '''Transfer between structured meshes where every coarse cell holds 2 x 2 fine cells
+
+    Parent cells may live on other procs; their DoFs are looked up by a rendezvous on the
+    coarse cell index'''
+    geom, coarseGeom = fine.geometry, coarse.geometry
+    assert geom.structuredGrid is not None and coarseGeom.structuredGrid is not None, "Geometric coarsening needs readInternal meshes"
+    _, nX, _, nY = geom.structuredGrid
+    _, nXc, _, nYc = coarseGeom.structuredGrid
+    assert (nX, nY) == (2*nXc, 2*nYc), "The coarse mesh must halve nX and nY"
+    coarseFixed = zeros(coarse.nLocalDoFs, dtype=bool) if coarseFixed is None else coarseFixed
+    fineFixed = zeros(fine.nLocalDoFs, dtype=bool) if fineFixed is None else fineFixed
+
+    # Cell (i, j) starts from point j*(nX+1)+i
+    v0 = geom.localConnectivity[:,0].astype("int64")
+    i, j = v0 % (nX+1), v0 // (nX+1)
+    parent, child = (j//2)*nXc + i//2, 2*(i % 2) + j % 2
+    cv0 = coarseGeom.localConnectivity[:,0].astype("int64")
+    cells = (cv0 // (nXc+1))*nXc + cv0 % (nXc+1)
+
+    nBasis = coarse.dofsPerElement
+    conn = coarse.dofConnectivity
+    rows = hstack([coarse.dofMap[conn], coarse.basisSigns, coarseFixed[conn]])
+    data = rendezvous(geom.mpiComm, cells, rows, parent, nXc*nYc)
+    table = stack([elementRefinement(coarse, fine, cx, cy) for cx in (0, 1) for cy in (0, 1)])
+    return elementTransfer(coarse, fine, data[:,:nBasis].astype("int64"), data[:,nBasis:2*nBasis],
+                           data[:,2*nBasis:] > 0.5, table[child], fineFixed)
+
+def pTransfer(coarse: DoFHandler, fine: DoFHandler, coarseFixed=None, fineFixed=None):
+    '''Transfer between two orders on the same mesh; the hierarchical coarse basis is a subset
+    of the fine one'''
+    assert coarse.geometry is fine.geometry, "p-coarsening keeps the mesh"
+    coarseFixed = zeros(coarse.nLocalDoFs, dtype=bool) if coarseFixed is None else coarseFixed
+    fineFixed = zeros(fine.nLocalDoFs, dtype=bool) if fineFixed is None else fineFixed
+    conn = coarse.dofConnectivity
+    E = elementRefinement(coarse, fine)
+    matrices = repeat(E[None], len(conn), axis=0)
+    return elementTransfer(coarse, fine, coarse.dofMap[conn], coarse.basisSigns, coarseFixed[conn], matrices, fineFixed)
+
+class MultigridHierarchy():
+    '''Levels below a DoFHandler on a readInternal mesh
+
+    The order is halved down to 1 first (p-multigrid on the fine mesh), then nX and nY are
+    halved while they stay even and at least coarsestCells. assemble(dofs) returns (A, bc) for
+    every level, bc a DirichletCondition or None, so coarse operators are rediscretized and
+    transfers skip the constrained DoFs'''
+
+    def __init__(self, dofs: DoFHandler, assemble, nLevels=None, coarsestCells=2, pCoarsening=True):
+        comm = dofs.geometry.mpiComm
+        comm.Barrier()
+        start = MPI.Wtime()
+        self._dofs, self._operators, self._fixed, self._transfers = [], [], [], []
+        self.__addLevel(dofs, assemble)
+        full = lambda: nLevels is not None and len(self._dofs) >= nLevels
+
+        while pCoarsening and self._dofs[-1].quadrature.order > 1 and not full():
+            fine = self._dofs[-1]
+            coarse = DoFHandler(fine.geometry, Quadrature2D(order=max(fine.quadrature.order//2, 1)))
+            self.__addLevel(coarse, assemble)
+            self._transfers.append(pTransfer(coarse, fine, self._fixed[-1], self._fixed[-2]))
+
+        while not full():
+            fine = self._dofs[-1]
+            grid = fine.geometry.structuredGrid
+            assert grid is not None, "Geometric multigrid needs a readInternal mesh"
+            _, nX, _, nY = grid
+            if nX % 2 or nY % 2 or min(nX, nY)//2 < coarsestCells:
+                break
+            coarse = DoFHandler(fine.geometry.coarsen(), Quadrature2D(order=fine.quadrature.order))
+            self.__addLevel(coarse, assemble)
+            self._transfers.append(hTransfer(coarse, fine, self._fixed[-1], self._fixed[-2]))
+        self._setupTime = MPI.Wtime() - start
+
+    def __addLevel(self, dofs, assemble):
+        A, bc = assemble(dofs)
+        fixed = zeros(dofs.nLocalDoFs, dtype=bool)
+        if bc is not None:
+            fixed[bc.constrainedDoFs] = True
+        self._dofs.append(dofs)
+        self._operators.append(A)
+        self._fixed.append(fixed)
+
+    @property
+    def nLevels(self):
+        return len(self._dofs)
+
+    @property
+    def setupTime(self):
+        return self._setupTime
+
+    @property
+    def operators(self):
+        '''Level operators, finest first'''
+        return self._operators
+
+    @property
+    def transfers(self):
+        '''transfers[l] prolongs from level l+1 to level l'''
+        return self._transfers
+
+    def dofs(self, level):
+        return self._dofs[level]
+
+    def preconditioner(self, A=None, **options):
+        '''MultigridPreconditioner on this hierarchy; A replaces the finest operator'''
+        operators = self._operators if A is None else [A] + self._operators[1:]
+        return MultigridPreconditioner(operators, self._transfers, **options)
+
+class JacobiSmoother():
+    '''Damped Jacobi correction omega D^{-1} r'''
+
+    def __init__(self, A, omega=2.0/3.0):
+        self._scaledInverse = omega / A.diagonal()
+
+    def apply(self, r, z=None):
+        z = r.duplicate() if z is None else z
+        z.owned[:] = self._scaledInverse * r.owned
+        return z
+
+class MultigridPreconditioner(Preconditioner):
+    '''V- or W-cycle over level operators (finest first) and the transfers between them
+
+    Each smoothing step adds S (b - A x) with S damped Jacobi or a Chebyshev polynomial in
+    D^{-1}A targeting the upper part of the spectrum; the coarsest level uses coarseSolver'''
+
+    def __init__(self, operators, transfers, cycle="V", smoother="chebyshev", preSmooth=1, postSmooth=1,
+                 smootherOptions=None, coarseSolver="lu"):
+        assert len(transfers) == len(operators) - 1, "Expected one transfer between every pair of levels"
+        assert cycle in ["V", "W"], f"Unsupported multigrid cycle: {cycle}"
+        super().__init__(operators[0])
+        comm = operators[0].layout.comm
+        comm.Barrier()
+        start = MPI.Wtime()
+        self._operators, self._transfers = operators, transfers
+        self._visits = 1 if cycle == "V" else 2
+        self._preSmooth, self._postSmooth = preSmooth, postSmooth
+
+        options = {} if smootherOptions is None else smootherOptions
+        if smoother == "jacobi":
+            self._smoothers = [JacobiSmoother(A, **options) for A in operators[:-1]]
+            self._smootherProducts = 1
+        elif smoother == "chebyshev":
+            options = {"degree": 2, "eigenRatio": 4.0, **options}
+            self._smoothers = [ChebyshevPreconditioner(A, **options) for A in operators[:-1]]
+            self._smootherProducts = options["degree"]
+        else:
+            raise RuntimeError(f"Unsupported multigrid smoother: {smoother}")
+        self._coarseSolver = createPreconditioner(operators[-1], coarseSolver)
+
+        # Work vectors per level: right-hand side, solution, residual and correction
+        self._vectors = [tuple(A.createVector() for _ in range(4)) for A in operators]
+        self._cycles, self._cycleTime = 0, 0.0
+        self._setupTime = MPI.Wtime() - start
+
+    @property
+    def nLevels(self):
+        return len(self._operators)
+
+    @property
+    def setupTime(self):
+        return self._setupTime
+
+    @property
+    def levelSizes(self):
+        return [A.layout.globalSize for A in self._operators]
+
+    @property
+    def operatorComplexity(self):
+        '''Nonzeros of all level operators over those of the finest'''
+        comm = self._operators[0].layout.comm
+        nnz = [comm.allreduce(len(A.data)) for A in self._operators]
+        return sum(nnz) / nnz[0]
+
+    @property
+    def cycleCost(self):
+        '''Work of one cycle in finest operator products: smoothing, residual and transfer
+        products weighted by their nonzeros, without the coarse solve'''
+        comm = self._operators[0].layout.comm
+        nnz = [comm.allreduce(len(A.data)) for A in self._operators]
+        work, visits = 0.0, 1
+        for level, transfer in enumerate(self._transfers):
+            sweeps = (self._preSmooth + self._postSmooth) * self._smootherProducts + 1
+            work += visits * (sweeps * nnz[level] + 2 * comm.allreduce(transfer.nnz))
+            visits *= self._visits
+        return work / nnz[0]
+
+    @property
+    def cycleTime(self):
+        '''Mean wall time of one cycle'''
+        return self._cycleTime / max(self._cycles, 1)
+
+    def apply(self, r, z=None):
+        z = r.duplicate() if z is None else z
+        start = MPI.Wtime()
+        b, x, _, _ = self._vectors[0]
+        b.owned[:] = r.owned
+        x.owned[:] = 0.0
+        self.__cycle(0)
+        z.owned[:] = x.owned
+        self._cycles += 1
+        self._cycleTime += MPI.Wtime() - start
+        return z
+
+    def __smooth(self, level, sweeps):
+        A = self._operators[level]
+        b, x, residual, correction = self._vectors[level]
+        for _ in range(sweeps):
+            A.mult(x, residual)
+            residual.owned[:] = b.owned - residual.owned
+            self._smoothers[level].apply(residual, correction)
+            x.owned[:] += correction.owned
+
+    def __cycle(self, level):
+        # Solves A x = b on a level, improving the x already there
+        b, x, residual, _ = self._vectors[level]
+        if level == len(self._operators) - 1:
+            self._coarseSolver.apply(b, x)
+            return
+
+        self.__smooth(level, self._preSmooth)
+        self._operators[level].mult(x, residual)
+        coarseB, coarseX, _, _ = self._vectors[level+1]
+        coarseB.owned[:] = self._transfers[level].restrict(b.owned - residual.owned)
+        coarseX.owned[:] = 0.0
+        for _ in range(self._visits):
+            self.__cycle(level+1)
+        x.owned[:] += self._transfers[level].prolong(coarseX.owned)
+        self.__smooth(level, self._postSmooth)
+
+    def report(self):
+        sizes = " -> ".join(str(it) for it in self.levelSizes)
+        return f"Multigrid {self.nLevels} levels ({sizes}), operator complexity {self.operatorComplexity:.3f}, " \
+               f"cycle cost {self.cycleCost:.2f} products, {self.cycleTime:.3e}s per cycle, setup {self._setupTime:.3e}s"
@@ -0,0 +1,102 @@
+from ..Aggregation import SmoothedAggregation, aggregate, strengthGraph
+from .test_multigrid import helper_dofs, helper_matrix, helper_poisson
+from ...Assembly.tests.test_assembly import helper_gmsh_geometry
+from ...BoundaryConditions.BoundaryConditions import DirichletCondition
+from ...DoFHandler.DoFHandler import DoFHandler
+from ...Quadrature.Quadrature import Quadrature2D
+from ...Solver.Newton import NewtonKrylov
+from ...Solver.Preconditioner import createPreconditioner
+from ...Solver.Solver import ConjugateGradient
+from ...Solver.tests.test_newton import helper_problem
+import pytest
+from numpy import arange, concatenate, flatnonzero
+from scipy.sparse import csr_array
+
+@pytest.mark.mpi(max_size=4)
+def test_aggregate():
+    A, bc = helper_poisson(helper_dofs(8, 1))
+    S = strengthGraph(A, 0.08)
+    aggregates, nAggregates = aggregate(S)
+
+    # Constrained rows keep only their diagonal and stay out of every aggregate
+    isolated = (S.indptr[1:] == S.indptr[:-1])
+    assert (aggregates[isolated] == -1).all()
+    assert set(aggregates[~isolated]) == set(range(nAggregates))
+
+    # Every node has a strong neighbour in its aggregate, and aggregates hold four nodes or more on average
+    rows = S.tocoo()
+    same = aggregates[rows.row] == aggregates[rows.col]
+    assert set(rows.row[same]) == set(flatnonzero(~isolated))
+    assert nAggregates <= (~isolated).sum() / 4
+
+@pytest.mark.mpi(max_size=4)
+def test_galerkin():
+    dofs = helper_dofs(16, 1)
+    A = helper_matrix(dofs, "stiffness")
+    amg = SmoothedAggregation(maxCoarse=10)
+    operators = amg.operators(A)
+    assert len(operators) >= 3 and amg.setups == 1
+    helper_checkGalerkin(amg, operators)
+
+    # Same sparsity with other values: the prolongators are kept and only P^T A P is recomputed
+    B = helper_matrix(dofs, "stiffness")
+    B.setValues(B.data + helper_matrix(dofs, "mass").data)
+    reused = amg.operators(B)
+    assert (amg.setups, amg.reuses) == (1, 1)
+    assert [it.layout.globalSize for it in reused] == [it.layout.globalSize for it in operators]
+    helper_checkGalerkin(amg, reused)
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("order", [1, 2])
+def test_unstructured(tmpdir, order):
+    dofs = DoFHandler(helper_gmsh_geometry(tmpdir), Quadrature2D(order=order))
+    A = helper_matrix(dofs, "stiffness")
+    DirichletCondition(dofs, {"xneg": 0.0, "xpos": 1.0}).apply(A)
+    b = A.createVector()
+    b.owned[:] = 1.0
+
+    # The constant of the hierarchical basis is one on the vertex DoFs only
+    vertices = (dofs.localDoFIds[:dofs.nOwnedDoFs] < dofs.geometry.globalNpoints).astype(float)
+    amg = SmoothedAggregation(maxCoarse=20, nearNullspace=vertices)
+    M = createPreconditioner(A, "amg", setup=amg)
+    assert M.nLevels >= 2
+    assert 1.0 < M.operatorComplexity < 1.5
+    assert M.cycleCost > 4.0
+
+    iterations = {}
+    for name, preconditioner in [("jacobi", createPreconditioner(A, "jacobi")), ("amg", M)]:
+        solver = ConjugateGradient(A, preconditioner, rtol=1.0e-10, maxIterations=1000)
+        x = solver.solve(b)
+        assert solver.converged
+        iterations[name] = solver.iterations
+    assert x.gather() == pytest.approx(createPreconditioner(A, "lu").apply(b).gather(), abs=1.0e-8)
+    assert iterations["amg"] < iterations["jacobi"] / 2
+    assert M.cycleTime > 0.0 and "cycle cost" in M.report()
+
+@pytest.mark.mpi(max_size=4)
+def test_newtonReuse():
+    # Newton Jacobians share one sparsity, so only the first preconditioner runs a full setup
+    problem, _, _ = helper_problem()
+    amg = SmoothedAggregation(maxCoarse=5)
+    solver = NewtonKrylov(problem, preconditioner="amg", preconditionerOptions={"setup": amg}, rtol=1.0e-10)
+    solver.solve(problem.createVector(1.0))
+    assert solver.converged, solver.report()
+    assert amg.setups == 1
+    assert amg.reuses == solver.preconditionerBuilds - 1
+
+###################################################################################################
+# Helper functions
+###################################################################################################
+def helper_globalProlongator(transfer, fineLayout):
+    P = transfer.matrix.tocoo()
+    coarse = transfer.coarseLayout
+    columns = concatenate([arange(*coarse.ownedRange), coarse.ghosts])
+    parts = fineLayout.comm.allgather((P.row + fineLayout.ownedRange[0], columns[P.col], P.data))
+    rows, cols, data = [concatenate([p[it] for p in parts]) for it in range(3)]
+    return csr_array((data, (rows, cols)), shape=(fineLayout.globalSize, coarse.globalSize))
+
+def helper_checkGalerkin(amg, operators):
+    for level, transfer in enumerate(amg.transfers):
+        P = helper_globalProlongator(transfer, operators[level].layout)
+        expected = (P.T @ operators[level].gather() @ P).toarray()
+        assert operators[level+1].gather().toarray() == pytest.approx(expected, abs=1.0e-12)
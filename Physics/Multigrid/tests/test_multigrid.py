@@ -0,0 +1,130 @@
+from ..Multigrid import MultigridHierarchy, refinementMatrix
+from ...Assembly.Assembly import ElementAssembler, DistributedAssembler
+from ...Assembly.tests.test_assembly import helper_gmsh_geometry
+from ...BoundaryConditions.BoundaryConditions import DirichletCondition
+from ...DoFHandler.DoFHandler import DoFHandler
+from ...Geometry.Geometry2D import Geometry2D
+from ...Quadrature.Quadrature import Quadrature2D, integratedLegendre
+from ...Solver.Preconditioner import createPreconditioner
+from ...Solver.Solver import ConjugateGradient
+import pytest
+from numpy import arange, cos, linspace, sin
+
+@pytest.mark.parametrize("coarse, fine, child", [(1, 1, 0), (2, 2, 1), (3, 3, 0), (1, 2, None), (2, 4, None)])
+def test_refinementMatrix(coarse, fine, child):
+    # Fine coefficients reproduce every coarse basis function on the sub-element
+    xi = linspace(-1.0, 1.0, 7)
+    parent = xi if child is None else 0.5*(xi + 2*child - 1)
+    values, _ = integratedLegendre(xi, fine)
+    expected, _ = integratedLegendre(parent, coarse)
+    assert values @ refinementMatrix(coarse, fine, child) == pytest.approx(expected, abs=1.0e-12)
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("order", [1, 2, 3])
+def test_galerkin(order):
+    # The coarse space lies in the fine one, so P^T A_f P matches the coarse rediscretization
+    # for stiffness and mass alike
+    for term in ["stiffness", "mass"]:
+        hierarchy = MultigridHierarchy(helper_dofs(8, order), lambda dofs: (helper_matrix(dofs, term), None))
+        for level, transfer in enumerate(hierarchy.transfers):
+            fine, coarse = hierarchy.operators[level], hierarchy.operators[level+1]
+            x, y = coarse.createVector(), coarse.createVector()
+            x.owned[:] = cos(arange(*x.layout.ownedRange))
+            y.owned[:] = sin(arange(*y.layout.ownedRange))
+            Px, Py = fine.createVector(), fine.createVector()
+            Px.owned[:] = transfer.prolong(x.owned)
+            Py.owned[:] = transfer.prolong(y.owned)
+            assert Py.dot(fine.mult(Px)) == pytest.approx(y.dot(coarse.mult(x)), rel=1.0e-10)
+
+            # Restriction is the transpose
+            Rr = x.duplicate()
+            Rr.owned[:] = transfer.restrict(Py.owned)
+            assert Rr.dot(x) == pytest.approx(Py.dot(Px), rel=1.0e-12)
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("order", [1, 2])
+def test_meshIndependence(order):
+    iterations = {}
+    for n in [8, 16, 32]:
+        hierarchy = MultigridHierarchy(helper_dofs(n, order), helper_poisson)
+        A = hierarchy.operators[0]
+        b = A.createVector()
+        b.owned[:] = 1.0
+        for name, options in [("jacobi", {}), ("multigrid", {"hierarchy": hierarchy})]:
+            solver = ConjugateGradient(A, createPreconditioner(A, name, **options), rtol=1.0e-10, maxIterations=1000)
+            solver.solve(b)
+            assert solver.converged
+            iterations[name, n] = solver.iterations
+
+    assert iterations["multigrid", 32] <= iterations["multigrid", 8] + 2
+    assert iterations["jacobi", 32] > 3*iterations["multigrid", 32]
+    assert iterations["jacobi", 32] > 2*iterations["jacobi", 8]
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("options", [
+    {"cycle": "W"},
+    {"smoother": "jacobi", "preSmooth": 2, "postSmooth": 2},
+    {"smoother": "chebyshev", "smootherOptions": {"degree": 3}},
+])
+def test_cycles(options):
+    hierarchy = MultigridHierarchy(helper_dofs(16, 2), helper_poisson)
+    A = hierarchy.operators[0]
+    M = hierarchy.preconditioner(**options)
+    assert M.levelSizes == [1089, 289, 81, 25, 9]
+    assert 1.0 < M.operatorComplexity < 1.5
+
+    b = A.createVector()
+    b.owned[:] = 1.0
+    solver = ConjugateGradient(A, M, rtol=1.0e-10)
+    x = solver.solve(b)
+    assert solver.converged
+    assert x.gather() == pytest.approx(createPreconditioner(A, "lu").apply(b).gather(), abs=1.0e-9)
+    assert solver.iterations <= 30
+
+@pytest.mark.mpi(max_size=4)
+def test_pMultigrid():
+    # Orders 4 -> 2 -> 1 on one mesh, without geometric levels
+    dofs = helper_dofs(4, 4)
+    hierarchy = MultigridHierarchy(dofs, helper_poisson, nLevels=3)
+    assert [hierarchy.dofs(it).quadrature.order for it in range(hierarchy.nLevels)] == [4, 2, 1]
+    assert all(hierarchy.dofs(it).geometry is dofs.geometry for it in range(hierarchy.nLevels))
+
+    A = hierarchy.operators[0]
+    b = A.createVector()
+    b.owned[:] = 1.0
+    solver = ConjugateGradient(A, hierarchy.preconditioner(preSmooth=2, postSmooth=2), rtol=1.0e-10)
+    solver.solve(b)
+    assert solver.converged
+    assert solver.iterations <= 20
+
+def test_unsupported(tmpdir):
+    with pytest.raises(AssertionError):
+        MultigridHierarchy(DoFHandler(helper_gmsh_geometry(tmpdir), Quadrature2D(order=1)), helper_poisson)
+    geom = Geometry2D()
+    geom.readInternal(xExtent=(0,1), nX=3, yExtent=(0,1), nY=4)
+    with pytest.raises(AssertionError):
+        geom.coarsen()
+    hierarchy = MultigridHierarchy(helper_dofs(4, 1), helper_poisson)
+    with pytest.raises(AssertionError):
+        hierarchy.preconditioner(cycle="F")
+    with pytest.raises(RuntimeError):
+        hierarchy.preconditioner(smoother="gauss-seidel")
+
+###################################################################################################
+# Helper functions
+###################################################################################################
+def helper_dofs(n, order):
+    geom = Geometry2D()
+    geom.readInternal(xExtent=(0,1), nX=n, yExtent=(0,1), nY=n)
+    return DoFHandler(geom, Quadrature2D(order=order))
+
+def helper_matrix(dofs, term):
+    assembler = ElementAssembler(dofs)
+    local = assembler.stiffnessMatrices() if term == "stiffness" else assembler.massMatrices()
+    return DistributedAssembler(dofs).assembleMatrix(local)
+
+def helper_poisson(dofs):
+    A = helper_matrix(dofs, "stiffness")
+    bc = DirichletCondition(dofs, {"xneg": 0.0, "xpos": 0.0, "yneg": 0.0})
+    bc.apply(A)
+    return A, bc
@@ -1,27 +1,87 @@
-from numpy import sqrt, array, linspace, zeros, einsum, meshgrid, ravel
+from numpy import sqrt, array, arange, asarray, diag, empty, linspace, zeros, einsum, meshgrid, ravel
+from numpy.linalg import eigh
 from mpl_toolkits.mplot3d import Axes3D
 from matplotlib import pyplot as plt
 
+# Reference tables are shared by every quadrature object of the same (dim, order, nPoints)
+_referenceTableCache = {}
+# Gauss-Legendre rules by number of points
+_gaussRuleCache = {}
+
+def legendre(x, n):
+    '''Legendre polynomials P_0..P_n at x, shape x.shape + (n+1,)'''
+    x = asarray(x, dtype="float64")
+    P = empty(x.shape + (n+1,))
+    P[...,0] = 1.0
+    if n > 0:
+        P[...,1] = x
+    for k in range(2, n+1):
+        P[...,k] = ((2*k-1)*x*P[...,k-1] - (k-1)*P[...,k-2]) / k
+    return P
+
+def gaussLegendre(nPoints):
+    '''Return points and weights of the nPoints Gauss-Legendre rule on [-1, 1]
+
+    Golub-Welsch: the points are the eigenvalues of the Jacobi matrix of the Legendre
+    recurrence and the weights follow from the first eigenvector components. One Newton step
+    on P_n polishes the points to round-off'''
+    if nPoints not in _gaussRuleCache:
+        assert nPoints >= 1, "Gauss rule needs at least one point"
+        k = arange(1, nPoints)
+        beta = k / sqrt(4.0*k**2 - 1.0)
+        points, vectors = eigh(diag(beta, 1) + diag(beta, -1))
+        weights = 2.0 * vectors[0]**2
+
+        P = legendre(points, nPoints)
+        dP = nPoints * (points*P[:,nPoints] - P[:,nPoints-1]) / (points**2 - 1.0)
+        points = points - P[:,nPoints] / dP
+        points = 0.5*(points - points[::-1])
+        weights = 0.5*(weights + weights[::-1])
+        for value in (points, weights):
+            value.setflags(write=False)
+        _gaussRuleCache[nPoints] = (points, weights)
+    return _gaussRuleCache[nPoints]
+
+def integratedLegendre(x, order):
+    '''Hierarchical 1D basis and derivatives at x, each shape x.shape + (order+1,)
+
+    Vertex functions (1-x)/2, (1+x)/2 followed by the modes
+    phi_k = -2 int_{-1}^x P_{k-1} = -2 (P_k - P_{k-2})/(2k-1), k = 2..order, which vanish at
+    both ends and have parity (-1)^k'''
+    x = asarray(x, dtype="float64")
+    P = legendre(x, order)
+    values, grads = empty(x.shape + (order+1,)), empty(x.shape + (order+1,))
+    values[...,0], values[...,1] = 0.5*(1.0 - x), 0.5*(1.0 + x)
+    grads[...,0], grads[...,1] = -0.5, 0.5
+    for k in range(2, order+1):
+        values[...,k] = -2.0*(P[...,k] - P[...,k-2]) / (2*k-1)
+        grads[...,k] = -2.0*P[...,k-1]
+    return values, grads
+
+def exactPoints(degree):
+    '''Fewest Gauss points integrating polynomials of the given degree exactly'''
+    return max(degree, 0)//2 + 1
+
+def exactRules(order, sourceDegree=0):
+    '''Per-term points exact on affine cells: stiffness and mass integrands reach degree 2*order
+    in one direction, the source term order+sourceDegree'''
+    return {"stiffness": order+1, "mass": order+1, "source": exactPoints(order + sourceDegree)}
+
 class QuadratureBase():
-    def __init__(self, order=1):
+    '''Gauss rule with nPoints per direction (order+1 by default, exact for the mass matrix)
+    paired with the hierarchical basis of the given order
+
+    rules optionally maps an integral ("stiffness", "mass", "source") to its own number of
+    points per direction; rule(term) returns the matching quadrature object'''
+
+    def __init__(self, order=1, nPoints=None, rules=None):
+        if order < 1:
+            raise RuntimeError("Unsupported Quadrature Order: {0:2g}".format(order))
         self._order = order
-        if self._order == 1:
-            self.q = [  [-1.0/sqrt(3.0), 1.0],
-                        [ 1.0/sqrt(3.0), 1.0]
-                     ]
-        elif self._order == 2:
-            self.q = [  [-sqrt(3.0/5.0), 5.0/9.0],
-                        [ 0.0,              8.0/9.0],
-                        [ sqrt(3.0/5.0), 5.0/9.0]
-                     ]
-        elif self._order == 3:
-            self.q = [  [-sqrt(3.0/7.0 + 2.0/7.0 * sqrt(6.0/5.0)), (18.0 - sqrt(30.0))/36.0],
-                        [-sqrt(3.0/7.0 - 2.0/7.0 * sqrt(6.0/5.0)), (18.0 + sqrt(30.0))/36.0],
-                        [ sqrt(3.0/7.0 - 2.0/7.0 * sqrt(6.0/5.0)), (18.0 + sqrt(30.0))/36.0],
-                        [ sqrt(3.0/7.0 + 2.0/7.0 * sqrt(6.0/5.0)), (18.0 - sqrt(30.0))/36.0]
-                     ]
-        else:
-            raise RuntimeError("Unsupported Quadrature Order: {0:2g}".format(self._order))
+        self._nPoints = order+1 if nPoints is None else nPoints
+        self._rules = {} if rules is None else dict(rules)
+        points, weights = gaussLegendre(self._nPoints)
+        self.q = [[x, w] for x,w in zip(points, weights)]
 
     def __iter__(self):
         return QuadratureIterator(self)
@@ -30,45 +90,92 @@ class QuadratureBase():
     def order(self):
         return self._order
 
-    # Hierarchical shape functions from Lagrange polynomials
-    def get_local_shape_vector(self, quadrature_point):
-        if self._order == 1:
-            return 0.5 * array([1.0 - quadrature_point,
-                                1.0 + quadrature_point
-                               ])
-        elif self._order == 2:
-            return 0.5 * array([1.0 - quadrature_point,
-                                1.0 + quadrature_point,
-                                2.0 * (1.0 - quadrature_point**2)
-                               ])
-        elif self._order == 3:
-            return 0.5 * array([1.0 - quadrature_point,
-                                1.0 + quadrature_point,
-                                2.0 * (1.0 - quadrature_point**2),
-                                1.125 * (1.0 - 3.0*quadrature_point - quadrature_point**2 + 3.0*quadrature_point**3)
-                               ])
+    @property
+    def nPoints(self):
+        '''Number of Gauss points per direction'''
+        return self._nPoints
+
+    @property
+    def rules(self):
+        return self._rules
+
+    def rule(self, term):
+        '''Quadrature of the same order and class with the points chosen for term'''
+        nPoints = self._rules.get(term, self._nPoints)
+        if nPoints == self._nPoints:
+            return self
+        return type(self)(order=self._order, nPoints=nPoints)
+
+    # Precomputed reference tables, read-only and in QuadratureIterator order
+    @property
+    def points(self):
+        '''Quadrature points (nq, dim)'''
+        return self._referenceTables(self.dim)["points"]
+
+    @property
+    def weights(self):
+        '''Quadrature weights (nq,)'''
+        return self._referenceTables(self.dim)["weights"]
+
+    @property
+    def shapeValues(self):
+        '''Shape functions at every quadrature point (nq, nBasis)'''
+        return self._referenceTables(self.dim)["shape"]
+
+    @property
+    def shapeGradients(self):
+        '''Shape function gradients at every quadrature point (nq, nBasis, dim)'''
+        return self._referenceTables(self.dim)["grad"]
+
+    # 1D factors of the tensor-product tables, for sum factorization
+    @property
+    def shapeValues1D(self):
+        '''1D shape functions at the 1D quadrature points (nq1, nBasis1)'''
+        return self._referenceTables(1)["shape"]
+
+    @property
+    def shapeGradients1D(self):
+        '''1D shape function derivatives at the 1D quadrature points (nq1, nBasis1)'''
+        return self._referenceTables(1)["grad"][:,:,0]
+
+    def _referenceTables(self, dim):
+        key = (dim, self._order, self._nPoints)
+        if key not in _referenceTableCache:
+            _referenceTableCache[key] = self._buildReferenceTables(dim)
+        return _referenceTableCache[key]
+
+    def _buildReferenceTables(self, dim):
+        # 1D tables evaluated in one batch, 2D tables as their tensor product
+        points, weights = gaussLegendre(self._nPoints)
+        shape, grad = integratedLegendre(points, self._order)
+
+        if dim == 1:
+            points = points.reshape(-1, 1)
+            grad = grad.reshape(len(points), -1, 1)
+        elif dim == 2:
+            nq, nb = shape.shape
+            points = array([[x, y] for x in points for y in points])
+            weights = einsum("a,b->ab", weights, weights).ravel()
+            grad2D = zeros((nq, nq, nb, nb, 2))
+            grad2D[...,0] = einsum("ai,bj->abij", grad, shape)
+            grad2D[...,1] = einsum("ai,bj->abij", shape, grad)
+            grad = grad2D.reshape(nq*nq, nb*nb, 2)
+            shape = einsum("ai,bj->abij", shape, shape).reshape(nq*nq, nb*nb)
         else:
-            raise RuntimeError("Unsupported Quadrature Order: {0:2g}".format(self._order))
+            raise RuntimeError("Unsupported Quadrature Dimension: {0:2g}".format(dim))
+
+        tables = {"points": points, "weights": weights, "shape": shape, "grad": grad}
+        for value in tables.values():
+            value.setflags(write=False)
+        return tables
+
+    # Hierarchical shape functions from integrated Legendre polynomials
+    def get_local_shape_vector(self, quadrature_point):
+        return integratedLegendre(quadrature_point, self._order)[0]
 
     # Gradients of shape functions
     def get_local_grad_shape_vector(self, quadrature_point):
-        if self._order == 1:
-            return 0.5 * array([-1.0,
-                                 1.0
-                               ])
-        elif self._order == 2:
-            return 0.5 * array([-1.0,
-                                 1.0,
-                                -4.0 * quadrature_point
-                               ])
-        elif self._order == 3:
-            return 0.5 * array([-1.0,
-                                 1.0,
-                                -4.0 * quadrature_point,
-                                -1.125 * (3.0 + 2.0*quadrature_point - 9.0*quadrature_point**2)
-                               ])
-        else:
-            raise RuntimeError("Unsupported Quadrature Order: {0:2g}".format(self._order))
+        return integratedLegendre(quadrature_point, self._order)[1]
 
     def plot_shape_functions(self, show_fig=False, save_fig=False):
         ref_geom = linspace(-1, 1, 100)
@@ -96,8 +203,8 @@ class QuadratureBase():
 
 
 class Quadrature1D(QuadratureBase):
-    def __init__(self, order=1):
-        super().__init__(order)
+    def __init__(self, order=1, nPoints=None, rules=None):
+        super().__init__(order, nPoints, rules)
         self.dim = 1
 
     @property
@@ -114,8 +221,8 @@ class Quadrature1D(QuadratureBase):
         return super().plot_shape_functions(show_fig, save_fig)
 
 class Quadrature2D(QuadratureBase):
-    def __init__(self, order=1):
-        super().__init__(order)
+    def __init__(self, order=1, nPoints=None, rules=None):
+        super().__init__(order, nPoints, rules)
         self.dim = 2
 
     @property
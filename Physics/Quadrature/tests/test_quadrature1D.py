@@ -1,5 +1,6 @@
-from ..Quadrature import Quadrature1D
+from ..Quadrature import Quadrature1D, gaussLegendre, integratedLegendre
 import pytest
+from numpy import linspace
 
 def test_weights_linear():
     q1 = Quadrature1D(order=1)
@@ -38,6 +39,53 @@ def test_weights_quartic():
     q3 = Quadrature1D(order=3)
     assert helper_check_integrand(expected=-10.6, quad=q3, funct=quartic_function)
 
+def test_reference_tables():
+    quad = Quadrature1D(order=3)
+    assert quad.points.shape == (4, 1)
+    assert quad.weights.shape == (4,)
+    assert quad.shapeValues.shape == (4, 4)
+    assert quad.shapeGradients.shape == (4, 4, 1)
+    for it,(x, w) in enumerate(quad):
+        assert quad.points[it,0] == pytest.approx(x)
+        assert quad.weights[it] == pytest.approx(w)
+        assert quad.shapeValues[it] == pytest.approx(quad.get_local_shape_vector(x))
+        assert quad.shapeGradients[it,:,0] == pytest.approx(quad.get_local_grad_shape_vector(x))
+    assert Quadrature1D(order=3).shapeValues is quad.shapeValues
+
+@pytest.mark.parametrize("nPoints", [1, 5, 12, 30])
+def test_gaussLegendre(nPoints):
+    points, weights = gaussLegendre(nPoints)
+    assert points.shape == weights.shape == (nPoints,)
+    assert gaussLegendre(nPoints)[0] is points
+    # Exact for monomials up to degree 2n-1
+    for degree in range(2*nPoints):
+        expected = 0.0 if degree % 2 else 2.0/(degree+1)
+        assert (weights * points**degree).sum() == pytest.approx(expected, abs=1.0e-13)
+
+@pytest.mark.parametrize("order", [2, 4, 7])
+def test_integratedLegendre(order):
+    x = linspace(-1.0, 1.0, 9)
+    values, grads = integratedLegendre(x, order)
+    assert values.shape == grads.shape == (9, order+1)
+
+    # Vertex functions interpolate the ends, modes vanish there and have parity (-1)^k
+    assert values[0,:2] == pytest.approx([1.0, 0.0]) and values[-1,:2] == pytest.approx([0.0, 1.0])
+    assert values[[0,-1],2:] == pytest.approx(0.0*values[[0,-1],2:], abs=1.0e-14)
+    for k in range(2, order+1):
+        assert values[::-1,k] == pytest.approx((-1)**k * values[:,k])
+    assert values[:,2] == pytest.approx(1.0 - x**2)
+
+    # Derivatives match central differences
+    h = 1.0e-6
+    difference = (integratedLegendre(x+h, order)[0] - integratedLegendre(x-h, order)[0]) / (2.0*h)
+    assert grads == pytest.approx(difference, abs=1.0e-7)
+
+    quad = Quadrature1D(order=order)
+    assert quad.nBasisFunctions == order+1 and len(quad.weights) == order+1
+    assert Quadrature1D(order=order, nPoints=2).weights.shape == (2,)
+    with pytest.raises(RuntimeError):
+        Quadrature1D(order=0)
+
 ###################################################################################################
 # Helper functions
 ###################################################################################################
@@ -1,5 +1,6 @@
 from ..Quadrature import Quadrature2D
 import pytest
+from numpy import einsum
 
 def test_weights_linear():
     q1 = Quadrature2D(order=1)
@@ -64,6 +65,32 @@ def test_local_grad_shape():
     b3 = q3.get_local_grad_shape_vector((-0.5,-0.5))
     assert b3.shape == (16,2)
 
+@pytest.mark.parametrize("order", [1, 2, 3, 6])
+def test_reference_tables(order):
+    quad = Quadrature2D(order=order)
+    nq, nb = (order+1)**2, (order+1)**2
+    assert quad.points.shape == (nq, 2)
+    assert quad.weights.shape == (nq,)
+    assert quad.shapeValues.shape == (nq, nb)
+    assert quad.shapeGradients.shape == (nq, nb, 2)
+
+    # Tables follow the iterator ordering and the pointwise evaluation
+    for it,(xi, eta, w) in enumerate(quad):
+        assert quad.points[it] == pytest.approx([xi, eta])
+        assert quad.weights[it] == pytest.approx(w)
+        assert quad.shapeValues[it] == pytest.approx(quad.get_local_shape_vector((xi, eta)))
+        assert quad.shapeGradients[it] == pytest.approx(quad.get_local_grad_shape_vector((xi, eta)))
+
+    # 2D tables are the tensor product of the 1D factors
+    B, D = quad.shapeValues1D, quad.shapeGradients1D
+    assert B.shape == D.shape == (order+1, order+1)
+    assert quad.shapeValues == pytest.approx(einsum("ai,bj->abij", B, B).reshape(nq, nb))
+    assert quad.shapeGradients[:,:,0] == pytest.approx(einsum("ai,bj->abij", D, B).reshape(nq, nb))
+
+    # Computed once and shared, read-only
+    assert Quadrature2D(order=order).shapeGradients is quad.shapeGradients
+    with pytest.raises(ValueError):
+        quad.shapeValues[0,0] = 1.0
 
 ###################################################################################################
 # Helper functions
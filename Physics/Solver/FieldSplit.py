@@ -0,0 +1,179 @@
+from ..LinearAlgebra.LinearAlgebra import DistributedMatrix, DistributedVector
+from .Preconditioner import Preconditioner, createPreconditioner
+from .Solver import ConjugateGradient, GMRES
+from mpi4py import MPI
+from numpy import asarray, concatenate, unique
+
+class KrylovPreconditioner(Preconditioner):
+    '''Inner CG or GMRES solve to a loose tolerance, used as a preconditioner
+
+    The result depends nonlinearly on r, so an outer GMRES must be flexible'''
+
+    def __init__(self, A, method="cg", preconditioner="jacobi", preconditionerOptions=None, rtol=1.0e-2,
+                 maxIterations=100, restart=30):
+        super().__init__(A)
+        M = createPreconditioner(A, preconditioner, **({} if preconditionerOptions is None else preconditionerOptions))
+        if method == "cg":
+            self._solver = ConjugateGradient(A, M, rtol=rtol, maxIterations=maxIterations)
+        elif method == "gmres":
+            self._solver = GMRES(A, M, rtol=rtol, maxIterations=maxIterations, restart=restart, flexible=True)
+        else:
+            raise RuntimeError(f"Unsupported inner Krylov method: {method}")
+        self._iterations = 0
+
+    @property
+    def iterations(self):
+        '''Inner iterations summed over every apply'''
+        return self._iterations
+
+    def apply(self, r, z=None):
+        z = r.duplicate() if z is None else z
+        z.owned[:] = 0.0
+        self._solver.solve(r, z)
+        self._iterations += self._solver.iterations
+        return z
+
+def createBlockSolver(A, solver="preonly", preconditioner="block-jacobi", **options):
+    '''Inner solver of one field block
+
+    "preonly" applies the named preconditioner once (options are its own), "cg" and "gmres"
+    iterate with it (options: rtol, maxIterations, restart, preconditionerOptions) and "lu"
+    factorizes the block directly'''
+    if solver == "preonly":
+        return createPreconditioner(A, preconditioner, **options)
+    elif solver == "lu":
+        return createPreconditioner(A, "lu")
+    elif solver in ["cg", "gmres"]:
+        return KrylovPreconditioner(A, solver, preconditioner, **options)
+    raise RuntimeError(f"Unsupported block solver: {solver}")
+
+class SchurComplement():
+    '''S = A_11 - A_10 A_00^{-1} A_01 applied through products with the full matrix
+
+    A_00^{-1} is the first field's block solver, so S is exact when that solve is'''
+
+    def __init__(self, split, first, second):
+        self._split = split
+        self._first, self._second = first, second
+
+    @property
+    def layout(self):
+        return self._split.block(self._second).layout
+
+    def createVector(self):
+        return DistributedVector(self.layout)
+
+    def mult(self, x: DistributedVector, y: DistributedVector = None):
+        y = self.createVector() if y is None else y
+        coupling, diagonal = self._split.product(self._second, x.owned, [self._first, self._second])
+        correction, = self._split.product(self._first, self._split.solveField(self._first, coupling), [self._second])
+        y.owned[:] = diagonal - correction
+        return y
+
+class FieldSplitPreconditioner(Preconditioner):
+    '''Block preconditioner from the per-field index sets of a coupled matrix
+
+    indexSets maps every field to its owned positions in A (BlockDoFHandler.indexSets). The
+    diagonal blocks are extracted with DistributedMatrix.subMatrix and solved with the inner
+    solvers of createBlockSolver (solvers maps a field to its options). Blocks combine
+
+        additive:       z_f = A_ff^{-1} r_f for every field (block Jacobi)
+        multiplicative: fields in turn on the updated residual (block Gauss-Seidel), with
+                        symmetric a backward sweep follows
+        schur:          full block factorization of two fields; the Schur complement of the
+                        second is solved by GMRES preconditioned with its own block solver
+
+    Inner Krylov solvers make the preconditioner vary, so use a flexible outer GMRES'''
+
+    def __init__(self, A: DistributedMatrix, indexSets: dict, type="multiplicative", order=None, solvers=None,
+                 symmetric=False, schur=None):
+        assert type in ["additive", "multiplicative", "schur"], f"Unsupported field split: {type}"
+        super().__init__(A)
+        start = MPI.Wtime()
+        self._type = type
+        self._symmetric = symmetric
+        self._order = list(indexSets) if order is None else list(order)
+        self._sets = {name: asarray(indexSets[name], dtype="int64") for name in self._order}
+        covered = unique(concatenate([self._sets[name] for name in self._order]))
+        assert len(covered) == A.layout.nOwned and len(covered) == sum(len(it) for it in self._sets.values()), \
+            "Index sets must partition the owned rows"
+
+        solvers = {} if solvers is None else solvers
+        self._blocks = {name: A.subMatrix(self._sets[name]) for name in self._order}
+        self._solvers = {name: createBlockSolver(self._blocks[name], **solvers.get(name, {})) for name in self._order}
+        self._fieldVectors = {name: (DistributedVector(self._blocks[name].layout), DistributedVector(self._blocks[name].layout))
+                              for name in self._order}
+        self._embedded, self._product = A.createVector(), A.createVector()
+
+        self._schurIterations = []
+        if type == "schur":
+            assert len(self._order) == 2, "The Schur complement split needs exactly two fields"
+            options = {"rtol": 1.0e-8, "maxIterations": 200, "restart": 30, **({} if schur is None else schur)}
+            first, second = self._order
+            self._schur = GMRES(SchurComplement(self, first, second), self._solvers[second], flexible=True, **options)
+        self._setupTime = MPI.Wtime() - start
+
+    @property
+    def order(self):
+        return self._order
+
+    @property
+    def setupTime(self):
+        return self._setupTime
+
+    @property
+    def schurIterations(self):
+        '''GMRES iterations of every Schur complement solve'''
+        return self._schurIterations
+
+    def block(self, name):
+        '''Diagonal block A_ff of a field as a DistributedMatrix on its own layout'''
+        return self._blocks[name]
+
+    def solver(self, name):
+        return self._solvers[name]
+
+    def solveField(self, name, values):
+        '''Return A_ff^{-1} values (owned entries of the field) with the field's block solver'''
+        rf, zf = self._fieldVectors[name]
+        rf.owned[:] = values
+        self._solvers[name].apply(rf, zf)
+        return zf.owned.copy()
+
+    def product(self, name, values, rows):
+        '''Return the owned entries of A x for the fields in rows, x holding values on one field'''
+        self._embedded.owned[:] = 0.0
+        self._embedded.owned[self._sets[name]] = values
+        self._A.mult(self._embedded, self._product)
+        return [self._product.owned[self._sets[it]] for it in rows]
+
+    def apply(self, r, z=None):
+        z = r.duplicate() if z is None else z
+        if self._type == "additive":
+            for name in self._order:
+                z.owned[self._sets[name]] = self.solveField(name, r.owned[self._sets[name]])
+        elif self._type == "multiplicative":
+            z.owned[:] = 0.0
+            sweep = self._order + (self._order[-2::-1] if self._symmetric else [])
+            residual = r.owned
+            for it, name in enumerate(sweep):
+                if it > 0:
+                    self._A.mult(z, self._product)
+                    residual = r.owned - self._product.owned
+                z.owned[self._sets[name]] += self.solveField(name, residual[self._sets[name]])
+        else:
+            self.__schurApply(r, z)
+        return z
+
+    def __schurApply(self, r, z):
+        first, second = self._order
+        # Lower solve, Schur complement solve, then the upper back substitution
+        y = self.solveField(first, r.owned[self._sets[first]])
+        coupling, = self.product(first, y, [second])
+        rhs, solution = DistributedVector(self._blocks[second].layout), DistributedVector(self._blocks[second].layout)
+        rhs.owned[:] = r.owned[self._sets[second]] - coupling
+        self._schur.solve(rhs, solution)
+        self._schurIterations.append(self._schur.iterations)
+        coupling, = self.product(second, solution.owned, [first])
+        z.owned[self._sets[first]] = self.solveField(first, r.owned[self._sets[first]] - coupling)
+        z.owned[self._sets[second]] = solution.owned
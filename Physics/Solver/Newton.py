@@ -0,0 +1,221 @@
+from ..LinearAlgebra.LinearAlgebra import DistributedVector
+from .Solver import GMRES
+from .Preconditioner import createPreconditioner
+from mpi4py import MPI
+from numpy import finfo, sqrt
+
+class FiniteDifferenceJacobian():
+    '''Jacobian-free product J v ~ (F(x + h v) - F(x)) / h around a fixed (x, F(x))
+
+    h = sqrt(machine eps) (1 + |x|) / |v| balances truncation and round-off'''
+
+    def __init__(self, residual, x: DistributedVector, F: DistributedVector):
+        self._residual = residual
+        self._x, self._F = x, F
+        self._xNorm = x.norm()
+        self._shifted = x.duplicate()
+        self._Fshifted = x.duplicate()
+
+    @property
+    def layout(self):
+        return self._x.layout
+
+    def createVector(self):
+        return self._x.duplicate()
+
+    def mult(self, v: DistributedVector, y: DistributedVector = None):
+        y = self.createVector() if y is None else y
+        vNorm = v.norm()
+        if vNorm == 0.0:
+            y.owned[:] = 0.0
+            return y
+        h = sqrt(finfo(float).eps) * (1.0 + self._xNorm) / vNorm
+        self._shifted.owned[:] = self._x.owned + h*v.owned
+        self._residual(self._shifted, self._Fshifted)
+        y.owned[:] = (self._Fshifted.owned - self._F.owned) / h
+        return y
+
+class NewtonKrylov():
+    '''Inexact Newton with GMRES inner solves
+
+    problem provides createVector(), residual(x, F=None) and jacobian(x) returning a
+    DistributedMatrix. Forcing terms follow Eisenstat-Walker choice 2, steps are globalized by
+    a backtracking line search on |F|. The assembled Jacobian is rebuilt every jacobianLag
+    iterations and the preconditioner every preconditionerLag iterations; a stale Jacobian is
+    refreshed when its step fails. With jacobianFree the Krylov operator is the finite
+    difference product and the (lagged) Jacobian only feeds the preconditioner. flexible runs
+    FGMRES, needed by preconditioners with inner Krylov solves'''
+
+    def __init__(self, problem, preconditioner="jacobi", preconditionerOptions=None, rtol=1.0e-8, atol=1.0e-12,
+                 maxIterations=50, forcing="eisenstat-walker", eta=1.0e-4, etaMax=0.9, gamma=0.9, alpha=2.0,
+                 lineSearch=True, maxBacktracks=10, jacobianLag=1, preconditionerLag=1, jacobianFree=False,
+                 restart=30, maxLinearIterations=500, flexible=False):
+        assert forcing in ["eisenstat-walker", "constant"], f"Unsupported forcing term: {forcing}"
+        assert jacobianLag >= 1 and preconditionerLag >= 1, "Lags count Newton iterations and start at 1"
+        self._problem = problem
+        self._preconditionerName = preconditioner
+        self._preconditionerOptions = {} if preconditionerOptions is None else preconditionerOptions
+        self._rtol, self._atol = rtol, atol
+        self._maxIterations = maxIterations
+        self._forcing = forcing
+        self._eta0, self._etaMax, self._gamma, self._alpha = eta, etaMax, gamma, alpha
+        self._lineSearch = lineSearch
+        self._maxBacktracks = maxBacktracks
+        self._jacobianLag, self._preconditionerLag = jacobianLag, preconditionerLag
+        self._jacobianFree = jacobianFree
+        self._restart = restart
+        self._flexible = flexible
+        self._maxLinearIterations = maxLinearIterations
+        self.__reset()
+
+    def __reset(self):
+        self._history = []
+        self._linearIterations = []
+        self._forcingTerms = []
+        self._stepLengths = []
+        self._jacobianBuilds = 0
+        self._preconditionerBuilds = 0
+        self._residualEvaluations = 0
+        self._converged = False
+        self._solveTime = 0.0
+
+    @property
+    def iterations(self):
+        return max(len(self._history) - 1, 0)
+
+    @property
+    def residualHistory(self):
+        '''Nonlinear residual 2-norms, starting with the initial residual'''
+        return self._history
+
+    @property
+    def linearIterations(self):
+        '''GMRES iterations of every Newton step'''
+        return self._linearIterations
+
+    @property
+    def forcingTerms(self):
+        return self._forcingTerms
+
+    @property
+    def stepLengths(self):
+        return self._stepLengths
+
+    @property
+    def jacobianBuilds(self):
+        return self._jacobianBuilds
+
+    @property
+    def preconditionerBuilds(self):
+        return self._preconditionerBuilds
+
+    @property
+    def residualEvaluations(self):
+        return self._residualEvaluations
+
+    @property
+    def converged(self):
+        return self._converged
+
+    @property
+    def solveTime(self):
+        return self._solveTime
+
+    def __residual(self, x, F=None):
+        self._residualEvaluations += 1
+        return self._problem.residual(x, F)
+
+    def __forcingTerm(self, norm, previousNorm, previousEta):
+        if self._forcing == "constant" or previousNorm is None:
+            return self._eta0
+        eta = self._gamma * (norm / previousNorm)**self._alpha
+        # Safeguard against dropping eta too fast while the residual still stalls
+        safeguard = self._gamma * previousEta**self._alpha
+        if safeguard > 0.1:
+            eta = max(eta, safeguard)
+        # Do not oversolve close to the nonlinear tolerance
+        eta = max(eta, 0.5 * self._tolerance / norm)
+        return min(eta, self._etaMax)
+
+    def solve(self, x: DistributedVector = None):
+        problem = self._problem
+        self.__reset()
+        comm = problem.layout.comm
+        comm.Barrier()
+        start = MPI.Wtime()
+        x = problem.createVector() if x is None else x
+        F = self.__residual(x)
+        norm = F.norm()
+        self._history = [norm]
+        self._tolerance = max(self._rtol * norm, self._atol)
+
+        # Jacobian-free runs without a preconditioner never assemble
+        assembled = not self._jacobianFree or self._preconditionerName != "none"
+        J = M = None
+        jacobianAge = preconditionerAge = 0
+        previousNorm, eta = None, self._eta0
+        trial, Ftrial, step, rhs = x.duplicate(), x.duplicate(), x.duplicate(), x.duplicate()
+        while norm > self._tolerance and self.iterations < self._maxIterations:
+            eta = self.__forcingTerm(norm, previousNorm, eta)
+            refresh = False
+            while True:
+                # Ages count Newton iterations since the last build
+                fdOperator = FiniteDifferenceJacobian(self.__residual, x, F) if self._jacobianFree else None
+                if assembled and (J is None or jacobianAge >= self._jacobianLag or refresh):
+                    J, jacobianAge = problem.jacobian(x), 0
+                    self._jacobianBuilds += 1
+                if M is None or preconditionerAge >= self._preconditionerLag or refresh:
+                    A = J if assembled else fdOperator
+                    M, preconditionerAge = createPreconditioner(A, self._preconditionerName, **self._preconditionerOptions), 0
+                    self._preconditionerBuilds += 1
+                operator = fdOperator if self._jacobianFree else J
+
+                rhs.owned[:] = -F.owned
+                step.owned[:] = 0.0
+                linear = GMRES(operator, M, rtol=eta, maxIterations=self._maxLinearIterations, restart=self._restart,
+                               flexible=self._flexible)
+                linear.solve(rhs, step)
+                lam, trialNorm = self.__lineSearch(x, step, norm, trial, Ftrial)
+                if lam is not None or refresh or jacobianAge + preconditionerAge == 0:
+                    break
+                # The step from a stale Jacobian or preconditioner failed; rebuild both here
+                refresh = True
+
+            self._linearIterations.append(linear.iterations)
+            self._forcingTerms.append(eta)
+            if lam is None:
+                break
+            self._stepLengths.append(lam)
+            x.owned[:] = trial.owned
+            F.owned[:] = Ftrial.owned
+            previousNorm, norm = norm, trialNorm
+            self._history.append(norm)
+            jacobianAge += 1
+            preconditionerAge += 1
+
+        self._converged = norm <= self._tolerance
+        self._solveTime = MPI.Wtime() - start
+        return x
+
+    def __lineSearch(self, x, step, norm, trial, Ftrial, c=1.0e-4):
+        '''Backtrack until |F(x + lam s)| <= (1 - c lam) |F(x)|; quadratic model of |F|^2/2
+        picks lam within [0.1, 0.5] of the previous one. Returns (lam, norm) or (None, None)'''
+        lam = 1.0
+        for _ in range(self._maxBacktracks + 1):
+            trial.owned[:] = x.owned + lam*step.owned
+            self.__residual(trial, Ftrial)
+            trialNorm = Ftrial.norm()
+            if trialNorm <= (1.0 - c*lam) * norm or not self._lineSearch:
+                return lam, trialNorm
+            # f(lam) = |F|^2/2 with f'(0) ~ -|F(x)|^2 for a Newton direction
+            f0, slope, fl = 0.5*norm**2, -norm**2, 0.5*trialNorm**2
+            curvature = fl - f0 - slope*lam
+            model = -slope*lam**2 / (2.0*curvature) if curvature > 0.0 else 0.5*lam
+            lam = min(max(model, 0.1*lam), 0.5*lam)
+        return None, None
+
+    def report(self):
+        status = "converged" if self._converged else "not converged"
+        return f"Newton-Krylov {status} in {self.iterations} iterations ({sum(self._linearIterations)} linear), " \
+            f"residual {self._history[0]:.3e} -> {self._history[-1]:.3e}, {self._jacobianBuilds} Jacobians, " \
+            f"{self._preconditionerBuilds} preconditioners, {self._residualEvaluations} residuals, {self._solveTime:.3e}s"
@@ -0,0 +1,84 @@
+from ..LinearAlgebra.LinearAlgebra import DistributedVector
+from .Newton import NewtonKrylov
+from mpi4py import MPI
+
+class PicardSolver():
+    '''Operator-split solve of a CoupledProblem by nonlinear block Gauss-Seidel sweeps
+
+    Every sweep solves each field in turn with NewtonKrylov while the other fields stay frozen
+    at their latest values, and stops once the coupled residual drops below
+    max(rtol |F(x0)|, atol). fieldOptions maps a field name to NewtonKrylov options; the inner
+    solves default to rtol=1e-3, which is enough for a linearly converging outer iteration.
+    relaxation under-relaxes every field update'''
+
+    def __init__(self, problem, order=None, rtol=1.0e-8, atol=1.0e-12, maxIterations=50, relaxation=1.0, fieldOptions=None):
+        assert 0.0 < relaxation <= 1.0, "Relaxation must lie in (0, 1]"
+        self._problem = problem
+        self._order = list(problem.fields) if order is None else list(order)
+        assert set(self._order) <= set(problem.fields), "Unknown field in the Picard order"
+        self._rtol, self._atol = rtol, atol
+        self._maxIterations = maxIterations
+        self._relaxation = relaxation
+        self._fieldOptions = {} if fieldOptions is None else fieldOptions
+        self.__reset()
+
+    def __reset(self):
+        self._history = []
+        self._fieldIterations = {name: [] for name in self._order}
+        self._converged = False
+        self._solveTime = 0.0
+
+    @property
+    def iterations(self):
+        return max(len(self._history) - 1, 0)
+
+    @property
+    def residualHistory(self):
+        '''Coupled residual 2-norms after every sweep, starting with the initial residual'''
+        return self._history
+
+    @property
+    def fieldIterations(self):
+        '''Newton iterations of every field solve, per sweep'''
+        return self._fieldIterations
+
+    @property
+    def converged(self):
+        return self._converged
+
+    @property
+    def solveTime(self):
+        return self._solveTime
+
+    def solve(self, x: DistributedVector = None):
+        problem = self._problem
+        self.__reset()
+        comm = problem.layout.comm
+        comm.Barrier()
+        start = MPI.Wtime()
+        x = problem.createVector() if x is None else x
+        F = problem.residual(x)
+        norm = F.norm()
+        self._history = [norm]
+        tolerance = max(self._rtol * norm, self._atol)
+
+        while norm > tolerance and self.iterations < self._maxIterations:
+            for name in self._order:
+                field = problem.fieldProblem(name, x)
+                options = {"rtol": 1.0e-3, "atol": 0.1*tolerance, **self._fieldOptions.get(name, {})}
+                solver = NewtonKrylov(field, **options)
+                field.update(solver.solve(field.createVector()), self._relaxation)
+                self._fieldIterations[name].append(solver.iterations)
+            problem.residual(x, F)
+            norm = F.norm()
+            self._history.append(norm)
+
+        self._converged = norm <= tolerance
+        self._solveTime = MPI.Wtime() - start
+        return x
+
+    def report(self):
+        status = "converged" if self._converged else "not converged"
+        inner = ", ".join(f"{name} {sum(its)}" for name, its in self._fieldIterations.items())
+        return f"Picard {status} in {self.iterations} sweeps (Newton iterations: {inner}), " \
+            f"residual {self._history[0]:.3e} -> {self._history[-1]:.3e}, {self._solveTime:.3e}s"
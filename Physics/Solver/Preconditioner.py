@@ -0,0 +1,224 @@
+from ..LinearAlgebra.LinearAlgebra import DistributedMatrix, DistributedVector
+from numpy.random import default_rng
+from numpy import arange, argsort, bincount, cumsum, diff, flatnonzero, ones, repeat, searchsorted, unique, zeros
+from scipy.sparse import csr_array, tril, triu, identity
+from scipy.sparse.linalg import splu, spsolve_triangular
+
+class Preconditioner():
+    '''Approximate inverse z = M^{-1} r of a DistributedMatrix'''
+
+    def __init__(self, A: DistributedMatrix):
+        self._A = A
+
+    def apply(self, r: DistributedVector, z: DistributedVector = None):
+        raise NotImplementedError("Preconditioner must implement apply(r, z)")
+
+class IdentityPreconditioner(Preconditioner):
+    def apply(self, r, z=None):
+        z = r.duplicate() if z is None else z
+        z.owned[:] = r.owned
+        return z
+
+class JacobiPreconditioner(Preconditioner):
+    '''Inverse of the owned diagonal'''
+
+    def __init__(self, A):
+        super().__init__(A)
+        diagonal = A.diagonal()
+        assert (diagonal != 0.0).all(), "Jacobi preconditioner requires a nonzero diagonal"
+        self._invDiagonal = 1.0 / diagonal
+
+    def apply(self, r, z=None):
+        z = r.duplicate() if z is None else z
+        z.owned[:] = self._invDiagonal * r.owned
+        return z
+
+class BlockJacobiPreconditioner(Preconditioner):
+    '''Solve with the owned diagonal block of every proc, factorized by sparse LU or ILU
+
+    "ilu" is ILU(0): no fill outside the pattern of the block, which keeps the factorization
+    symmetric for symmetric blocks (SuperLU's threshold ILU does not)'''
+
+    def __init__(self, A, method="lu"):
+        super().__init__(A)
+        block = A.diagonalBlock.tocsc()
+        if method == "lu":
+            self._factor = splu(block)
+        elif method == "ilu":
+            L, U = incompleteLU(A.diagonalBlock)
+            self._factor = TriangularFactors(L, U)
+        else:
+            raise RuntimeError(f"Unsupported block-Jacobi factorization: {method}")
+
+    def apply(self, r, z=None):
+        z = r.duplicate() if z is None else z
+        if len(r.owned) > 0:
+            z.owned[:] = self._factor.solve(r.owned)
+        return z
+
+class DirectPreconditioner(Preconditioner):
+    '''Sparse LU of the whole matrix, gathered on every proc
+
+    Every apply gathers the residual and solves the full system redundantly, so it is meant
+    for small (coarse or field) blocks'''
+
+    def __init__(self, A):
+        super().__init__(A)
+        self._factor = splu(A.gather().tocsc())
+
+    def apply(self, r, z=None):
+        z = r.duplicate() if z is None else z
+        start, end = r.layout.ownedRange
+        z.owned[:] = self._factor.solve(r.gather())[start:end]
+        return z
+
+class TriangularFactors():
+    def __init__(self, L, U):
+        self._L, self._U = L, U
+
+    def solve(self, r):
+        y = spsolve_triangular(self._L, r, lower=True, unit_diagonal=True)
+        return spsolve_triangular(self._U, y, lower=False)
+
+def incompleteLU(A):
+    '''ILU(0) of a csr_array: unit lower L and upper U on the pattern of A
+
+    Rows are eliminated level by level: the rows of a level only depend on rows of earlier
+    levels, so the s-th lower entries of all of them are eliminated together with update
+    targets found once from the pattern'''
+    A = csr_array(A, copy=True)
+    A.sort_indices()
+    n = A.shape[0]
+    indptr, indices, data = A.indptr, A.indices, A.data
+    diagonal = diagonalPositions(A)
+    rowOf = repeat(arange(n), diff(indptr))
+    lower = flatnonzero(indices < rowOf)
+    levels = eliminationLevels(rowOf[lower], indices[lower], n)
+    steps = lower - indptr[rowOf[lower]]
+
+    # Entry p = (i, k) updates (i, j) for every upper entry (k, j) in the pattern of row i
+    pivots = indices[lower]
+    counts = indptr[pivots+1] - diagonal[pivots] - 1
+    owner = repeat(arange(len(lower)), counts)
+    upper = repeat(diagonal[pivots] + 1, counts) + arange(len(owner)) - repeat(cumsum(counts) - counts, counts)
+    keys = rowOf.astype("int64") * n + indices
+    wanted = rowOf[lower][owner].astype("int64") * n + indices[upper]
+    target = searchsorted(keys, wanted).clip(max=max(len(keys)-1, 0))
+    found = keys[target] == wanted
+    owner, upper, target = owner[found], upper[found], target[found]
+
+    # Groups of one (level, step): no row appears twice, so the targets are distinct
+    group = levels[rowOf[lower]] * (steps.max(initial=0) + 1) + steps
+    groups, group = unique(group, return_inverse=True)
+    entries = argsort(group, kind="stable")
+    entryBounds = searchsorted(group[entries], arange(len(groups)+1))
+    updates = argsort(group[owner], kind="stable")
+    updateBounds = searchsorted(group[owner][updates], arange(len(groups)+1))
+    owner, upper, target = lower[owner[updates]], upper[updates], target[updates]
+    for g in range(len(groups)):
+        p = lower[entries[entryBounds[g]:entryBounds[g+1]]]
+        data[p] /= data[diagonal[indices[p]]]
+        u = slice(updateBounds[g], updateBounds[g+1])
+        data[target[u]] -= data[owner[u]] * data[upper[u]]
+    return (tril(A, k=-1) + identity(n)).tocsr(), triu(A).tocsr()
+
+def eliminationLevels(rows, cols, n):
+    '''Level of every row when row rows[e] needs row cols[e] first: one more than its deepest
+    dependency, found front by front'''
+    pending = bincount(rows, minlength=n)
+    dependents = csr_array((ones(len(rows)), (cols, rows)), shape=(n, n))
+    levels = zeros(n, dtype="int64")
+    front, depth = flatnonzero(pending == 0), 0
+    while len(front) > 0:
+        levels[front] = depth
+        reached, hits = unique(dependents[front].indices, return_counts=True)
+        pending[reached] -= hits
+        front, depth = reached[pending[reached] == 0], depth + 1
+    return levels
+
+def diagonalPositions(A):
+    '''Position of the diagonal entry in every sorted row of a csr_array'''
+    n = A.shape[0]
+    rowOf = repeat(arange(n), diff(A.indptr))
+    positions = A.indptr[:-1] + bincount(rowOf[A.indices < rowOf], minlength=n)
+    assert ((positions < A.indptr[1:]) & (A.indices[positions.clip(max=max(len(A.indices)-1, 0))] == arange(n))).all(), \
+        "ILU(0) requires a structurally nonzero diagonal"
+    return positions
+
+class ChebyshevPreconditioner(Preconditioner):
+    '''Fixed degree Chebyshev polynomial in the Jacobi scaled operator D^{-1}A
+
+    The upper eigenvalue is estimated by power iteration; the polynomial targets
+    [lambdaMax/eigenRatio, lambdaMax]'''
+
+    def __init__(self, A, degree=3, eigenRatio=30.0, powerIterations=15, safety=1.1, seed=0):
+        super().__init__(A)
+        self._degree = degree
+        self._invDiagonal = 1.0 / A.diagonal()
+        self._lambdaMax = safety * self.estimateLambdaMax(powerIterations, seed)
+        self._lambdaMin = self._lambdaMax / eigenRatio
+
+    @property
+    def eigenBounds(self):
+        return self._lambdaMin, self._lambdaMax
+
+    def estimateLambdaMax(self, iterations, seed=0):
+        x = self._A.createVector()
+        x.owned[:] = default_rng(seed + x.layout.comm.Get_rank()).random(len(x.owned))
+        y = x.duplicate()
+        estimate = 0.0
+        for _ in range(iterations):
+            x.owned[:] /= x.norm()
+            self._A.mult(x, y)
+            y.owned[:] *= self._invDiagonal
+            estimate = x.dot(y)
+            x, y = y, x
+        return estimate
+
+    def apply(self, r, z=None):
+        z = r.duplicate() if z is None else z
+        theta = 0.5 * (self._lambdaMax + self._lambdaMin)
+        delta = 0.5 * (self._lambdaMax - self._lambdaMin)
+        sigma = theta / delta
+        rho = 1.0 / sigma
+
+        d = r.duplicate()
+        d.owned[:] = self._invDiagonal * r.owned / theta
+        z.owned[:] = d.owned
+        residual = r.duplicate()
+        for _ in range(1, self._degree):
+            self._A.mult(z, residual)
+            residual.owned[:] = r.owned - residual.owned
+            rhoNew = 1.0 / (2.0*sigma - rho)
+            d.owned[:] = rhoNew*rho*d.owned + (2.0*rhoNew/delta) * self._invDiagonal * residual.owned
+            z.owned[:] += d.owned
+            rho = rhoNew
+        return z
+
+def createPreconditioner(A, name="jacobi", **options):
+    '''Preconditioner by name: none, jacobi, block-jacobi, chebyshev, lu, fieldsplit, multigrid, amg'''
+    if name == "none":
+        return IdentityPreconditioner(A)
+    elif name == "jacobi":
+        return JacobiPreconditioner(A)
+    elif name == "block-jacobi":
+        return BlockJacobiPreconditioner(A, **options)
+    elif name == "chebyshev":
+        return ChebyshevPreconditioner(A, **options)
+    elif name == "lu":
+        return DirectPreconditioner(A)
+    elif name == "fieldsplit":
+        # Field splits run inner Krylov solves, which import this module
+        from .FieldSplit import FieldSplitPreconditioner
+        return FieldSplitPreconditioner(A, **options)
+    elif name == "multigrid":
+        # A MultigridHierarchy holds the coarse levels below A
+        assert "hierarchy" in options, "Multigrid needs a hierarchy option"
+        hierarchy = options.pop("hierarchy")
+        return hierarchy.preconditioner(A, **options)
+    elif name == "amg":
+        # Passing a SmoothedAggregation setup reuses it for matrices with the same sparsity
+        from ..Multigrid.Aggregation import SmoothedAggregation
+        setup = options.pop("setup", None)
+        return (SmoothedAggregation() if setup is None else setup).preconditioner(A, **options)
+    raise RuntimeError(f"Unsupported preconditioner: {name}")
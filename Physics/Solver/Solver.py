@@ -0,0 +1,223 @@
+from ..LinearAlgebra.LinearAlgebra import DistributedMatrix, DistributedVector
+from .Preconditioner import Preconditioner, createPreconditioner
+from mpi4py import MPI
+from numpy import empty, zeros, hypot
+from numpy.linalg import solve as denseSolve
+
+class ConjugateGradient():
+    '''Preconditioned conjugate gradient on a DistributedMatrix
+
+    Dot products reduce with Allreduce and every operator application uses the halo-exchange
+    SpMV. Statistics of the last solve are kept on the solver'''
+
+    def __init__(self, A: DistributedMatrix, preconditioner: Preconditioner = None, rtol=1.0e-8, atol=0.0, maxIterations=1000):
+        self._A = A
+        self._comm = A.layout.comm
+        start = MPI.Wtime()
+        self._preconditioner = createPreconditioner(A, "jacobi") if preconditioner is None else preconditioner
+        self._setupTime = MPI.Wtime() - start
+        self._rtol = rtol
+        self._atol = atol
+        self._maxIterations = maxIterations
+        self._history = []
+        self._converged = False
+        self._solveTime = 0.0
+
+    @property
+    def iterations(self):
+        return max(len(self._history) - 1, 0)
+
+    @property
+    def residualHistory(self):
+        '''Unpreconditioned residual 2-norms, starting with the initial residual'''
+        return self._history
+
+    @property
+    def converged(self):
+        return self._converged
+
+    @property
+    def setupTime(self):
+        return self._setupTime
+
+    @property
+    def solveTime(self):
+        return self._solveTime
+
+    @property
+    def timePerIteration(self):
+        return self._solveTime / max(self.iterations, 1)
+
+    def solve(self, b: DistributedVector, x: DistributedVector = None):
+        self._comm.Barrier()
+        start = MPI.Wtime()
+        A, M = self._A, self._preconditioner
+        x = b.duplicate() if x is None else x
+
+        r = A.mult(x)
+        r.owned[:] = b.owned - r.owned
+        z = M.apply(r)
+        p = z.copy()
+        q = b.duplicate()
+        rz = r.dot(z)
+        tolerance = max(self._rtol * b.norm(), self._atol)
+        self._history = [r.norm()]
+        self._converged = self._history[-1] <= tolerance
+
+        while not self._converged and self.iterations < self._maxIterations:
+            A.mult(p, q)
+            alpha = rz / p.dot(q)
+            x.owned[:] += alpha * p.owned
+            r.owned[:] -= alpha * q.owned
+            self._history.append(r.norm())
+            if self._history[-1] <= tolerance:
+                self._converged = True
+                break
+
+            M.apply(r, z)
+            rzNew = r.dot(z)
+            p.owned[:] = z.owned + (rzNew / rz) * p.owned
+            rz = rzNew
+
+        self._solveTime = MPI.Wtime() - start
+        return x
+
+    def report(self):
+        status = "converged" if self._converged else "not converged"
+        return f"CG {status} in {self.iterations} iterations, residual {self._history[0]:.3e} -> {self._history[-1]:.3e}, " \
+            f"{self._comm.Get_size()} procs, setup {self._setupTime:.3e}s, {self.timePerIteration:.3e}s per iteration"
+
+class GMRES():
+    '''Restarted GMRES(m) with right preconditioning for nonsymmetric operators
+
+    A only needs mult(x, y) and createVector(), so assembled DistributedMatrix objects and
+    matrix-free operators both work. The Krylov basis is orthogonalized by classical
+    Gram-Schmidt applied twice, one Allreduce per pass. The residual norms tracked are those
+    of the least-squares problem, which equal the true residuals in exact arithmetic.
+    flexible keeps the preconditioned vectors (FGMRES), so the preconditioner may change
+    between iterations, e.g. when it runs inner Krylov solves'''
+
+    def __init__(self, A, preconditioner: Preconditioner = None, rtol=1.0e-8, atol=0.0, maxIterations=1000, restart=30,
+                 flexible=False):
+        self._A = A
+        self._comm = A.layout.comm
+        start = MPI.Wtime()
+        self._preconditioner = createPreconditioner(A, "jacobi") if preconditioner is None else preconditioner
+        self._setupTime = MPI.Wtime() - start
+        self._rtol = rtol
+        self._atol = atol
+        self._maxIterations = maxIterations
+        self._restart = restart
+        self._flexible = flexible
+        self._history = []
+        self._converged = False
+        self._solveTime = 0.0
+
+    @property
+    def iterations(self):
+        return max(len(self._history) - 1, 0)
+
+    @property
+    def residualHistory(self):
+        return self._history
+
+    @property
+    def converged(self):
+        return self._converged
+
+    @property
+    def setupTime(self):
+        return self._setupTime
+
+    @property
+    def solveTime(self):
+        return self._solveTime
+
+    @property
+    def timePerIteration(self):
+        return self._solveTime / max(self.iterations, 1)
+
+    def setTolerances(self, rtol=None, atol=None):
+        self._rtol = self._rtol if rtol is None else rtol
+        self._atol = self._atol if atol is None else atol
+
+    def __dots(self, V, w):
+        local = V.dot(w)
+        result = empty(len(local))
+        self._comm.Allreduce(local, result, op=MPI.SUM)
+        return result
+
+    def solve(self, b: DistributedVector, x: DistributedVector = None):
+        self._comm.Barrier()
+        start = MPI.Wtime()
+        A, M, m = self._A, self._preconditioner, self._restart
+        x = b.duplicate() if x is None else x
+        nOwned = len(b.owned)
+        V = zeros((m+1, nOwned))
+        H = zeros((m+1, m))
+        Z = zeros((m, nOwned)) if self._flexible else None
+        cs, sn = zeros(m), zeros(m)
+        z, w = b.duplicate(), b.duplicate()
+
+        tolerance = max(self._rtol * b.norm(), self._atol)
+        self._history = []
+        self._converged = False
+        while True:
+            A.mult(x, w)
+            w.owned[:] = b.owned - w.owned
+            beta = w.norm()
+            if not self._history:
+                self._history.append(beta)
+            if beta <= tolerance or self.iterations >= self._maxIterations:
+                self._converged = beta <= tolerance
+                break
+
+            V[0] = w.owned / beta
+            g = zeros(m+1)
+            g[0] = beta
+            j = 0
+            while j < m and self.iterations < self._maxIterations:
+                z.owned[:] = V[j]
+                M.apply(z, w)
+                if self._flexible:
+                    Z[j] = w.owned
+                A.mult(w, z)
+                # Classical Gram-Schmidt, twice
+                h = self.__dots(V[:j+1], z.owned)
+                z.owned[:] -= h.dot(V[:j+1])
+                correction = self.__dots(V[:j+1], z.owned)
+                z.owned[:] -= correction.dot(V[:j+1])
+                H[:j+1, j] = h + correction
+                H[j+1, j] = z.norm()
+                if H[j+1, j] > 0.0:
+                    V[j+1] = z.owned / H[j+1, j]
+
+                # Givens rotations keep H upper triangular
+                for it in range(j):
+                    H[it, j], H[it+1, j] = cs[it]*H[it, j] + sn[it]*H[it+1, j], -sn[it]*H[it, j] + cs[it]*H[it+1, j]
+                radius = hypot(H[j, j], H[j+1, j])
+                cs[j], sn[j] = (H[j, j]/radius, H[j+1, j]/radius) if radius > 0.0 else (1.0, 0.0)
+                H[j, j], H[j+1, j] = radius, 0.0
+                g[j], g[j+1] = cs[j]*g[j], -sn[j]*g[j]
+                j += 1
+                self._history.append(abs(g[j]))
+                if abs(g[j]) <= tolerance:
+                    break
+
+            # x += M^{-1} V y, or Z y with the stored preconditioned vectors
+            y = denseSolve(H[:j, :j], g[:j]) if j > 0 else zeros(0)
+            if self._flexible:
+                x.owned[:] += y.dot(Z[:j])
+            else:
+                w.owned[:] = y.dot(V[:j])
+                M.apply(w, z)
+                x.owned[:] += z.owned
+
+        self._solveTime = MPI.Wtime() - start
+        return x
+
+    def report(self):
+        status = "converged" if self._converged else "not converged"
+        name = "FGMRES" if self._flexible else "GMRES"
+        return f"{name}({self._restart}) {status} in {self.iterations} iterations, residual {self._history[0]:.3e} -> {self._history[-1]:.3e}, " \
+            f"{self._comm.Get_size()} procs, setup {self._setupTime:.3e}s, {self.timePerIteration:.3e}s per iteration"
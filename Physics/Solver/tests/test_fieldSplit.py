@@ -0,0 +1,100 @@
+from ..FieldSplit import FieldSplitPreconditioner, createBlockSolver
+from ..Newton import NewtonKrylov
+from ..Preconditioner import createPreconditioner
+from ..Solver import GMRES
+from ...Assembly.Coupled import HeatGeneration
+from ...Assembly.tests.test_coupled import helper_problem
+from ...BoundaryConditions.BoundaryConditions import DirichletCondition
+from ...DoFHandler.BlockDoFHandler import BlockDoFHandler
+from ...DoFHandler.DoFHandler import DoFHandler
+from ...Geometry.Geometry2D import Geometry2D
+from ...Quadrature.Quadrature import Quadrature2D
+import pytest
+from numpy import arange
+from scipy.sparse.linalg import spsolve
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("type, solvers, symmetric", [
+    ("additive", {"temperature": {"solver": "lu"}, "source": {"solver": "lu"}}, False),
+    ("multiplicative", {"temperature": {"solver": "lu"}, "source": {"solver": "lu"}}, True),
+    ("multiplicative", {"temperature": {"solver": "gmres", "rtol": 1.0e-6}, "source": {"solver": "preonly", "preconditioner": "jacobi"}}, False),
+    ("schur", {"temperature": {"solver": "lu"}, "source": {"solver": "cg", "rtol": 1.0e-4}}, False),
+])
+def test_fieldSplit(type, solvers, symmetric):
+    problem, J = helper_jacobian(4, 10.0)
+    M = createPreconditioner(J, "fieldsplit", indexSets=problem.dofs.indexSets, type=type, solvers=solvers, symmetric=symmetric)
+    assert M.block("temperature").gather().toarray() == pytest.approx(helper_globalBlock(problem, J, "temperature"))
+
+    b = J.createVector()
+    b.owned[:] = 1.0
+    solver = GMRES(J, M, rtol=1.0e-10, flexible=True)
+    x = solver.solve(b)
+    assert solver.converged, solver.report()
+    assert x.gather() == pytest.approx(spsolve(J.gather().tocsc(), b.gather()), rel=1.0e-7, abs=1.0e-10)
+    if type == "schur":
+        assert len(M.schurIterations) > 0
+
+@pytest.mark.mpi(max_size=4)
+def test_flatIterations():
+    # Exact block solves keep the outer iterations fixed under refinement and stronger coupling,
+    # while Jacobi grows with the mesh
+    iterations = {}
+    for n in [4, 8, 16]:
+        for heating in [1.0, 100.0]:
+            problem, J = helper_jacobian(n, heating)
+            b = J.createVector()
+            b.owned[:] = 1.0
+            for name, options in [("jacobi", {}),
+                                  ("multiplicative", {"type": "multiplicative"}),
+                                  ("schur", {"type": "schur"})]:
+                if options:
+                    options = {**options, "indexSets": problem.dofs.indexSets, "solvers": {it: {"solver": "lu"} for it in problem.fields}}
+                    M = FieldSplitPreconditioner(J, **options)
+                else:
+                    M = createPreconditioner(J, name)
+                solver = GMRES(J, M, rtol=1.0e-10, flexible=True, maxIterations=1000)
+                solver.solve(b)
+                assert solver.converged
+                iterations[name, n, heating] = solver.iterations
+
+    for heating in [1.0, 100.0]:
+        assert iterations["multiplicative", 4, heating] == iterations["multiplicative", 16, heating]
+        assert iterations["jacobi", 16, heating] > 2*iterations["jacobi", 4, heating]
+    assert max(iterations[key] for key in iterations if key[0] == "schur") <= 2
+    assert max(iterations[key] for key in iterations if key[0] == "multiplicative") <= 8
+
+@pytest.mark.mpi(max_size=4)
+def test_newtonFieldSplit():
+    problem, _ = helper_problem("split", (1, 2))
+    options = {"indexSets": problem.dofs.indexSets, "type": "schur",
+               "solvers": {"temperature": {"solver": "gmres", "preconditioner": "block-jacobi", "rtol": 1.0e-6}}}
+    solver = NewtonKrylov(problem, preconditioner="fieldsplit", preconditionerOptions=options, flexible=True, rtol=1.0e-10)
+    solver.solve(problem.createVector({"temperature": 1.0, "source": 0.0}))
+    assert solver.converged, solver.report()
+    assert max(solver.linearIterations) <= 3
+
+def test_unsupported():
+    problem, J = helper_jacobian(2, 1.0)
+    with pytest.raises(AssertionError):
+        FieldSplitPreconditioner(J, problem.dofs.indexSets, type="cyclic")
+    with pytest.raises(AssertionError):
+        FieldSplitPreconditioner(J, {"temperature": problem.dofs.indexSets["temperature"]})
+    with pytest.raises(RuntimeError):
+        createBlockSolver(J, solver="bicgstab")
+
+###################################################################################################
+# Helper functions
+###################################################################################################
+def helper_jacobian(n, heating):
+    geom = Geometry2D()
+    geom.readInternal(xExtent=(0,1), nX=n, yExtent=(0,1), nY=n)
+    fields = {"temperature": DoFHandler(geom, Quadrature2D(order=2)), "source": DoFHandler(geom, Quadrature2D(order=1))}
+    dofs = BlockDoFHandler(fields)
+    dirichlet = {name: DirichletCondition(fields[name], {"xneg": 1.0, "xpos": 2.0}) for name in fields}
+    problem = HeatGeneration(dofs, lambda T: 1.0 + T**2, lambda T: 2.0*T, lambda T: 1.0 + T**2, lambda T: 2.0*T,
+                             heating=heating, supply=1.0, dirichlet=dirichlet)
+    return problem, problem.jacobian(problem.createVector(1.5))
+
+def helper_globalBlock(problem, J, name):
+    rows = problem.dofs.blockNumbers(name, arange(problem.dofs.field(name).globalDoFsize))
+    return J.gather().toarray()[rows][:, rows]
@@ -0,0 +1,69 @@
+from ..Newton import NewtonKrylov, FiniteDifferenceJacobian
+from ...Assembly.Nonlinear import NonlinearDiffusion
+from ...BoundaryConditions.BoundaryConditions import DirichletCondition
+from ...DoFHandler.DoFHandler import DoFHandler
+from ...Geometry.Geometry2D import Geometry2D
+from ...Quadrature.Quadrature import Quadrature2D
+import pytest
+from numpy import arange, cos, searchsorted
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("options", [
+    {},
+    {"jacobianLag": 3, "preconditionerLag": 3},
+    {"jacobianFree": True, "preconditionerLag": 4},
+    {"jacobianFree": True, "preconditioner": "none"},
+    {"forcing": "constant", "eta": 1.0e-2, "preconditioner": "block-jacobi"},
+])
+def test_newtonKrylov(options):
+    problem, dofs, exact = helper_problem()
+    solver = NewtonKrylov(problem, rtol=1.0e-10, **options)
+    x = solver.solve(problem.createVector(1.0))
+    assert solver.converged, solver.report()
+    assert solver.residualHistory[-1] <= 1.0e-10 * solver.residualHistory[0]
+    assert len(solver.linearIterations) == solver.iterations
+
+    # T = 1 + x + y is in the discrete space and integrated exactly
+    solution = x.gather()
+    geom = dofs.geometry
+    vertices = dofs.localDoFIds < geom.globalNpoints
+    points = geom.localPoints[searchsorted(geom.localPointIds, dofs.localDoFIds[vertices])]
+    assert solution[dofs.dofMap[vertices]] == pytest.approx(exact(points[:,0], points[:,1]), abs=1.0e-8)
+
+    lags = max(options.get("jacobianLag", 1), options.get("preconditionerLag", 1))
+    if options.get("preconditioner") == "none":
+        assert solver.jacobianBuilds == 0
+    elif lags > 1:
+        assert solver.jacobianBuilds < solver.iterations or solver.preconditionerBuilds < solver.iterations
+
+@pytest.mark.mpi(max_size=4)
+def test_jacobian():
+    problem, _, _ = helper_problem()
+    x = problem.createVector(1.0)
+    x.owned[:] += 0.25*cos(arange(*problem.layout.ownedRange))
+    F = problem.residual(x)
+    J = problem.jacobian(x)
+
+    # The assembled Jacobian matches the finite difference product in directions that keep the
+    # constraints, where the symmetric elimination does not change the product
+    v = problem.createVector(1.0)
+    v.owned[:] -= problem.createVector(0.0).owned
+    fd = FiniteDifferenceJacobian(problem.residual, x, F).mult(v)
+    assembled = J.mult(v)
+    assert fd.gather() == pytest.approx(assembled.gather(), abs=1.0e-5)
+
+###################################################################################################
+# Helper functions
+###################################################################################################
+def helper_problem():
+    geom = Geometry2D()
+    geom.readInternal(xExtent=(0,2), nX=4, yExtent=(0,1), nY=4)
+    dofs = DoFHandler(geom, Quadrature2D(order=1))
+    dofs.renumberDoFs()
+
+    # -div(k(T) grad T) = Q with k = 1 + T^2 and T = 1 + x + y
+    exact = lambda x,y: 1.0 + x + y
+    bc = DirichletCondition(dofs, {name: exact for name in ["xneg", "xpos", "yneg", "ypos"]})
+    problem = NonlinearDiffusion(dofs, lambda T: 1.0 + T**2, lambda T: 2.0*T,
+                                 lambda x,y: -4.0*exact(x, y), dirichlet=bc)
+    return problem, dofs, exact
@@ -0,0 +1,25 @@
+from ..Picard import PicardSolver
+from ..Newton import NewtonKrylov
+from ...Assembly.tests.test_coupled import helper_problem, helper_vertexValues, helper_vertexExact
+import pytest
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("options", [
+    {},
+    {"order": ["source", "temperature"], "relaxation": 0.8},
+    {"fieldOptions": {"source": {"preconditioner": "block-jacobi", "rtol": 1.0e-6}}},
+])
+def test_picard(options):
+    problem, exact = helper_problem("split", (1, 2))
+    solver = PicardSolver(problem, rtol=1.0e-10, **options)
+    x = solver.solve(problem.createVector({"temperature": 1.0, "source": 0.0}))
+    assert solver.converged, solver.report()
+    assert solver.residualHistory[-1] <= 1.0e-10 * solver.residualHistory[0]
+    assert all(len(its) == solver.iterations for its in solver.fieldIterations.values())
+    for name in problem.fields:
+        assert helper_vertexValues(problem, x, name) == pytest.approx(helper_vertexExact(problem, name, exact), abs=1.0e-8)
+
+    # The coupled Newton solve reaches the same discrete solution
+    coupled = NewtonKrylov(problem, preconditioner="block-jacobi", rtol=1.0e-10)
+    y = coupled.solve(problem.createVector({"temperature": 1.0, "source": 0.0}))
+    assert x.gather() == pytest.approx(y.gather(), abs=1.0e-8)
@@ -0,0 +1,48 @@
+from ..Preconditioner import JacobiPreconditioner, BlockJacobiPreconditioner, ChebyshevPreconditioner, createPreconditioner, incompleteLU
+from .test_solver import helper_laplacian
+import pytest
+from numpy.linalg import eigvals
+from scipy.sparse import diags
+
+@pytest.mark.mpi(max_size=4)
+def test_jacobi():
+    A = helper_laplacian(6)
+    r = A.createVector()
+    r.owned[:] = 8.0
+    assert JacobiPreconditioner(A).apply(r).owned == pytest.approx([2.0]*len(r.owned))
+
+@pytest.mark.mpi(max_size=4)
+def test_blockJacobi():
+    A = helper_laplacian(6)
+    r = A.createVector()
+    r.owned[:] = 1.0
+    z = BlockJacobiPreconditioner(A, method="lu").apply(r)
+    assert A.diagonalBlock @ z.owned == pytest.approx(r.owned)
+    with pytest.raises(RuntimeError):
+        BlockJacobiPreconditioner(A, method="cholesky")
+
+def test_incompleteLU():
+    # No fill for a tridiagonal matrix: ILU(0) is the exact LU
+    A = diags([[-1.0]*5, [3.0]*6, [-2.0]*5], [-1, 0, 1], format="csr")
+    L, U = incompleteLU(A)
+    assert (L @ U).toarray() == pytest.approx(A.toarray())
+    assert L.diagonal() == pytest.approx([1.0]*6)
+
+    # Fill outside the pattern is dropped but the pattern entries match
+    B = helper_laplacian(5).gather()
+    L, U = incompleteLU(B)
+    product, mask = (L @ U).toarray(), B.toarray() != 0.0
+    assert product[mask] == pytest.approx(B.toarray()[mask])
+
+@pytest.mark.mpi(max_size=4)
+def test_chebyshevBounds():
+    A = helper_laplacian(8)
+    # D^{-1}A of the 5-point Laplacian has eigenvalues in (0, 2)
+    lambdaMax = max(eigvals(A.gather().toarray() / 4.0).real)
+    low, high = ChebyshevPreconditioner(A, powerIterations=30).eigenBounds
+    assert lambdaMax <= high <= 1.1*lambdaMax + 1.0e-12
+    assert low == pytest.approx(high / 30.0)
+
+def test_unknown():
+    with pytest.raises(RuntimeError):
+        createPreconditioner(helper_laplacian(4), "sor")
@@ -0,0 +1,102 @@
+from ..Solver import ConjugateGradient, GMRES
+from ..Preconditioner import createPreconditioner
+from ...LinearAlgebra.LinearAlgebra import ParallelLayout, DistributedMatrix
+import pytest
+from mpi4py import MPI
+from numpy import arange, array, concatenate, unique, ones, diff
+from scipy.sparse.linalg import spsolve
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("name, options", [
+    ("none", {}),
+    ("jacobi", {}),
+    ("block-jacobi", {"method": "lu"}),
+    ("block-jacobi", {"method": "ilu"}),
+    ("chebyshev", {"degree": 3}),
+    ("lu", {}),
+])
+def test_cg(name, options):
+    A = helper_laplacian(12)
+    b = A.createVector()
+    b.owned[:] = 1.0
+    solver = ConjugateGradient(A, createPreconditioner(A, name, **options), rtol=1.0e-10)
+    x = solver.solve(b)
+
+    assert solver.converged
+    assert solver.residualHistory[-1] <= 1.0e-10 * b.norm()
+    assert len(solver.residualHistory) == solver.iterations + 1
+    assert x.gather() == pytest.approx(spsolve(A.gather().tocsc(), b.gather()), rel=1.0e-8)
+    assert "converged" in solver.report()
+
+@pytest.mark.mpi(max_size=4)
+def test_preconditioned_iterations():
+    A = helper_laplacian(16)
+    b = A.createVector()
+    b.owned[:] = 1.0
+    iterations = {}
+    for name, options in [("none", {}), ("block-jacobi", {"method": "lu"}), ("chebyshev", {"degree": 4})]:
+        solver = ConjugateGradient(A, createPreconditioner(A, name, **options), rtol=1.0e-8)
+        solver.solve(b)
+        iterations[name] = solver.iterations
+    assert iterations["chebyshev"] < iterations["none"]
+    if MPI.COMM_WORLD.Get_size() == 1:
+        # A single block is the exact inverse
+        assert iterations["block-jacobi"] == 1
+
+def test_maxIterations():
+    A = helper_laplacian(12)
+    b = A.createVector()
+    b.owned[:] = 1.0
+    solver = ConjugateGradient(A, rtol=1.0e-12, maxIterations=3)
+    solver.solve(b)
+    assert not solver.converged and solver.iterations == 3
+
+@pytest.mark.mpi(max_size=4)
+@pytest.mark.parametrize("name, restart", [("none", 10), ("jacobi", 30), ("block-jacobi", 5)])
+def test_gmres(name, restart):
+    # Nonsymmetric: upwinded convection on top of the Laplacian
+    A = helper_laplacian(12)
+    data = A.localMatrix()
+    rows = arange(len(data.indptr)-1).repeat(diff(data.indptr)) + A.layout.ownedRange[0]
+    cols = concatenate([arange(*A.layout.ownedRange), A.layout.ghosts])[data.indices]
+    values = data.data.copy()
+    values[cols == rows - 1] -= 0.8
+    values[cols == rows] += 0.8
+    A.setValues(values)
+    assert abs(A.gather() - A.gather().T).max() > 0.1
+
+    b = A.createVector()
+    b.owned[:] = 1.0
+    solver = GMRES(A, createPreconditioner(A, name), rtol=1.0e-10, restart=restart)
+    x = solver.solve(b)
+    assert solver.converged
+    assert x.gather() == pytest.approx(spsolve(A.gather().tocsc(), b.gather()), rel=1.0e-7)
+    assert "GMRES" in solver.report()
+
+###################################################################################################
+# Helper functions
+###################################################################################################
+def helper_laplacian(n):
+    '''5-point Laplacian on an n x n grid, rows split into contiguous blocks over procs'''
+    comm = MPI.COMM_WORLD
+    rank, size = comm.Get_rank(), comm.Get_size()
+    N = n*n
+    ranges = array([(N*it)//size for it in range(size+1)])
+    rows = arange(ranges[rank], ranges[rank+1])
+    i, j = rows // n, rows % n
+
+    cols = [rows, rows-n, rows+n, rows-1, rows+1]
+    valid = [ones(len(rows), dtype=bool), i > 0, i < n-1, j > 0, j < n-1]
+    values = [4.0, -1.0, -1.0, -1.0, -1.0]
+    rowOf = concatenate([rows[v] for v in valid])
+    colOf = concatenate([c[v] for c,v in zip(cols, valid)])
+    valOf = concatenate([values[it] + 0.0*rows[v] for it,v in enumerate(valid)])
+
+    ghosts = unique(colOf[(colOf < ranges[rank]) | (colOf >= ranges[rank+1])])
+    layout = ParallelLayout(comm, ranges, ghosts)
+    local = layout.globalToLocal(colOf)
+    order = (rowOf - ranges[rank]) * (N + 1) + local
+    order = order.argsort()
+    counts = diff(concatenate([[0], (rowOf[order] - ranges[rank]).searchsorted(arange(len(rows)), side="right")]))
+    indptr = concatenate([[0], counts.cumsum()])
+    return DistributedMatrix(layout, indptr, local[order], valOf[order])
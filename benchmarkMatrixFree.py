@@ -0,0 +1,50 @@
+from Physics.Geometry.Geometry2D import Geometry2D
+from Physics.Quadrature.Quadrature import Quadrature2D
+from Physics.DoFHandler.DoFHandler import DoFHandler
+from Physics.Assembly.Assembly import ElementAssembler, DistributedAssembler
+from Physics.Assembly.MatrixFree import MatrixFreeLaplacian
+from mpi4py import MPI
+
+def run(nX=64, nY=64, repeats=20):
+    geom = Geometry2D()
+    geom.readInternal(nX=nX, nY=nY)
+    comm = geom.mpiComm
+
+    if geom.mpiRank == 0:
+        print(f"{nX}x{nY} cells on {geom.mpiSize} procs, {repeats} operator applications")
+        print(f"{'order':>5} {'DoFs':>9} {'CSR MB':>9} {'free MB':>9} {'CSR MDoF/s':>11} {'free MDoF/s':>12}")
+
+    for order in [1, 2, 3]:
+        dofs = DoFHandler(geom, Quadrature2D(order=order))
+        dofs.renumberDoFs()
+
+        A = DistributedAssembler(dofs).assembleMatrix(ElementAssembler(dofs).stiffnessMatrices())
+        blocks = [A.diagonalBlock, A.offDiagonalBlock]
+        assembledBytes = sum(m.data.nbytes + m.indices.nbytes + m.indptr.nbytes for m in blocks)
+        assembledTime = timeApplications(A, repeats)
+
+        operator = MatrixFreeLaplacian(dofs)
+        freeTime = timeApplications(operator, repeats)
+
+        assembledBytes = comm.allreduce(assembledBytes, op=MPI.SUM)
+        freeBytes = comm.allreduce(operator.nbytes, op=MPI.SUM)
+        throughput = lambda seconds: dofs.globalDoFsize * repeats / seconds / 1.0e6
+        if geom.mpiRank == 0:
+            print(f"{order:>5} {dofs.globalDoFsize:>9} {assembledBytes/2**20:>9.2f} {freeBytes/2**20:>9.2f} "
+                  f"{throughput(assembledTime):>11.2f} {throughput(freeTime):>12.2f}")
+
+def timeApplications(operator, repeats):
+    '''Slowest proc's wall time for repeated y = A x'''
+    x = operator.createVector()
+    x.owned[:] = 1.0
+    y = operator.createVector()
+    operator.mult(x, y)
+    comm = x.layout.comm
+    comm.Barrier()
+    start = MPI.Wtime()
+    for _ in range(repeats):
+        operator.mult(x, y)
+    return comm.allreduce(MPI.Wtime() - start, op=MPI.MAX)
+
+if __name__ == "__main__":
+    run()
@@ -1,9 +1,16 @@
 from Physics.Geometry.Geometry2D import Geometry2D
 from Physics.Quadrature.Quadrature import Quadrature2D
 from Physics.DoFHandler.DoFHandler import DoFHandler
-
-from numpy import array, zeros, outer, matmul
-from scipy.sparse import csr_array
+from Physics.Assembly.Assembly import ElementAssembler, DistributedAssembler
+from Physics.BoundaryConditions.BoundaryConditions import DirichletCondition
+from Physics.Solver.Solver import ConjugateGradient
+from Physics.Solver.Preconditioner import createPreconditioner
+from Physics.Solver.Newton import NewtonKrylov
+from Physics.Assembly.Nonlinear import NonlinearDiffusion
+from Physics.Assembly.Coupled import HeatGeneration
+from Physics.DoFHandler.BlockDoFHandler import BlockDoFHandler
+from Physics.Solver.Picard import PicardSolver
+from numpy import exp
 
 def run():
     geom = Geometry2D()
@@ -17,54 +24,82 @@ def run():
     # Setup DoFs
     quad = Quadrature2D(order=2)
     dofs = DoFHandler(geom, quad)
-    dofs.renumberDoFs()
+    report = dofs.renumberDoFs()
+    if geom.mpiRank == 0:
+        print(f"Renumbering: bandwidth {report['bandwidth'][0]} -> {report['bandwidth'][1]}, profile {report['profile'][0]} -> {report['profile'][1]}")
     dofs.buildSparsity()
     dofs.plotSparsity()
 
-    # Allocate Space for Matrix & RHS
-    row, col = dofs.sparsity
-    localA = csr_array(
-                    (array([0]*len(col), dtype="float64"), col, row),
-                    shape=(dofs.globalDoFsize,dofs.globalDoFsize)
-                )
-    localRHS = array([0]*dofs.globalDoFsize, dtype="float64")
+    # Construct Matrix & RHS (owned rows on every proc)
+    assembler = ElementAssembler(dofs)
+    distributed = DistributedAssembler(dofs)
+    A = distributed.assembleMatrix(assembler.stiffnessMatrices())
+    RHS = distributed.assembleVector(assembler.rhsVectors(calculate_Q))
 
-    # Construct Matrix & RHS
-    for it,_ in enumerate(dofs.dofConnectivity):
-        local_mat = zeros((dofs.dofsPerElement, dofs.dofsPerElement))
-        local_rhs = zeros(dofs.dofsPerElement)
+    # Dirichelt Boundary Conditions
+    bc = DirichletCondition(dofs, {"xneg": 0.0, "xpos": 0.0, "yneg": 0.0, "ypos": 0.0})
+    bc.apply(A, RHS)
 
-        for q_xi, q_eta, q_w in quad:
-            # Element to Reference Transformation
-            J = geom.localConnectivity[it].getJacobian(q_xi, q_eta)
-            J_inv = geom.localConnectivity[it].getInvJacobian(q_xi, q_eta)
-            detJ = J[0,0]*J[1,1] - J[0,1]*J[1,0]
-            symJ_inv = J_inv.dot(J_inv.T)
+    # Solve
+    solver = ConjugateGradient(A, createPreconditioner(A, "jacobi"), rtol=1.0e-10)
+    solution = solver.solve(RHS)
+    if geom.mpiRank == 0:
+        print(solver.report())
+            
+    # globalA = A.gather()
+    # if geom.mpiRank == 0:
+    #     print(globalA.toarray())
 
-            # Local Matrix Contribution [Stiffness]
-            localgrad = quad.get_local_grad_shape_vector((q_xi,q_eta))
-            stiffness = matmul(matmul(localgrad, symJ_inv), localgrad.T)
-            local_mat += stiffness * detJ * q_w
+def runNonlinear(jacobianLag=3, jacobianFree=True):
+    # Heat conduction with the temperature dependent conductivity of the design notes
+    geom = Geometry2D()
+    geom.readInternal(xExtent=(0,1), nX=16, yExtent=(0,1), nY=16)
+    dofs = DoFHandler(geom, Quadrature2D(order=2))
+    dofs.renumberDoFs()
 
-            # Local RHS Contribution
-            x_q, y_q = geom.localConnectivity[it].getPhysicalLocation(q_xi, q_eta)
-            Q_q = calculate_Q(x_q, y_q)
-            local_rhs += Q_q * quad.get_local_shape_vector((q_xi,q_eta)) * detJ * q_w
+    bc = DirichletCondition(dofs, {"xpos": 450.0})
+    problem = NonlinearDiffusion(dofs, calculate_k, calculate_dk, calculate_Q, dirichlet=bc)
+    solver = NewtonKrylov(problem, preconditioner="block-jacobi", jacobianLag=jacobianLag,
+                          preconditionerLag=jacobianLag, jacobianFree=jacobianFree, rtol=1.0e-10)
+    solution = solver.solve(problem.createVector(450.0))
+    if geom.mpiRank == 0:
+        print(solver.report())
+    return solution
 
-        # Update global system
-        for it,rhs in enumerate(local_rhs):
-            for jt,val in enumerate(local_mat[it]):
-                localA[dofs.dofMap[it],dofs.dofMap[jt]] += val
-            localRHS[dofs.dofMap[it]] += rhs
+def runCoupled(picard=False):
+    # Heat generated by a species whose consumption depends on the temperature, in place of
+    # the constant calculate_Q
+    geom = Geometry2D()
+    geom.readInternal(xExtent=(0,1), nX=16, yExtent=(0,1), nY=16)
+    fields = {"temperature": DoFHandler(geom, Quadrature2D(order=2)), "source": DoFHandler(geom, Quadrature2D(order=1))}
+    dofs = BlockDoFHandler(fields, numbering="split")
 
-    # Dirichelt Boundary Conditions
-    # TODO
-            
-    # if geom.mpiRank == 0:
-    #     print(localA.toarray())
+    dirichlet = {"temperature": DirichletCondition(fields["temperature"], {"xpos": 450.0}),
+                 "source": DirichletCondition(fields["source"], {"xneg": 11.2})}
+    problem = HeatGeneration(dofs, calculate_k, calculate_dk, lambda T: 1.0e-3*T, lambda T: 1.0e-3 + 0.0*T,
+                             heating=1.0, diffusivity=1.0, dirichlet=dirichlet)
+    initial = problem.createVector({"temperature": 450.0, "source": 11.2})
+    if picard:
+        solver = PicardSolver(problem, rtol=1.0e-10,
+                              fieldOptions={name: {"preconditioner": "block-jacobi"} for name in fields})
+    else:
+        solver = NewtonKrylov(problem, preconditioner="block-jacobi", rtol=1.0e-10)
+    solution = solver.solve(initial)
+    if geom.mpiRank == 0:
+        print(solver.report())
+    return solution
 
 def calculate_Q(x,y,z=0):
     return 11.2
+
+def calculate_k(T):
+    return 0.12 + 0.75*exp(-0.05*(T - 450.0)**2)
+
+def calculate_dk(T):
+    return -0.1*(T - 450.0)*0.75*exp(-0.05*(T - 450.0)**2)
             
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    run()
+    runNonlinear()
+    runCoupled()
+    runCoupled(picard=True)
\ No newline at end of file